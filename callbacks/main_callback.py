@@ -6,6 +6,7 @@ from callbacks.report_callbacks import handle_report_callback
 from callbacks.search_callbacks import handle_search_callback
 from callbacks.payment_callbacks import handle_payment_callback
 from decorators import authorized_required
+from utils.payment_reminder import render_payment_reminder
 
 logger = logging.getLogger(__name__)
 
@@ -50,18 +51,15 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         principal_12 = context.user_data.get('broadcast_principal_12', 0)
         outstanding_interest = context.user_data.get(
             'broadcast_outstanding_interest', 0)
-        date_str = context.user_data.get('broadcast_date_str', '')
-        weekday_str = context.user_data.get('broadcast_weekday_str', 'Friday')
+        due = context.user_data.get('broadcast_due_date')
 
         if principal_12 == 0:
             await query.answer("❌ 数据错误")
             return
 
-        message = (
-            f"Your next payment is due on {date_str} ({weekday_str}) "
-            f"for {principal_12:.2f} to defer the principal payment for one week.\n\n"
-            f"Your outstanding interest is {outstanding_interest:.2f}."
-        )
+        # 与本金版本使用同一个付款日
+        message = render_payment_reminder(
+            [principal_12], due, outstanding_interest=outstanding_interest, decimals=2)
 
         try:
             await context.bot.send_message(chat_id=query.message.chat_id, text=message)
@@ -70,8 +68,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
             # 清除临时数据
             context.user_data.pop('broadcast_principal_12', None)
             context.user_data.pop('broadcast_outstanding_interest', None)
-            context.user_data.pop('broadcast_date_str', None)
-            context.user_data.pop('broadcast_weekday_str', None)
+            context.user_data.pop('broadcast_due_date', None)
         except Exception as e:
             logger.error(f"发送播报消息失败: {e}", exc_info=True)
             await query.answer(f"❌ 发送失败: {e}")
@@ -81,8 +78,7 @@ async def button_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # 清除临时数据
         context.user_data.pop('broadcast_principal_12', None)
         context.user_data.pop('broadcast_outstanding_interest', None)
-        context.user_data.pop('broadcast_date_str', None)
-        context.user_data.pop('broadcast_weekday_str', None)
+        context.user_data.pop('broadcast_due_date', None)
     else:
         logger.warning(f"Unhandled callback data: {data}")
         await query.message.reply_text(f"⚠️ 未知的操作: {data}")
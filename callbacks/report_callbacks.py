@@ -5,7 +5,9 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import db_operations
 from utils.date_helpers import get_daily_period_date
-from handlers.report_handlers import generate_report_text
+from handlers.report_handlers import (
+    generate_report_text, generate_leaderboard_text, get_today_report_text
+)
 
 
 async def handle_report_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -191,11 +193,45 @@ async def handle_report_callback(update: Update, context: ContextTypes.DEFAULT_T
                 row = []
         if row:
             keyboard.append(row)
+        keyboard.append([
+            InlineKeyboardButton("🏆 今日排行", callback_data="report_leaderboard_today"),
+            InlineKeyboardButton("🏆 本月排行", callback_data="report_leaderboard_month"),
+        ])
         keyboard.append([InlineKeyboardButton(
             "🔙 返回", callback_data="report_view_today_ALL")])
         await query.edit_message_text("请选择归属ID查看报表:", reply_markup=InlineKeyboardMarkup(keyboard))
         return
 
+    if data.startswith("report_leaderboard_"):
+        # 所有归属ID并排对比（一次查询）
+        period_type = data[len("report_leaderboard_"):]
+        end_date = get_daily_period_date()
+        if period_type == 'month':
+            start_date = end_date[:8] + '01'
+        else:
+            period_type = 'today'
+            start_date = end_date
+
+        messages = await generate_leaderboard_text(period_type, start_date, end_date)
+        other = 'month' if period_type == 'today' else 'today'
+        keyboard = [
+            [InlineKeyboardButton(
+                "🏆 本月排行" if other == 'month' else "🏆 今日排行",
+                callback_data=f"report_leaderboard_{other}")],
+            [InlineKeyboardButton("🔙 返回", callback_data="report_menu_attribution")],
+        ]
+        # 第一条替换当前消息，超长部分追加发送，按钮放在最后一条
+        if len(messages) == 1:
+            await query.edit_message_text(
+                messages[0], parse_mode='HTML', reply_markup=InlineKeyboardMarkup(keyboard))
+            return
+        await query.edit_message_text(messages[0], parse_mode='HTML')
+        for i, text in enumerate(messages[1:], 1):
+            await query.message.reply_text(
+                text, parse_mode='HTML',
+                reply_markup=InlineKeyboardMarkup(keyboard) if i == len(messages) - 1 else None)
+        return
+
     if data == "report_search_orders":
         await query.message.reply_text(
             "🔍 查找订单\n\n"
@@ -252,6 +288,32 @@ async def handle_report_callback(update: Update, context: ContextTypes.DEFAULT_T
         return
 
     if data.startswith("report_change_to_"):
+        # 预览归属变更（不修改数据），确认后再执行
+        new_group_id = data[17:]  # 提取新的归属ID
+
+        orders = context.user_data.get('report_search_orders', [])
+        if not orders:
+            await query.answer("❌ 没有找到订单")
+            return
+
+        from handlers.attribution_handlers import (
+            preview_orders_attribution, format_attribution_preview)
+        preview = await preview_orders_attribution(orders, new_group_id)
+        if not preview:
+            await query.answer("❌ 预览失败")
+            return
+
+        keyboard = [[
+            InlineKeyboardButton("✅ 确认修改", callback_data=f"report_change_ok_{new_group_id}"),
+            InlineKeyboardButton("🔙 取消", callback_data="report_view_today_ALL")
+        ]]
+        await query.edit_message_text(
+            format_attribution_preview(preview, new_group_id),
+            reply_markup=InlineKeyboardMarkup(keyboard)
+        )
+        return
+
+    if data.startswith("report_change_ok_"):
         # 处理归属变更
         new_group_id = data[17:]  # 提取新的归属ID
 
@@ -298,8 +360,7 @@ async def handle_report_callback(update: Update, context: ContextTypes.DEFAULT_T
     group_id = None if group_id == 'ALL' else group_id
 
     if view_type == 'today':
-        date = get_daily_period_date()
-        report_text = await generate_report_text("today", date, date, group_id)
+        report_text = await get_today_report_text(get_daily_period_date(), group_id)
 
         keyboard = [
             [
@@ -1,6 +1,7 @@
 """配置管理模块"""
 import os
 import sys
+import hashlib
 import logging
 from pathlib import Path
 
@@ -60,3 +61,38 @@ def load_config():
 
 # 加载配置
 BOT_TOKEN, ADMIN_IDS = load_config()
+
+# 接收消息的方式：polling（长轮询，默认）或 webhook（内置 HTTP 服务器接收 Telegram 推送）
+UPDATE_MODE = os.getenv('UPDATE_MODE', 'polling').strip().lower()
+# Telegram 访问的公网地址（https://域名[:端口]），webhook 模式必填
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').strip().rstrip('/')
+# 本地监听地址和端口（平台通过 PORT 分配端口时自动使用）
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', os.getenv('PORT', '8443')))
+# 接收路径（不以 / 开头）
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram').strip('/')
+# Telegram 同时推送的最大连接数（1-100）
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))
+# 请求头 X-Telegram-Bot-Api-Secret-Token 的校验值，未设置时由 Token 派生
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or hashlib.sha256(
+    f"webhook:{BOT_TOKEN}".encode()).hexdigest()
+
+
+def get_webhook_options() -> dict:
+    """webhook 模式的启动参数（Application.run_webhook / Updater.start_webhook）"""
+    if UPDATE_MODE != 'webhook':
+        raise ValueError(f"UPDATE_MODE={UPDATE_MODE}，不是 webhook 模式")
+    if not WEBHOOK_URL:
+        raise ValueError(
+            "UPDATE_MODE=webhook 时必须设置 WEBHOOK_URL（Telegram 能访问的 https 地址）\n"
+            "   示例：WEBHOOK_URL='https://bot.example.com'")
+    if not 1 <= WEBHOOK_MAX_CONNECTIONS <= 100:
+        raise ValueError("WEBHOOK_MAX_CONNECTIONS 必须在 1-100 之间")
+    return {
+        'listen': WEBHOOK_LISTEN,
+        'port': WEBHOOK_PORT,
+        'url_path': WEBHOOK_PATH,
+        'webhook_url': f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+        'secret_token': WEBHOOK_SECRET,
+        'max_connections': WEBHOOK_MAX_CONNECTIONS,
+    }
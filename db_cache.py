@@ -0,0 +1,318 @@
+"""进程内缓存：由 db_operations 在写入时同步更新（write-through）"""
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+# 缓存配置（可通过环境变量调整）
+# 授权用户集合的过期时间（秒），过期后下一次检查会从数据库重新加载
+AUTH_CACHE_TTL = float(os.getenv('AUTH_CACHE_TTL', '300'))
+# 有效订单缓存的最大条目数（按 chat_id，LRU 淘汰）
+ORDER_CACHE_SIZE = int(os.getenv('ORDER_CACHE_SIZE', '2048'))
+# "该群没有有效订单" 的缓存时间（秒）
+ORDER_CACHE_NEGATIVE_TTL = float(os.getenv('ORDER_CACHE_NEGATIVE_TTL', '30'))
+# 报表区间统计缓存的最大条目数（按 (开始日期, 结束日期, 归属ID)）
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', '256'))
+
+
+class AuthorizedUserCache:
+    """授权员工集合
+
+    - 启动时整体加载，之后权限检查只查内存集合
+    - add_authorized_user / remove_authorized_user 提交后立即更新集合
+    - TTL 过期作为兜底（例如其他进程直接修改了数据库）
+    """
+
+    def __init__(self, ttl: float = AUTH_CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._users: Optional[set] = None
+        self._loaded_at = 0.0
+        # 每次增删都会递增，用于丢弃加载期间已过时的数据库快照
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+
+    def contains(self, user_id: int) -> Optional[bool]:
+        """返回是否授权；缓存未加载或已过期时返回 None（需要重新加载）"""
+        with self._lock:
+            if self._users is None or time.monotonic() - self._loaded_at > self.ttl:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return user_id in self._users
+
+    def version(self) -> int:
+        """读取数据库前调用，传给 load()"""
+        with self._lock:
+            return self._version
+
+    def load(self, user_ids: Iterable[int], version: Optional[int] = None):
+        """用数据库中的完整列表替换缓存（读取期间有增删时放弃本次结果）"""
+        with self._lock:
+            if version is not None and version != self._version:
+                return
+            self._users = set(user_ids)
+            self._loaded_at = time.monotonic()
+            self.loads += 1
+
+    def add(self, user_id: int):
+        with self._lock:
+            self._version += 1
+            if self._users is not None:
+                self._users.add(user_id)
+
+    def discard(self, user_id: int):
+        with self._lock:
+            self._version += 1
+            if self._users is not None:
+                self._users.discard(user_id)
+
+    def invalidate(self):
+        with self._lock:
+            self._version += 1
+            self._users = None
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._users) if self._users is not None else 0,
+                'hits': self.hits,
+                'misses': self.misses,
+                'loads': self.loads,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+class ActiveOrderCache:
+    """有效订单缓存（chat_id -> 订单，LRU，容量有限）
+
+    - 订单写入（创建、改金额、改状态、改归属）在同一写线程中提交后立即回写缓存
+    - "没有有效订单" 也会缓存，但只保留 negative_ttl 秒
+    - 读取数据库期间如有写入，放弃缓存本次读取结果，避免旧数据覆盖新数据
+    """
+
+    def __init__(self, max_size: int = ORDER_CACHE_SIZE,
+                 negative_ttl: float = ORDER_CACHE_NEGATIVE_TTL):
+        self.max_size = max(1, max_size)
+        self.negative_ttl = negative_ttl
+        self._lock = threading.Lock()
+        # chat_id -> (订单或None, 过期时间（仅空结果）)
+        self._entries: 'OrderedDict[int, Tuple[Optional[Dict], float]]' = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.negative_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, chat_id: int) -> Tuple[bool, Optional[Dict]]:
+        """返回 (是否命中, 订单副本或None)"""
+        with self._lock:
+            entry = self._entries.get(chat_id)
+            if entry is not None:
+                order, expires_at = entry
+                if order is not None:
+                    self._entries.move_to_end(chat_id)
+                    self.hits += 1
+                    return True, dict(order)
+                if time.monotonic() < expires_at:
+                    self.negative_hits += 1
+                    return True, None
+                del self._entries[chat_id]
+            self.misses += 1
+            return False, None
+
+    def version(self) -> int:
+        """读取数据库前调用，传给 put()"""
+        with self._lock:
+            return self._version
+
+    def put(self, chat_id: int, order: Optional[Dict], version: Optional[int] = None):
+        """
+        写入缓存（order 为 None 表示没有有效订单）
+        :param version: 读路径传入读取前的版本号；写路径不传，并使之前的读取结果作废
+        """
+        with self._lock:
+            if version is None:
+                self._version += 1
+            elif version != self._version:
+                return
+            expires_at = 0.0 if order is not None else time.monotonic() + self.negative_ttl
+            self._entries[chat_id] = (dict(order) if order is not None else None, expires_at)
+            self._entries.move_to_end(chat_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, chat_id: Optional[int] = None):
+        """删除指定群的缓存（不传则清空）"""
+        with self._lock:
+            self._version += 1
+            if chat_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(chat_id, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.negative_hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'negative_hits': self.negative_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_ratio': (self.hits + self.negative_hits) / total if total else 0.0,
+            }
+
+
+class ReportStatsCache:
+    """报表区间统计缓存（(开始日期, 结束日期, 归属ID) -> 统计结果，LRU）
+
+    日结数据写入提交后，只使包含该日期、且归属为全局或该归属的条目失效
+    """
+
+    def __init__(self, max_size: int = REPORT_CACHE_SIZE):
+        self.max_size = max(1, max_size)
+        self._lock = threading.Lock()
+        self._entries: 'OrderedDict[Tuple[str, str, Optional[str]], Dict]' = OrderedDict()
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple[str, str, Optional[str]]) -> Optional[Dict]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(value)
+
+    def version(self) -> int:
+        """读取数据库前调用，传给 put()"""
+        with self._lock:
+            return self._version
+
+    def put(self, key: Tuple[str, str, Optional[str]], value: Dict, version: int):
+        """写入缓存（读取期间有写入时放弃）"""
+        with self._lock:
+            if version != self._version:
+                return
+            self._entries[key] = dict(value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, date: str, group_ids: Iterable[Optional[str]]):
+        """使包含该日期的条目失效（group_ids 中的 None 表示全局）"""
+        group_ids = set(group_ids)
+        with self._lock:
+            self._version += 1
+            stale = [key for key in self._entries
+                     if key[0] <= date <= key[1] and key[2] in group_ids]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+class RenderedReportCache:
+    """预先生成的今日报表统计部分（(日期, 归属ID) -> 文本），只保留最新一天
+
+    日切时由日结任务生成新一天全局和各归属的文本；余额和时间在读取时填入，
+    日结数据写入提交后只使该日期的全局和对应归属条目失效
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._date: Optional[str] = None
+        self._entries: Dict[Optional[str], str] = {}
+        self._version = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, key: Tuple[str, Optional[str]]) -> Optional[str]:
+        date, group_id = key
+        with self._lock:
+            text = self._entries.get(group_id) if date == self._date else None
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+            return text
+
+    def version(self) -> int:
+        """生成报表前调用，传给 put()"""
+        with self._lock:
+            return self._version
+
+    def put(self, key: Tuple[str, Optional[str]], text: str, version: int):
+        """写入缓存（生成期间有统计写入时放弃）；写入新的一天时丢弃之前日期的条目"""
+        date, group_id = key
+        with self._lock:
+            if version != self._version:
+                return
+            if self._date is not None and date < self._date:
+                return
+            if date != self._date:
+                self._date = date
+                self._entries = {}
+            self._entries[group_id] = text
+
+    def invalidate(self, date: str, group_ids: Iterable[Optional[str]]):
+        """使该日期全局/对应归属的条目失效（group_ids 中的 None 表示全局）"""
+        with self._lock:
+            self._version += 1
+            if date != self._date:
+                return
+            for group_id in set(group_ids):
+                if self._entries.pop(group_id, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._version += 1
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'date': self._date,
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'invalidations': self.invalidations,
+                'hit_ratio': self.hits / total if total else 0.0,
+            }
+
+
+# 全局缓存实例
+authorized_users = AuthorizedUserCache()
+active_orders = ActiveOrderCache()
+report_stats = ReportStatsCache()
+rendered_reports = RenderedReportCache()
@@ -1,8 +1,15 @@
 import sqlite3
 import os
+import csv
+import gzip
+import json
 import asyncio
+from datetime import datetime, timedelta
 from typing import Optional, Dict, List, Tuple, Any
 from functools import wraps
+import db_pool
+import db_cache
+from constants import DAILY_ALLOWED_PREFIXES
 
 # 数据库文件路径 - 支持持久化存储
 DATA_DIR = os.getenv('DATA_DIR', os.path.dirname(os.path.abspath(__file__)))
@@ -11,44 +18,43 @@ DB_NAME = os.path.join(DATA_DIR, 'loan_bot.db')
 
 
 def get_connection():
-    """获取数据库连接"""
+    """获取数据库连接（一次性连接，供脚本和初始化使用）"""
     conn = sqlite3.connect(DB_NAME, check_same_thread=False)
     conn.row_factory = sqlite3.Row
     return conn
 
 
 def db_transaction(func):
-    """数据库事务装饰器: 异步执行，自动处理连接开启、提交、回滚和关闭"""
+    """数据库事务装饰器: 提交到写队列，与同一时间窗口内的其他写请求合并为一个事务提交"""
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        loop = asyncio.get_running_loop()
+        pool = db_pool.get_pool(DB_NAME)
 
-        def sync_work():
-            conn = get_connection()
+        def sync_work(conn):
             cursor = conn.cursor()
             try:
-                # 执行被装饰的同步函数
-                result = func(conn, cursor, *args, **kwargs)
-                return result
-            except Exception as e:
-                conn.rollback()
-                print(f"Database error in {func.__name__}: {e}")
-                return False
+                # 执行被装饰的同步函数（出错时写队列只回滚本请求）
+                return func(conn, cursor, *args, **kwargs)
             finally:
-                conn.close()
+                cursor.close()
 
-        return await loop.run_in_executor(None, sync_work)
+        try:
+            return await asyncio.wrap_future(pool.write_queue.submit(sync_work))
+        except Exception as e:
+            print(f"Database error in {func.__name__}: {e}")
+            return False
     return wrapper
 
 
 def db_query(func):
-    """数据库查询装饰器: 异步执行，自动处理连接开启和关闭"""
+    """数据库查询装饰器: 在读线程池中执行，复用线程内的长连接"""
     @wraps(func)
     async def wrapper(*args, **kwargs):
         loop = asyncio.get_running_loop()
+        pool = db_pool.get_pool(DB_NAME)
 
         def sync_work():
-            conn = get_connection()
+            conn = pool.reader_connection()
             cursor = conn.cursor()
             try:
                 return func(conn, cursor, *args, **kwargs)
@@ -56,11 +62,37 @@ def db_query(func):
                 print(f"Database query error in {func.__name__}: {e}")
                 raise e
             finally:
+                if conn.in_transaction:
+                    conn.rollback()
+                cursor.close()
+
+        return await loop.run_in_executor(pool.reader, sync_work)
+    return wrapper
+
+def db_export(func):
+    """数据导出装饰器: 在独立线程中使用独立的只读连接执行，长时间导出不占用读线程池"""
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        def sync_work():
+            conn = get_connection()
+            conn.execute('PRAGMA query_only = ON')
+            cursor = conn.cursor()
+            try:
+                return func(conn, cursor, *args, **kwargs)
+            except Exception as e:
+                print(f"Database export error in {func.__name__}: {e}")
+                raise e
+            finally:
+                cursor.close()
                 conn.close()
 
-        return await loop.run_in_executor(None, sync_work)
+        return await asyncio.to_thread(sync_work)
     return wrapper
 
+def get_write_stats() -> Dict:
+    """写队列的批次统计"""
+    return db_pool.get_pool(DB_NAME).write_queue.stats()
+
 # ========== 订单操作 ==========
 
 
@@ -84,21 +116,45 @@ def create_order(conn, cursor, order_data: Dict) -> bool:
             order_data['state']
         ))
         conn.commit()
+        _refresh_active_order(cursor, order_data['chat_id'])
         return True
     except sqlite3.IntegrityError as e:
         print(f"订单创建失败（重复）: {e}")
         return False
 
 
+# 状态条件写成字面量，才能命中部分索引 idx_orders_active_chat
+ACTIVE_ORDER_SQL = "SELECT * FROM orders WHERE chat_id = ? AND state NOT IN ('end', 'breach_end')"
+
+
+def _refresh_active_order(cursor, chat_id: int) -> Optional[Dict]:
+    """订单写入后读取该群最新的有效订单，整批提交后回写到缓存（在写线程中调用）"""
+    cursor.execute(ACTIVE_ORDER_SQL, (chat_id,))
+    row = cursor.fetchone()
+    order = dict(row) if row else None
+    db_pool.after_commit(lambda: db_cache.active_orders.put(chat_id, order))
+    return order
+
+
 @db_query
-def get_order_by_chat_id(conn, cursor, chat_id: int) -> Optional[Dict]:
-    """根据chat_id获取订单"""
-    cursor.execute('SELECT * FROM orders WHERE chat_id = ? AND state NOT IN (?, ?)',
-                   (chat_id, 'end', 'breach_end'))
+def _fetch_order_by_chat_id(conn, cursor, chat_id: int) -> Optional[Dict]:
+    """从数据库读取有效订单"""
+    cursor.execute(ACTIVE_ORDER_SQL, (chat_id,))
     row = cursor.fetchone()
     return dict(row) if row else None
 
 
+async def get_order_by_chat_id(chat_id: int) -> Optional[Dict]:
+    """根据chat_id获取订单（优先读缓存）"""
+    hit, order = db_cache.active_orders.get(chat_id)
+    if hit:
+        return order
+    version = db_cache.active_orders.version()
+    order = await _fetch_order_by_chat_id(chat_id)
+    db_cache.active_orders.put(chat_id, order, version)
+    return order
+
+
 @db_query
 def get_order_by_order_id(conn, cursor, order_id: str) -> Optional[Dict]:
     """根据order_id获取订单"""
@@ -107,42 +163,6 @@ def get_order_by_order_id(conn, cursor, order_id: str) -> Optional[Dict]:
     return dict(row) if row else None
 
 
-@db_transaction
-def update_order_amount(conn, cursor, chat_id: int, new_amount: float) -> bool:
-    """更新订单金额"""
-    cursor.execute('''
-    UPDATE orders 
-    SET amount = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE chat_id = ? AND state NOT IN (?, ?)
-    ''', (new_amount, chat_id, 'end', 'breach_end'))
-    conn.commit()
-    return cursor.rowcount > 0
-
-
-@db_transaction
-def update_order_state(conn, cursor, chat_id: int, new_state: str) -> bool:
-    """更新订单状态"""
-    cursor.execute('''
-    UPDATE orders 
-    SET state = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE chat_id = ? AND state NOT IN (?, ?)
-    ''', (new_state, chat_id, 'end', 'breach_end'))
-    conn.commit()
-    return cursor.rowcount > 0
-
-
-@db_transaction
-def update_order_group_id(conn, cursor, chat_id: int, new_group_id: str) -> bool:
-    """更新订单归属ID"""
-    cursor.execute('''
-    UPDATE orders 
-    SET group_id = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE chat_id = ?
-    ''', (new_group_id, chat_id))
-    conn.commit()
-    return cursor.rowcount > 0
-
-
 def delete_order_by_chat_id(chat_id: int) -> bool:
     """删除订单（标记为完成或违约完成时使用）"""
     return True
@@ -286,6 +306,33 @@ def search_orders_advanced_all_states(conn, cursor, criteria: Dict) -> List[Dict
     rows = cursor.fetchall()
     return [dict(row) for row in rows]
 
+
+# 可以发送付款提醒的订单状态
+REMINDER_ORDER_STATES = ('normal', 'overdue', 'breach')
+
+
+@db_query
+def get_reminder_orders(conn, cursor, weekday_group: Optional[str] = None,
+                        group_id: Optional[str] = None,
+                        states: Tuple[str, ...] = ('normal', 'overdue')) -> List[Dict]:
+    """付款提醒活动：一次查询选出符合条件的有效订单（chat_id、本金等，不排序）"""
+    states = tuple(s for s in states if s in REMINDER_ORDER_STATES)
+    if not states:
+        return []
+    query = f'''
+    SELECT chat_id, order_id, group_id, weekday_group, state, amount FROM orders
+    WHERE state IN ({','.join('?' * len(states))})
+    '''
+    params = list(states)
+    if weekday_group:
+        query += " AND weekday_group = ?"
+        params.append(weekday_group)
+    if group_id:
+        query += " AND group_id = ?"
+        params.append(group_id)
+    cursor.execute(query, params)
+    return [dict(row) for row in cursor.fetchall()]
+
 # ========== 财务数据操作 ==========
 
 
@@ -317,36 +364,10 @@ def get_financial_data(conn, cursor) -> Dict:
 
 @db_transaction
 def update_financial_data(conn, cursor, field: str, amount: float) -> bool:
-    """更新财务数据字段"""
-    # 先获取当前值
-    cursor.execute('SELECT * FROM financial_data ORDER BY id DESC LIMIT 1')
-    row = cursor.fetchone()
-    if not row:
-        # 如果不存在，创建新记录
-        cursor.execute('''
-        INSERT INTO financial_data (
-            valid_orders, valid_amount, liquid_funds,
-            new_clients, new_clients_amount,
-            old_clients, old_clients_amount,
-            interest, completed_orders, completed_amount,
-            breach_orders, breach_amount,
-            breach_end_orders, breach_end_amount
-        ) VALUES (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        ''')
-        conn.commit()
-        current_value = 0
-    else:
-        row_dict = dict(row)
-        current_value = row_dict.get(field, 0)
-
-    # 更新值
-    new_value = current_value + amount
-    # 使用参数化查询防止SQL注入
-    cursor.execute(f'''
-    UPDATE financial_data 
-    SET "{field}" = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE id = (SELECT id FROM financial_data ORDER BY id DESC LIMIT 1)
-    ''', (new_value,))
+    """更新财务数据字段（原子累加）"""
+    delta = StatsDelta()
+    delta.financial[field] = amount
+    _apply_stats_delta(cursor, delta)
     conn.commit()
     return True
 
@@ -392,38 +413,10 @@ def get_grouped_data(conn, cursor, group_id: Optional[str] = None) -> Dict:
 
 @db_transaction
 def update_grouped_data(conn, cursor, group_id: str, field: str, amount: float) -> bool:
-    """更新分组数据字段"""
-    # 检查分组是否存在
-    cursor.execute(
-        'SELECT * FROM grouped_data WHERE group_id = ?', (group_id,))
-    row = cursor.fetchone()
-
-    if not row:
-        # 如果不存在，创建新记录
-        cursor.execute('''
-        INSERT INTO grouped_data (
-            group_id, valid_orders, valid_amount, liquid_funds,
-            new_clients, new_clients_amount,
-            old_clients, old_clients_amount,
-            interest, completed_orders, completed_amount,
-            breach_orders, breach_amount,
-            breach_end_orders, breach_end_amount
-        ) VALUES (?, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        ''', (group_id,))
-        conn.commit()
-        current_value = 0
-    else:
-        row_dict = dict(row)
-        current_value = row_dict.get(field, 0)
-
-    # 更新值
-    new_value = current_value + amount
-    # 使用参数化查询防止SQL注入
-    cursor.execute(f'''
-    UPDATE grouped_data 
-    SET "{field}" = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE group_id = ?
-    ''', (new_value, group_id))
+    """更新分组数据字段（原子累加，分组不存在时自动创建）"""
+    delta = StatsDelta()
+    delta.grouped[group_id] = {field: amount}
+    _apply_stats_delta(cursor, delta)
     conn.commit()
     return True
 
@@ -438,6 +431,126 @@ def get_all_group_ids(conn, cursor) -> List[str]:
 
 # ========== 日结数据操作 ==========
 
+@db_transaction
+def close_day(conn, cursor, date: str) -> Dict:
+    """
+    日结：冻结该日期（之后提交的统计变动计入下一天），补全全局和各归属的日终存量
+    该日期或之后的日期已日结时不重复处理
+    :return: {'status': 'ok' | 'already_closed', 'stock': 日终存量列表}
+    """
+    cursor.execute('SELECT MAX(date) FROM day_closes')
+    closed = cursor.fetchone()[0]
+    if closed and date <= closed:
+        return {'status': 'already_closed', 'stock': _fetch_daily_stock(cursor, date)}
+
+    cursor.execute('INSERT INTO day_closes (date) VALUES (?)', (date,))
+    _fill_daily_stock(cursor, date)
+    conn.commit()
+    return {'status': 'ok', 'stock': _fetch_daily_stock(cursor, date)}
+
+
+def _fill_daily_stock(cursor, date: str):
+    """
+    为当天没有存量变动的全局/归属补一行日终存量：取该日期之前最近一行，
+    从没有存量变动的取当前存量；当天有变动的已由 _increment_stock 维护
+    """
+    columns = ', '.join(STOCK_FIELDS)
+    cursor.execute(f'''
+    INSERT INTO daily_stock (date, group_id, {columns})
+    SELECT ?, targets.group_id, {', '.join(
+        f"CASE WHEN s.id IS NOT NULL THEN s.{c} WHEN EXISTS ("
+        f"SELECT 1 FROM daily_stock WHERE group_id IS targets.group_id) THEN 0 "
+        f"ELSE targets.{c} END" for c in STOCK_FIELDS)}
+    FROM (
+        SELECT NULL AS group_id, {columns} FROM financial_data
+        WHERE id = (SELECT MAX(id) FROM financial_data)
+        UNION ALL
+        SELECT group_id, {columns} FROM grouped_data
+    ) targets
+    LEFT JOIN daily_stock s ON s.id = (
+        SELECT id FROM daily_stock
+        WHERE group_id IS targets.group_id AND date < ?
+        ORDER BY date DESC LIMIT 1
+    )
+    WHERE NOT EXISTS (
+        SELECT 1 FROM daily_stock WHERE group_id IS targets.group_id AND date = ?
+    )
+    ''', (date, date, date))
+
+
+def _fetch_daily_stock(cursor, date: str) -> List[Dict]:
+    cursor.execute(
+        'SELECT * FROM daily_stock WHERE date = ? ORDER BY group_id IS NOT NULL, group_id', (date,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+def _fetch_current_stock(cursor, group_id: Optional[str]) -> Dict:
+    """当前存量（financial_data / grouped_data）"""
+    columns = ', '.join(STOCK_FIELDS)
+    if group_id is None:
+        cursor.execute(
+            f'SELECT {columns} FROM financial_data WHERE id = (SELECT MAX(id) FROM financial_data)')
+    else:
+        cursor.execute(f'SELECT {columns} FROM grouped_data WHERE group_id = ?', (group_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else {field: 0 for field in STOCK_FIELDS}
+
+
+def _has_daily_stock(cursor, group_id: Optional[str]) -> bool:
+    cursor.execute('SELECT 1 FROM daily_stock WHERE group_id IS ? LIMIT 1', (group_id,))
+    return cursor.fetchone() is not None
+
+
+def _fetch_stock_as_of(cursor, date: str, group_id: Optional[str], inclusive: bool = True) -> Dict:
+    """
+    该日期（inclusive=False 时为该日期之前）最近一行日终存量
+    之前没有记录时为 0；从没有存量变动（只有升级前的存量）时为当前存量
+    """
+    cursor.execute(f'''
+    SELECT date, {', '.join(STOCK_FIELDS)} FROM daily_stock
+    WHERE group_id IS ? AND date {'<=' if inclusive else '<'} ?
+    ORDER BY date DESC LIMIT 1
+    ''', (group_id, date))
+    row = cursor.fetchone()
+    if row:
+        return dict(row)
+    if _has_daily_stock(cursor, group_id):
+        return {'date': None, **{field: 0 for field in STOCK_FIELDS}}
+    return {'date': None, **_fetch_current_stock(cursor, group_id)}
+
+
+@db_query
+def get_daily_stock(conn, cursor, date: str) -> List[Dict]:
+    """获取某天的日终存量（第一行为全局，其余按归属ID排序）"""
+    return _fetch_daily_stock(cursor, date)
+
+
+@db_query
+def get_last_closed_date(conn, cursor) -> Optional[str]:
+    """最后一个已日结的日期"""
+    cursor.execute('SELECT MAX(date) FROM day_closes')
+    return cursor.fetchone()[0]
+
+
+@db_query
+def get_stock_as_of(conn, cursor, date: str, group_id: Optional[str] = None) -> Dict:
+    """某天日终的存量（有效订单数、有效金额、流动资金），group_id 为 None 时为全局"""
+    return _fetch_stock_as_of(cursor, date, group_id)
+
+
+@db_query
+def get_stock_change(conn, cursor, start_date: str, end_date: str,
+                     group_id: Optional[str] = None) -> Dict:
+    """
+    区间的期初（start_date 前一天日终）、期末（end_date 日终）存量及变化
+    :return: {'opening', 'closing', 'change'}
+    """
+    opening = _fetch_stock_as_of(cursor, start_date, group_id, inclusive=False)
+    closing = _fetch_stock_as_of(cursor, end_date, group_id)
+    change = {field: closing[field] - opening[field] for field in STOCK_FIELDS}
+    return {'opening': opening, 'closing': closing, 'change': change}
+
+
 
 @db_query
 def get_daily_data(conn, cursor, date: str, group_id: Optional[str] = None) -> Dict:
@@ -475,106 +588,1167 @@ def get_daily_data(conn, cursor, date: str, group_id: Optional[str] = None) -> D
 
 @db_transaction
 def update_daily_data(conn, cursor, date: str, field: str, amount: float, group_id: Optional[str] = None) -> bool:
-    """更新日结数据字段"""
-    # 检查记录是否存在
-    if group_id:
+    """更新日结数据字段（原子累加，记录不存在时自动创建）"""
+    delta = StatsDelta(date)
+    delta.daily[group_id] = {field: amount}
+    _apply_stats_delta(cursor, delta)
+    conn.commit()
+    _invalidate_report_cache(delta)
+    return True
+
+
+def _stats_select(source: str) -> str:
+    """日结字段求和的 SELECT 子句"""
+    columns = ",\n        ".join(f"SUM({f}) as {f}" for f in DAILY_STATS_KEYS)
+    return f"SELECT\n        {columns}\n    FROM {source}"
+
+
+def _stats_row_to_dict(row) -> Dict:
+    """将求和结果转换为字典，None转为0"""
+    return {key: row[i] if row[i] is not None else 0
+            for i, key in enumerate(DAILY_STATS_KEYS)}
+
+
+async def get_stats_by_date_range(start_date: str, end_date: str, group_id: Optional[str] = None) -> Dict:
+    """根据日期范围聚合统计数据（按 (范围, 归属ID) 缓存，日结数据写入时失效）"""
+    key = (start_date, end_date, group_id)
+    cached = db_cache.report_stats.get(key)
+    if cached is not None:
+        return cached
+    version = db_cache.report_stats.version()
+    result = await _fetch_stats_by_date_range(start_date, end_date, group_id)
+    db_cache.report_stats.put(key, result, version)
+    return result
+
+
+def _date_range_union(start_date: str, end_date: str, group_clause: str,
+                      group_params: List, columns: str) -> Tuple[Optional[str], List]:
+    """
+    生成日期范围内汇总行 + 边缘日期的 UNION ALL 子查询
+    :param group_clause: 归属条件，如 'group_id IS ?' 或 'group_id IS NOT NULL'
+    :return: (子查询SQL, 参数)，范围为空时SQL为None
+    """
+    rollups, day_ranges = _plan_date_range(start_date, end_date)
+    parts = []
+    params = []
+    for period in ROLLUP_PERIODS:
+        starts = [period_start for p, period_start in rollups if p == period]
+        if starts:
+            parts.append(
+                f"SELECT {columns} FROM daily_rollups WHERE period = ? "
+                f"AND period_start IN ({', '.join('?' for _ in starts)}) AND {group_clause}")
+            params += [period] + starts + group_params
+    for range_start, range_end in day_ranges:
+        parts.append(
+            f"SELECT {columns} FROM daily_data WHERE date >= ? AND date <= ? AND {group_clause}")
+        params += [range_start, range_end] + group_params
+    if not parts:
+        return None, []
+    return f"({' UNION ALL '.join(parts)})", params
+
+
+@db_query
+def _fetch_stats_by_date_range(conn, cursor, start_date: str, end_date: str,
+                               group_id: Optional[str] = None) -> Dict:
+    """根据日期范围聚合统计数据：整月/整周读汇总行，其余边缘日期读 daily_data"""
+    source, params = _date_range_union(
+        start_date, end_date, 'group_id IS ?', [group_id], ', '.join(DAILY_STATS_KEYS))
+    if source is None:
+        return {key: 0 for key in DAILY_STATS_KEYS}
+    cursor.execute(_stats_select(source), params)
+    return _stats_row_to_dict(cursor.fetchone())
+
+
+@db_query
+def get_attribution_report(conn, cursor, start_date: str, end_date: str) -> List[Dict]:
+    """
+    一次查询获取所有归属ID的当前数据（grouped_data）和周期统计
+    :return: [{'group_id', 'current': 分组数据, 'period': 周期统计}]，按归属ID排序
+    """
+    source, params = _date_range_union(
+        start_date, end_date, 'group_id IS NOT NULL',
+        [], 'group_id, ' + ', '.join(DAILY_STATS_KEYS))
+    if source is None:
+        source = f"(SELECT NULL AS group_id, {', '.join('0 AS ' + k for k in DAILY_STATS_KEYS)} WHERE 0)"
+    period_columns = ', '.join(f"p.{k} AS p_{k}" for k in DAILY_STATS_KEYS)
+    sums = ', '.join(f"SUM({k}) AS {k}" for k in DAILY_STATS_KEYS)
+    cursor.execute(f'''
+    SELECT grouped_data.*, {period_columns}
+    FROM grouped_data
+    LEFT JOIN (SELECT group_id, {sums} FROM {source} GROUP BY group_id) p
+        ON p.group_id = grouped_data.group_id
+    ORDER BY grouped_data.group_id
+    ''', params)
+
+    result = []
+    for row in cursor.fetchall():
+        row = dict(row)
+        period = {k: row.pop(f"p_{k}") or 0 for k in DAILY_STATS_KEYS}
+        result.append({'group_id': row['group_id'], 'current': row, 'period': period})
+    return result
+
+# ========== 日结汇总（月/周 rollup） ==========
+
+# M: 自然月（period_start 为当月1日），W: 自然周（period_start 为周一）
+ROLLUP_PERIODS = ('M', 'W')
+
+
+def _parse_date(date_str: str):
+    try:
+        return datetime.strptime(date_str, '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return None
+
+
+def _rollup_keys(date_str: str) -> List[Tuple[str, str]]:
+    """某个日结日期所属的汇总行 [(period, period_start)]"""
+    day = _parse_date(date_str)
+    if day is None:
+        return []
+    return [
+        ('M', day.replace(day=1).isoformat()),
+        ('W', (day - timedelta(days=day.weekday())).isoformat()),
+    ]
+
+
+def _plan_date_range(start_date: str, end_date: str) -> Tuple[List[Tuple[str, str]], List[Tuple[str, str]]]:
+    """
+    把日期范围拆成汇总行 + 边缘日期区间
+    完整的月用月汇总；不完整的月内用完整的周汇总，剩余的天读 daily_data
+    每个不完整的月最多 4 个周汇总 + 2 段日期
+    :return: ([(period, period_start)], [(开始日期, 结束日期)])
+    """
+    start = _parse_date(start_date)
+    end = _parse_date(end_date)
+    if start is None or end is None:
+        # 非标准日期格式，直接按字符串范围读 daily_data
+        return [], [(start_date, end_date)]
+
+    rollups: List[Tuple[str, str]] = []
+    days: List[Tuple[str, str]] = []
+
+    def add_days(first, last):
+        if days and _parse_date(days[-1][1]) + timedelta(days=1) == first:
+            days[-1] = (days[-1][0], last.isoformat())
+        else:
+            days.append((first.isoformat(), last.isoformat()))
+
+    day = start
+    while day <= end:
+        month_start = day.replace(day=1)
+        month_end = (month_start + timedelta(days=32)).replace(day=1) - timedelta(days=1)
+        segment_end = min(end, month_end)
+        if day == month_start and segment_end == month_end:
+            rollups.append(('M', month_start.isoformat()))
+        else:
+            # 月内：开头到周一之前 + 完整的周 + 结尾剩余的天
+            week_start = day + timedelta(days=(7 - day.weekday()) % 7)
+            if week_start + timedelta(days=6) > segment_end:
+                add_days(day, segment_end)
+            else:
+                if day < week_start:
+                    add_days(day, week_start - timedelta(days=1))
+                while week_start + timedelta(days=6) <= segment_end:
+                    rollups.append(('W', week_start.isoformat()))
+                    week_start += timedelta(days=7)
+                if week_start <= segment_end:
+                    add_days(week_start, segment_end)
+        day = segment_end + timedelta(days=1)
+    return rollups, days
+
+
+def _increment_rollups(cursor, date: str, group_id: Optional[str], fields: Dict[str, float]):
+    """日结数据累加时同步累加所属的月/周汇总行"""
+    clause, values = _set_increment_clause(fields, DAILY_FIELDS)
+    sql = f'''
+    UPDATE daily_rollups
+    SET {clause}
+    WHERE period = ? AND period_start = ? AND group_id IS ?
+    '''
+    for period, period_start in _rollup_keys(date):
+        params = values + [period, period_start, group_id]
+        cursor.execute(sql, params)
+        if cursor.rowcount == 0:
+            cursor.execute(
+                'INSERT INTO daily_rollups (period, period_start, group_id) VALUES (?, ?, ?)',
+                (period, period_start, group_id))
+            cursor.execute(sql, params)
+
+
+def rebuild_daily_rollups(cursor):
+    """根据 daily_data 重新生成全部月/周汇总行（初始化及重建统计后调用）"""
+    columns = sorted(DAILY_FIELDS)
+    sums = ', '.join(f"SUM({c})" for c in columns)
+    # 只汇总标准格式的日期（与 _rollup_keys 一致）
+    valid_date = "date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+    period_starts = {
+        'M': "substr(date, 1, 7) || '-01'",
+        'W': "date(date, '-' || ((CAST(strftime('%w', date) AS INTEGER) + 6) % 7) || ' days')",
+    }
+    cursor.execute('DELETE FROM daily_rollups')
+    for period, period_start in period_starts.items():
+        cursor.execute(f'''
+        INSERT INTO daily_rollups (period, period_start, group_id, {', '.join(columns)})
+        SELECT '{period}', {period_start}, group_id, {sums}
+        FROM daily_data
+        WHERE {valid_date}
+        GROUP BY 2, group_id
+        ''')
+
+
+def _invalidate_report_cache(delta: 'StatsDelta'):
+    """统计变动提交后，使包含该日期的报表缓存失效"""
+    if delta.daily:
+        date, group_ids = delta.date, list(delta.daily.keys())
+        db_pool.after_commit(lambda: db_cache.report_stats.invalidate(date, group_ids))
+
+
+# ========== 统计变动（单事务批量写入） ==========
+
+# 可累加的统计字段（用于校验字段名，防止拼接SQL时注入）
+FINANCIAL_FIELDS = {
+    'valid_orders', 'valid_amount', 'liquid_funds',
+    'new_clients', 'new_clients_amount',
+    'old_clients', 'old_clients_amount',
+    'interest', 'completed_orders', 'completed_amount',
+    'breach_orders', 'breach_amount',
+    'breach_end_orders', 'breach_end_amount'
+}
+DAILY_FIELDS = {
+    'new_clients', 'new_clients_amount',
+    'old_clients', 'old_clients_amount',
+    'interest', 'completed_orders', 'completed_amount',
+    'breach_orders', 'breach_amount',
+    'breach_end_orders', 'breach_end_amount',
+    'liquid_flow', 'company_expenses', 'other_expenses'
+}
+# 存量字段：随全局/分组累计数据同步写入每天的 daily_stock
+STOCK_FIELDS = ('valid_orders', 'valid_amount', 'liquid_funds')
+# 报表中日结字段的顺序
+DAILY_STATS_KEYS = [
+    'new_clients', 'new_clients_amount',
+    'old_clients', 'old_clients_amount',
+    'interest',
+    'completed_orders', 'completed_amount',
+    'breach_orders', 'breach_amount',
+    'breach_end_orders', 'breach_end_amount',
+    'liquid_flow', 'company_expenses', 'other_expenses'
+]
+
+
+class StatsDelta:
+    """
+    一次业务事件产生的所有统计变动（全局、日结全局、日结分组、分组累计）
+    收集完成后通过 apply_stats_delta 在一个事务中应用，并追加一条 order_events 流水
+    """
+
+    def __init__(self, date: Optional[str] = None, event_type: str = 'stats'):
+        self.date = date
+        self.financial: Dict[str, float] = {}
+        # {group_id(None表示全局): {field: delta}}
+        self.daily: Dict[Optional[str], Dict[str, float]] = {}
+        self.grouped: Dict[str, Dict[str, float]] = {}
+        # 流水事件信息
+        self.event_type = event_type
+        self.order_id: Optional[str] = None
+        self.chat_id: Optional[int] = None
+        self.group_id: Optional[str] = None
+        self.amount: float = 0
+        self.note: Optional[str] = None
+
+    def for_event(self, event_type: str, order: Optional[Dict] = None,
+                  amount: float = 0, note: Optional[str] = None) -> 'StatsDelta':
+        """设置产生本次变动的业务事件（写入 order_events）"""
+        self.event_type = event_type
+        if order:
+            self.order_id = order.get('order_id')
+            self.chat_id = order.get('chat_id')
+            self.group_id = order.get('group_id')
+        self.amount = amount
+        self.note = note
+        return self
+
+    @staticmethod
+    def _add(target: Dict[str, float], field: str, value: float):
+        target[field] = target.get(field, 0) + value
+
+    def add(self, field: str, amount: float, count: int = 0, group_id: Optional[str] = None) -> 'StatsDelta':
+        """
+        添加一组变动（字段映射规则与 update_all_stats 一致）
+        :param field: 基础字段名（如 'valid'、'new_clients'）或完整字段名
+        """
+        global_amount_field = field if field.endswith('_amount') or field in [
+            'liquid_funds', 'interest'] else f"{field}_amount"
+        global_count_field = field if field.endswith('_orders') or field in [
+            'new_clients', 'old_clients'] else f"{field}_orders"
+
+        # 1. 全局财务数据
+        if amount != 0:
+            self._add(self.financial, global_amount_field, amount)
+        if count != 0:
+            self._add(self.financial, global_count_field, count)
+
+        # 2. 日结数据（只包含流量数据，不包含存量）
+        is_daily_field = any(field.startswith(prefix)
+                             for prefix in DAILY_ALLOWED_PREFIXES)
+        if is_daily_field and (amount != 0 or count != 0):
+            if not self.date:
+                raise ValueError("日结统计变动需要指定日期")
+            daily_amount_field = field if field.endswith(
+                '_amount') or field == 'interest' else f"{field}_amount"
+            targets = [None] + ([group_id] if group_id else [])
+            for target_group in targets:
+                fields = self.daily.setdefault(target_group, {})
+                if amount != 0:
+                    self._add(fields, daily_amount_field, amount)
+                if count != 0:
+                    self._add(fields, global_count_field, count)
+
+        # 3. 分组累计数据（字段与全局表一致）
+        if group_id:
+            fields = self.grouped.setdefault(group_id, {})
+            if amount != 0:
+                self._add(fields, global_amount_field, amount)
+            if count != 0:
+                self._add(fields, global_count_field, count)
+        return self
+
+    def add_liquid(self, amount: float) -> 'StatsDelta':
+        """流动资金变动（全局余额 + 全局日结流量）"""
+        if amount != 0:
+            if not self.date:
+                raise ValueError("日结统计变动需要指定日期")
+            self._add(self.financial, 'liquid_funds', amount)
+            self._add(self.daily.setdefault(None, {}), 'liquid_flow', amount)
+        return self
+
+    def add_expense(self, expense_type: str, amount: float) -> 'StatsDelta':
+        """开销：计入全局日结开销，并扣除全局流动资金"""
+        if not self.date:
+            raise ValueError("日结统计变动需要指定日期")
+        field = 'company_expenses' if expense_type == 'company' else 'other_expenses'
+        self._add(self.daily.setdefault(None, {}), field, amount)
+        self._add(self.financial, 'liquid_funds', -amount)
+        return self
+
+    def is_empty(self) -> bool:
+        return not (self.financial or self.daily or self.grouped)
+
+    def to_json(self) -> str:
+        """序列化统计变动（日结的 group_id 可能为 None，使用列表保存）"""
+        return json.dumps({
+            'financial': self.financial,
+            'daily': [[group_id, fields] for group_id, fields in self.daily.items()],
+            'grouped': self.grouped
+        }, ensure_ascii=False)
+
+
+def _set_increment_clause(fields: Dict[str, float], allowed: set) -> Tuple[str, List[float]]:
+    """生成 SET col = col + ? 子句"""
+    for field in fields:
+        if field not in allowed:
+            raise ValueError(f"Unknown stats field: {field}")
+    clause = ", ".join(f'"{field}" = "{field}" + ?' for field in fields)
+    return clause, list(fields.values())
+
+
+def _increment_financial(cursor, fields: Dict[str, float]):
+    """原子累加全局财务数据"""
+    clause, values = _set_increment_clause(fields, FINANCIAL_FIELDS)
+    sql = f'''
+    UPDATE financial_data
+    SET {clause}, updated_at = CURRENT_TIMESTAMP
+    WHERE id = (SELECT MAX(id) FROM financial_data)
+    '''
+    cursor.execute(sql, values)
+    if cursor.rowcount == 0:
+        cursor.execute('INSERT INTO financial_data DEFAULT VALUES')
+        cursor.execute(sql, values)
+
+
+def _increment_daily(cursor, date: str, group_id: Optional[str], fields: Dict[str, float]):
+    """原子累加日结数据（记录不存在时先创建）"""
+    clause, values = _set_increment_clause(fields, DAILY_FIELDS)
+    sql = f'''
+    UPDATE daily_data
+    SET {clause}, updated_at = CURRENT_TIMESTAMP
+    WHERE date = ? AND group_id IS ?
+    '''
+    params = values + [date, group_id]
+    cursor.execute(sql, params)
+    if cursor.rowcount == 0:
         cursor.execute(
-            'SELECT * FROM daily_data WHERE date = ? AND group_id = ?', (date, group_id))
-    else:
+            'INSERT INTO daily_data (date, group_id) VALUES (?, ?)', (date, group_id))
+        cursor.execute(sql, params)
+    _increment_rollups(cursor, date, group_id, fields)
+
+
+def _increment_grouped(cursor, group_id: str, fields: Dict[str, float]):
+    """原子累加分组数据（记录不存在时先创建）"""
+    cursor.execute(
+        'INSERT OR IGNORE INTO grouped_data (group_id) VALUES (?)', (group_id,))
+    if not fields:
+        return
+    clause, values = _set_increment_clause(fields, FINANCIAL_FIELDS)
+    cursor.execute(f'''
+    UPDATE grouped_data
+    SET {clause}, updated_at = CURRENT_TIMESTAMP
+    WHERE group_id = ?
+    ''', values + [group_id])
+
+
+def _stock_fields(fields: Dict[str, float]) -> Dict[str, float]:
+    return {field: value for field, value in fields.items() if field in STOCK_FIELDS and value}
+
+
+def _increment_stock(cursor, date: str, group_id: Optional[str], fields: Dict[str, float]):
+    """
+    存量变动同步累加到 daily_stock（在累计数据累加之后调用）：
+    该日期还没有记录时先复制之前最近一天的存量，再累加该日期及之后的每一行
+    （变动按当前日结日期写入时只有一行）；第一次存量变动直接从当前存量开始
+    """
+    columns = ', '.join(STOCK_FIELDS)
+    cursor.execute(f'''
+    SELECT date, {columns} FROM daily_stock
+    WHERE group_id IS ? AND date <= ?
+    ORDER BY date DESC LIMIT 1
+    ''', (group_id, date))
+    row = cursor.fetchone()
+    if row is None and not _has_daily_stock(cursor, group_id):
+        current = _fetch_current_stock(cursor, group_id)
         cursor.execute(
-            'SELECT * FROM daily_data WHERE date = ? AND group_id IS NULL', (date,))
+            f"INSERT INTO daily_stock (date, group_id, {columns}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in STOCK_FIELDS)})",
+            [date, group_id] + [current[field] for field in STOCK_FIELDS])
+        return
+    if row is None or row['date'] != date:
+        # 写入早于最早一行的日期时，之前的存量按 0 计
+        previous = [row[field] for field in STOCK_FIELDS] if row else [0] * len(STOCK_FIELDS)
+        cursor.execute(
+            f"INSERT INTO daily_stock (date, group_id, {columns}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in STOCK_FIELDS)})",
+            [date, group_id] + previous)
+    clause, values = _set_increment_clause(fields, set(STOCK_FIELDS))
+    cursor.execute(f'''
+    UPDATE daily_stock
+    SET {clause}
+    WHERE group_id IS ? AND date >= ?
+    ''', values + [group_id, date])
+
+
+def rebuild_daily_stock(cursor) -> int:
+    """
+    根据当前存量和 order_events 流水重新生成 daily_stock（升级及重建统计后调用）
+    某天的日终存量 = 当前存量 - 该日期之后的存量变动，已日结的日期补全全部归属
+    :return: 有存量变动的（日期, 归属）数
+    """
+    columns = ', '.join(STOCK_FIELDS)
+    cursor.execute(
+        f'SELECT {columns} FROM financial_data WHERE id = (SELECT MAX(id) FROM financial_data)')
+    row = cursor.fetchone()
+    current: Dict[Optional[str], List[float]] = {
+        None: list(row) if row else [0] * len(STOCK_FIELDS)}
+    cursor.execute(f'SELECT group_id, {columns} FROM grouped_data')
+    for row in cursor.fetchall():
+        current[row[0]] = list(row[1:])
+
+    # {group_id(None表示全局): {date: {field: delta}}}
+    changes: Dict[Optional[str], Dict[str, Dict[str, float]]] = {}
+    valid_date = "date GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'"
+    reader = cursor.connection.execute(
+        f'SELECT date, deltas FROM order_events WHERE {valid_date} ORDER BY id')
+    while True:
+        rows = reader.fetchmany(1000)
+        if not rows:
+            break
+        for date, deltas in rows:
+            data = json.loads(deltas)
+            targets = [(None, data.get('financial', {}))] + list(data.get('grouped', {}).items())
+            for group_id, fields in targets:
+                fields = _stock_fields(fields)
+                if fields:
+                    _fold_deltas(changes.setdefault(group_id, {}).setdefault(date, {}), fields)
+    reader.close()
+
+    # 没有存量变动的全局/归属不写入，查询时取当前存量
+    rows = []
+    for group_id, dates in changes.items():
+        level = list(current.get(group_id, [0] * len(STOCK_FIELDS)))
+        for date in sorted(dates, reverse=True):
+            rows.append([date, group_id] + level)
+            level = [value - dates[date].get(field, 0) for field, value in zip(STOCK_FIELDS, level)]
+
+    cursor.execute('DELETE FROM daily_stock')
+    cursor.executemany(
+        f"INSERT INTO daily_stock (date, group_id, {columns}) "
+        f"VALUES (?, ?, {', '.join('?' for _ in STOCK_FIELDS)})", rows)
+    cursor.execute('SELECT date FROM day_closes ORDER BY date')
+    for (date,) in cursor.fetchall():
+        _fill_daily_stock(cursor, date)
+    return sum(len(dates) for dates in changes.values())
+
+
+def _append_order_event(cursor, delta: StatsDelta):
+    """追加一条流水记录"""
+    cursor.execute('''
+    INSERT INTO order_events (
+        event_type, order_id, chat_id, group_id, date, amount, note, deltas
+    ) VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', (
+        delta.event_type, delta.order_id, delta.chat_id, delta.group_id,
+        delta.date, delta.amount, delta.note, delta.to_json()
+    ))
+
+
+def _open_period_date(cursor, date: str) -> str:
+    """已日结的日期不再写入：日切后才提交的变动计入最后一个日结日期的下一天"""
+    cursor.execute('SELECT MAX(date) FROM day_closes')
+    closed = cursor.fetchone()[0]
+    if closed and date <= closed:
+        return (datetime.strptime(closed, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+    return date
+
+
+def _apply_stats_delta(cursor, delta: StatsDelta):
+    """在当前事务中应用统计变动并写入流水（不提交），提交后该日期预先生成的报表失效"""
+    stock = [(None, _stock_fields(delta.financial))] + [
+        (group_id, _stock_fields(fields)) for group_id, fields in delta.grouped.items()]
+    stock = [(group_id, fields) for group_id, fields in stock if fields]
+    if stock and not delta.date:
+        # 没有指定日期的存量变动（如手动调整余额）计入当前日结日期
+        from utils.date_helpers import get_daily_period_date
+        delta.date = get_daily_period_date()
+    if delta.date:
+        delta.date = _open_period_date(cursor, delta.date)
+    _append_order_event(cursor, delta)
+    if delta.financial:
+        _increment_financial(cursor, delta.financial)
+    for group_id, fields in delta.daily.items():
+        if fields:
+            _increment_daily(cursor, delta.date, group_id, fields)
+    for group_id, fields in delta.grouped.items():
+        _increment_grouped(cursor, group_id, fields)
+    for group_id, fields in stock:
+        _increment_stock(cursor, delta.date, group_id, fields)
+    # 预先生成的今日报表只包含日结数据（余额在读取时填入）
+    if delta.daily:
+        date, group_ids = delta.date, list(delta.daily.keys())
+        db_pool.after_commit(lambda: db_cache.rendered_reports.invalidate(date, group_ids))
+
+
+@db_transaction
+def apply_stats_delta(conn, cursor, delta: StatsDelta) -> bool:
+    """在一个事务中应用一次业务事件的全部统计变动"""
+    # 没有变动也没有业务事件信息时无需写入
+    if delta.is_empty() and delta.event_type == 'stats':
+        return True
+    _apply_stats_delta(cursor, delta)
+    conn.commit()
+    _invalidate_report_cache(delta)
+    return True
+
+# ========== 订单命令（订单变更 + 统计变动在一个事务中） ==========
+#
+# 每个命令在写线程的同一个连接上：读取并校验订单 -> 修改订单 -> 应用统计变动 -> 提交，
+# 返回 {'status', 'order', 'financial', 'grouped'}，处理器无需再查询余额。
+# status: ok / no_order / invalid_state / invalid_amount / insufficient_funds / duplicate
+
+# 计入有效订单统计的状态
+VALID_ORDER_STATES = ('normal', 'overdue')
+# 未完成订单的状态
+ACTIVE_ORDER_STATES = ('normal', 'overdue', 'breach')
 
+
+def _command_result(cursor, status: str, order: Optional[Dict] = None) -> Dict:
+    """命令结果：订单 + 最新全局余额 + 订单归属的分组余额"""
+    cursor.execute('SELECT * FROM financial_data WHERE id = (SELECT MAX(id) FROM financial_data)')
     row = cursor.fetchone()
+    financial = dict(row) if row else {}
+    grouped = None
+    if order:
+        cursor.execute('SELECT * FROM grouped_data WHERE group_id = ?', (order['group_id'],))
+        row = cursor.fetchone()
+        grouped = dict(row) if row else None
+    return {'status': status, 'order': order, 'financial': financial, 'grouped': grouped}
+
 
+def _fetch_order_row(cursor, order_pk: int) -> Dict:
+    cursor.execute('SELECT * FROM orders WHERE id = ?', (order_pk,))
+    return dict(cursor.fetchone())
+
+
+def _commit_order_command(conn, cursor, order: Dict, delta: StatsDelta) -> Dict:
+    """应用统计变动并提交，整批提交后刷新订单缓存和报表缓存"""
+    _apply_stats_delta(cursor, delta)
+    conn.commit()
+    _invalidate_report_cache(delta)
+    _refresh_active_order(cursor, order['chat_id'])
+    return _command_result(cursor, 'ok', _fetch_order_row(cursor, order['id']))
+
+
+def _add_state_transition(delta: StatsDelta, order: Dict, target_state: str):
+    """
+    状态变更的统计迁移
+    Normal/Overdue -> End: 有效 -> 完成，流动资金增加
+    Normal/Overdue -> Breach: 有效 -> 违约
+    Breach -> Normal/Overdue: 违约 -> 有效
+    Normal <-> Overdue: 都在有效统计下，仅记流水
+    """
+    current_state = order['state']
+    amount = order['amount']
+    group_id = order['group_id']
+    if current_state in VALID_ORDER_STATES:
+        if target_state == 'end':
+            delta.add('valid', -amount, -1, group_id)
+            delta.add('completed', amount, 1, group_id)
+            delta.add_liquid(amount)
+        elif target_state == 'breach':
+            delta.add('valid', -amount, -1, group_id)
+            delta.add('breach', amount, 1, group_id)
+    elif current_state == 'breach' and target_state in VALID_ORDER_STATES:
+        delta.add('breach', -amount, -1, group_id)
+        delta.add('valid', amount, 1, group_id)
+
+
+def _change_order_state(conn, cursor, date: str, chat_id: int, target_state: str,
+                        allowed_states: Tuple[str, ...], note: Optional[str] = None) -> Dict:
+    """校验当前状态并变更订单状态（违约完成除外）"""
+    cursor.execute(ACTIVE_ORDER_SQL, (chat_id,))
+    row = cursor.fetchone()
     if not row:
-        # 如果不存在，创建新记录
+        return _command_result(cursor, 'no_order')
+    order = dict(row)
+    if order['state'] not in allowed_states or order['state'] == target_state:
+        return _command_result(cursor, 'invalid_state', order)
+
+    cursor.execute('''
+    UPDATE orders SET state = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (target_state, order['id']))
+    transition = f"{order['state']}->{target_state}"
+    delta = StatsDelta(date).for_event(
+        'state_change', order, order['amount'],
+        f"{transition} ({note})" if note else transition)
+    _add_state_transition(delta, order, target_state)
+    return _commit_order_command(conn, cursor, order, delta)
+
+
+@db_transaction
+def open_order(conn, cursor, date: str, order_data: Dict, historical: bool = False) -> Dict:
+    """
+    创建订单并记账（有效/违约统计；非历史订单同时扣除流动资金、计入新老客户统计）
+    非历史订单在同一事务中检查流动资金是否足够
+    """
+    cursor.execute(ACTIVE_ORDER_SQL, (order_data['chat_id'],))
+    row = cursor.fetchone()
+    if row:
+        return _command_result(cursor, 'duplicate', dict(row))
+
+    amount = order_data['amount']
+    if not historical:
+        cursor.execute(
+            'SELECT liquid_funds FROM financial_data WHERE id = (SELECT MAX(id) FROM financial_data)')
+        row = cursor.fetchone()
+        if (row['liquid_funds'] if row else 0) < amount:
+            return _command_result(cursor, 'insufficient_funds')
+
+    try:
+        # 历史订单按导入当天作为最近付款日，逾期扫描从下一个付款周期开始判断
         cursor.execute('''
-        INSERT INTO daily_data (
-            date, group_id, new_clients, new_clients_amount,
-            old_clients, old_clients_amount,
-            interest, completed_orders, completed_amount,
-            breach_orders, breach_amount,
-            breach_end_orders, breach_end_amount,
-            liquid_flow, company_expenses, other_expenses
-        ) VALUES (?, ?, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        ''', (date, group_id))
-        conn.commit()
-        current_value = 0
+        INSERT INTO orders (
+            order_id, group_id, chat_id, date, weekday_group,
+            customer, amount, state, last_payment_date
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', (
+            order_data['order_id'],
+            order_data['group_id'],
+            order_data['chat_id'],
+            order_data['date'],
+            order_data['group'],
+            order_data['customer'],
+            amount,
+            order_data['state'],
+            date if historical else None
+        ))
+    except sqlite3.IntegrityError as e:
+        print(f"订单创建失败（重复）: {e}")
+        return _command_result(cursor, 'duplicate')
+    order = _fetch_order_row(cursor, cursor.lastrowid)
+
+    group_id = order['group_id']
+    delta = StatsDelta(date).for_event(
+        'create', order, amount, 'historical' if historical else None)
+    # 根据初始状态计入 Valid 或 Breach
+    if order['state'] == 'breach':
+        delta.add('breach', amount, 1, group_id)
     else:
-        row_dict = dict(row)
-        current_value = row_dict.get(field, 0)
+        delta.add('valid', amount, 1, group_id)
+    if not historical:
+        delta.add_liquid(-amount)
+        client_field = 'new_clients' if order['customer'] == 'A' else 'old_clients'
+        delta.add(client_field, amount, 1, group_id)
+    return _commit_order_command(conn, cursor, order, delta)
 
-    # 更新值
-    new_value = current_value + amount
-    if group_id:
-        cursor.execute(f'''
-        UPDATE daily_data 
-        SET "{field}" = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE date = ? AND group_id = ?
-        ''', (new_value, date, group_id))
-    else:
-        cursor.execute(f'''
-        UPDATE daily_data 
-        SET "{field}" = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE date = ? AND group_id IS NULL
-        ''', (new_value, date))
 
-    conn.commit()
-    return True
+@db_transaction
+def set_order_state(conn, cursor, date: str, chat_id: int, target_state: str,
+                    allowed_states: Tuple[str, ...] = ACTIVE_ORDER_STATES,
+                    note: Optional[str] = None) -> Dict:
+    """变更订单状态（normal / overdue / breach 之间），统计在有效和违约之间迁移"""
+    return _change_order_state(conn, cursor, date, chat_id, target_state, allowed_states, note)
 
 
-@db_query
-def get_stats_by_date_range(conn, cursor, start_date: str, end_date: str, group_id: Optional[str] = None) -> Dict:
-    """根据日期范围聚合统计数据"""
-    # 构建查询条件
-    where_clause = "date >= ? AND date <= ?"
-    params = [start_date, end_date]
+@db_transaction
+def end_order(conn, cursor, date: str, chat_id: int) -> Dict:
+    """订单完成：有效订单减少，完成订单增加，流动资金增加"""
+    return _change_order_state(conn, cursor, date, chat_id, 'end', VALID_ORDER_STATES)
 
-    if group_id:
-        where_clause += " AND group_id = ?"
-        params.append(group_id)
-    else:
-        where_clause += " AND group_id IS NULL"
 
+@db_transaction
+def breach_order(conn, cursor, date: str, chat_id: int) -> Dict:
+    """逾期订单转为违约：有效订单减少，违约订单增加"""
+    return _change_order_state(conn, cursor, date, chat_id, 'breach', ('overdue',))
+
+
+@db_transaction
+def sweep_overdue_orders(conn, cursor, date: str, due_before: Dict[str, str]) -> Dict[str, Dict]:
+    """
+    逾期扫描：把最近付款日（没有付款时为下单日）不晚于所在星期分组截止日期的正常订单，
+    用一条 UPDATE 全部转为逾期；重复执行时已转为逾期的订单不再匹配
+    :param due_before: {星期分组: 截止日期 YYYY-MM-DD}
+    :return: {归属ID: {'count', 'amount', 'order_ids'}}
+    """
+    groups = sorted(due_before)
+    if not groups:
+        return {}
+    cases = ' '.join('WHEN ? THEN ?' for _ in groups)
+    params = [value for group in groups for value in (group, due_before[group])]
     cursor.execute(f'''
-    SELECT 
-        SUM(new_clients) as new_clients,
-        SUM(new_clients_amount) as new_clients_amount,
-        SUM(old_clients) as old_clients,
-        SUM(old_clients_amount) as old_clients_amount,
-        SUM(interest) as interest,
-        SUM(completed_orders) as completed_orders,
-        SUM(completed_amount) as completed_amount,
-        SUM(breach_orders) as breach_orders,
-        SUM(breach_amount) as breach_amount,
-        SUM(breach_end_orders) as breach_end_orders,
-        SUM(breach_end_amount) as breach_end_amount,
-        SUM(liquid_flow) as liquid_flow,
-        SUM(company_expenses) as company_expenses,
-        SUM(other_expenses) as other_expenses
-    FROM daily_data 
-    WHERE {where_clause}
+    UPDATE orders SET state = 'overdue', updated_at = CURRENT_TIMESTAMP
+    WHERE state = 'normal'
+      AND COALESCE(last_payment_date, substr(date, 1, 10)) <= CASE weekday_group {cases} END
+    RETURNING order_id, chat_id, group_id, amount
     ''', params)
+    rows = cursor.fetchall()
+
+    summary: Dict[str, Dict] = {}
+    for row in rows:
+        group = summary.setdefault(row['group_id'], {'count': 0, 'amount': 0, 'order_ids': []})
+        group['count'] += 1
+        group['amount'] += row['amount']
+        group['order_ids'].append(row['order_id'])
+    # Normal -> Overdue 都在有效统计下，统计表不变；每个归属记一条汇总流水
+    for group_id, group in summary.items():
+        delta = StatsDelta(date).for_event(
+            'state_change', amount=group['amount'],
+            note=f"normal->overdue (sweep, {group['count']} orders)")
+        delta.group_id = group_id
+        _apply_stats_delta(cursor, delta)
+    conn.commit()
+
+    chat_ids = [row['chat_id'] for row in rows]
+
+    def invalidate_orders():
+        for chat_id in chat_ids:
+            db_cache.active_orders.invalidate(chat_id)
+    db_pool.after_commit(invalidate_orders)
+    return summary
+
 
+@db_transaction
+def end_breach_order(conn, cursor, date: str, chat_id: int, amount: float) -> Dict:
+    """违约订单完成：违约完成订单增加，收回金额计入流动资金"""
+    if amount <= 0:
+        return _command_result(cursor, 'invalid_amount')
+    cursor.execute(ACTIVE_ORDER_SQL, (chat_id,))
     row = cursor.fetchone()
+    if not row:
+        return _command_result(cursor, 'no_order')
+    order = dict(row)
+    if order['state'] != 'breach':
+        return _command_result(cursor, 'invalid_state', order)
+
+    cursor.execute('''
+    UPDATE orders SET state = 'breach_end', updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (order['id'],))
+    delta = (StatsDelta(date).for_event('breach_end', order, amount)
+             .add('breach_end', amount, 1, order['group_id'])
+             .add_liquid(amount))
+    return _commit_order_command(conn, cursor, order, delta)
 
-    # 将结果转换为字典，None转为0
-    result = {}
-    keys = [
-        'new_clients', 'new_clients_amount',
-        'old_clients', 'old_clients_amount',
-        'interest',
-        'completed_orders', 'completed_amount',
-        'breach_orders', 'breach_amount',
-        'breach_end_orders', 'breach_end_amount',
-        'liquid_flow', 'company_expenses', 'other_expenses'
-    ]
 
-    for i, key in enumerate(keys):
-        result[key] = row[i] if row[i] is not None else 0
+@db_transaction
+def reduce_principal(conn, cursor, date: str, chat_id: int, amount: float) -> Dict:
+    """本金减少：订单金额减少，有效金额转为完成金额，流动资金增加"""
+    # 最近付款日与统计变动使用同一个日期（已日结的日期计入下一天）
+    date = _open_period_date(cursor, date)
+    cursor.execute(ACTIVE_ORDER_SQL, (chat_id,))
+    row = cursor.fetchone()
+    if not row:
+        return _command_result(cursor, 'no_order')
+    order = dict(row)
+    if order['state'] not in VALID_ORDER_STATES:
+        return _command_result(cursor, 'invalid_state', order)
+    if amount <= 0 or amount > order['amount']:
+        return _command_result(cursor, 'invalid_amount', order)
+
+    cursor.execute('''
+    UPDATE orders SET amount = amount - ?, last_payment_date = ?,
+                      updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (amount, date, order['id']))
+    group_id = order['group_id']
+    delta = (StatsDelta(date).for_event('principal_reduction', order, amount)
+             .add('valid', -amount, 0, group_id)
+             .add('completed', amount, 0, group_id)
+             .add_liquid(amount))
+    return _commit_order_command(conn, cursor, order, delta)
+
+
+@db_transaction
+def record_interest(conn, cursor, date: str, chat_id: int, amount: float) -> Dict:
+    """利息收入：群内有有效订单时计入订单归属并记为最近付款日，否则只计入全局；流动资金增加"""
+    # 最近付款日与统计变动使用同一个日期（已日结的日期计入下一天）
+    date = _open_period_date(cursor, date)
+    cursor.execute(ACTIVE_ORDER_SQL, (chat_id,))
+    row = cursor.fetchone()
+    order = dict(row) if row else None
+    # 非正数不是付款，不能计入利息或推迟逾期
+    if amount <= 0:
+        return _command_result(cursor, 'invalid_amount', order)
+    delta = (StatsDelta(date).for_event('interest', order, amount)
+             .add('interest', amount, 0, order['group_id'] if order else None)
+             .add_liquid(amount))
+    if order:
+        cursor.execute(
+            'UPDATE orders SET last_payment_date = ? WHERE id = ?', (date, order['id']))
+        return _commit_order_command(conn, cursor, order, delta)
+    _apply_stats_delta(cursor, delta)
+    conn.commit()
+    _invalidate_report_cache(delta)
+    return _command_result(cursor, 'ok', order)
 
+
+@db_transaction
+def reassign_order(conn, cursor, date: str, order_id: str, new_group_id: str) -> Dict:
+    """修改订单归属；未完成订单的有效/违约统计从旧归属迁移到新归属"""
+    cursor.execute('SELECT * FROM orders WHERE order_id = ?', (order_id,))
+    row = cursor.fetchone()
+    if not row:
+        return _command_result(cursor, 'no_order')
+    order = dict(row)
+    if order['group_id'] == new_group_id:
+        return _command_result(cursor, 'ok', order)
+
+    cursor.execute('''
+    UPDATE orders SET group_id = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (new_group_id, order['id']))
+    delta = StatsDelta(date).for_event('attribution', order, order['amount'], f"-> {new_group_id}")
+    # 已完成订单的统计已经固定，只改归属
+    if order['state'] in ACTIVE_ORDER_STATES:
+        field = 'breach' if order['state'] == 'breach' else 'valid'
+        delta.add(field, -order['amount'], -1, order['group_id'])
+        delta.add(field, order['amount'], 1, new_group_id)
+    return _commit_order_command(conn, cursor, order, delta)
+
+
+@db_transaction
+def reassign_orders(conn, cursor, date: str, order_ids: List[str], new_group_id: str,
+                    dry_run: bool = False) -> Dict:
+    """
+    批量修改订单归属（一条 UPDATE + 一次 GROUP BY 汇总迁移的统计，一个事务）
+    :param dry_run: True 只汇总将要迁移的数据，不修改
+    :return: {
+        'requested': 订单号数量, 'matched': 找到的订单数, 'moved': 修改归属的订单数,
+        'unchanged': 已经是新归属的订单数,
+        'groups': {旧归属ID: {'valid_orders', 'valid_amount', 'breach_orders', 'breach_amount', 'closed_orders'}},
+        'dry_run': bool
+    }
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    # 订单号放入临时表，避免 IN (...) 参数数量超过上限
+    cursor.execute('CREATE TEMP TABLE IF NOT EXISTS reassign_order_ids (order_id TEXT PRIMARY KEY)')
+    cursor.execute('DELETE FROM reassign_order_ids')
+    cursor.executemany('INSERT INTO reassign_order_ids (order_id) VALUES (?)',
+                       [(order_id,) for order_id in order_ids])
+
+    cursor.execute('''
+    SELECT group_id, state, COUNT(*) AS orders, SUM(amount) AS amount
+    FROM orders
+    WHERE order_id IN (SELECT order_id FROM reassign_order_ids)
+    GROUP BY group_id, state
+    ''')
+    groups: Dict[str, Dict[str, float]] = {}
+    matched = unchanged = 0
+    for row in cursor.fetchall():
+        matched += row['orders']
+        if row['group_id'] == new_group_id:
+            unchanged += row['orders']
+            continue
+        stats = groups.setdefault(row['group_id'], {
+            'valid_orders': 0, 'valid_amount': 0,
+            'breach_orders': 0, 'breach_amount': 0, 'closed_orders': 0})
+        if row['state'] in VALID_ORDER_STATES:
+            stats['valid_orders'] += row['orders']
+            stats['valid_amount'] += row['amount']
+        elif row['state'] == 'breach':
+            stats['breach_orders'] += row['orders']
+            stats['breach_amount'] += row['amount']
+        else:
+            # 已完成订单的统计已经固定，只改归属
+            stats['closed_orders'] += row['orders']
+
+    result = {
+        'requested': len(order_ids),
+        'matched': matched,
+        'moved': matched - unchanged,
+        'unchanged': unchanged,
+        'groups': groups,
+        'dry_run': dry_run,
+    }
+    if dry_run or not groups:
+        cursor.execute('DELETE FROM reassign_order_ids')
+        return result
+
+    cursor.execute('''
+    UPDATE orders SET group_id = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE order_id IN (SELECT order_id FROM reassign_order_ids) AND group_id != ?
+    ''', (new_group_id, new_group_id))
+
+    delta = StatsDelta(date).for_event(
+        'attribution', amount=sum(s['valid_amount'] + s['breach_amount'] for s in groups.values()),
+        note=f"-> {new_group_id} ({result['moved']} orders)")
+    for old_group_id, stats in groups.items():
+        for field in ('valid', 'breach'):
+            count, amount = stats[f'{field}_orders'], stats[f'{field}_amount']
+            if count:
+                delta.add(field, -amount, -count, old_group_id)
+                delta.add(field, amount, count, new_group_id)
+    _apply_stats_delta(cursor, delta)
+
+    # 刷新被修改的有效订单缓存
+    cursor.execute('''
+    SELECT * FROM orders
+    WHERE order_id IN (SELECT order_id FROM reassign_order_ids)
+      AND state NOT IN ('end', 'breach_end')
+    ''')
+    active = [dict(row) for row in cursor.fetchall()]
+    cursor.execute('DELETE FROM reassign_order_ids')
+    conn.commit()
+    _invalidate_report_cache(delta)
+
+    def refresh_cache():
+        for order in active:
+            db_cache.active_orders.put(order['chat_id'], order)
+    db_pool.after_commit(refresh_cache)
     return result
 
+
+@db_transaction
+def import_historical_orders(conn, cursor, date: str, orders: List[Dict]) -> Dict:
+    """
+    批量导入历史订单（不扣流动资金）：executemany 插入 + 按归属汇总成一条统计变动，一个事务
+    订单号已存在、或该群已有未完成订单的行不导入
+    :param orders: 订单数据（字段同 create_order），需已通过校验
+    :return: {'inserted': 导入数量, 'rejected': [(订单在列表中的下标, 原因)]}
+    """
+    cursor.execute('''
+    CREATE TEMP TABLE IF NOT EXISTS import_order_keys (
+        order_id TEXT PRIMARY KEY,
+        chat_id INTEGER NOT NULL
+    )''')
+    cursor.execute('DELETE FROM import_order_keys')
+    cursor.executemany('INSERT OR IGNORE INTO import_order_keys (order_id, chat_id) VALUES (?, ?)',
+                       [(order['order_id'], order['chat_id']) for order in orders])
+    cursor.execute('''
+    SELECT order_id FROM orders
+    WHERE order_id IN (SELECT order_id FROM import_order_keys)
+    ''')
+    existing_ids = {row['order_id'] for row in cursor.fetchall()}
+    cursor.execute('''
+    SELECT chat_id FROM orders
+    WHERE chat_id IN (SELECT chat_id FROM import_order_keys)
+      AND state NOT IN ('end', 'breach_end')
+    ''')
+    busy_chats = {row['chat_id'] for row in cursor.fetchall()}
+    cursor.execute('DELETE FROM import_order_keys')
+
+    rejected: List[Tuple[int, str]] = []
+    rows = []
+    seen_ids = set()
+    delta = StatsDelta(date).for_event('import', note='historical')
+    for index, order in enumerate(orders):
+        if order['order_id'] in existing_ids or order['order_id'] in seen_ids:
+            rejected.append((index, 'duplicate order_id'))
+            continue
+        if order['chat_id'] in busy_chats:
+            rejected.append((index, 'chat already has an active order'))
+            continue
+        seen_ids.add(order['order_id'])
+        busy_chats.add(order['chat_id'])
+        rows.append((
+            order['order_id'], order['group_id'], order['chat_id'], order['date'],
+            order['group'], order['customer'], order['amount'], order['state'], date))
+        field = 'breach' if order['state'] == 'breach' else 'valid'
+        delta.add(field, order['amount'], 1, order['group_id'])
+        delta.amount += order['amount']
+
+    if rows:
+        cursor.executemany('''
+        INSERT INTO orders (
+            order_id, group_id, chat_id, date, weekday_group,
+            customer, amount, state, last_payment_date
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        delta.note = f"historical ({len(rows)} orders)"
+        _apply_stats_delta(cursor, delta)
+    conn.commit()
+    _invalidate_report_cache(delta)
+
+    chat_ids = [row[2] for row in rows]
+
+    def invalidate_orders():
+        for chat_id in chat_ids:
+            db_cache.active_orders.invalidate(chat_id)
+    db_pool.after_commit(invalidate_orders)
+    return {'inserted': len(rows), 'rejected': rejected}
+
+# ========== 流水（order_events） ==========
+
+# 重放校验时允许的浮点误差
+LEDGER_TOLERANCE = 0.005
+
+
+def seed_order_events_baseline(cursor) -> bool:
+    """
+    流水为空时，把当前三张统计表的内容写成一条 baseline 事件
+    这样重放流水可以还原启用流水之前的历史数据
+    """
+    cursor.execute('SELECT 1 FROM order_events LIMIT 1')
+    if cursor.fetchone():
+        return False
+
+    delta = StatsDelta(event_type='baseline')
+    cursor.execute('SELECT * FROM financial_data ORDER BY id DESC LIMIT 1')
+    row = cursor.fetchone()
+    if row:
+        row = dict(row)
+        delta.financial = {f: row[f] for f in FINANCIAL_FIELDS if row.get(f)}
+
+    cursor.execute('SELECT * FROM grouped_data')
+    for row in cursor.fetchall():
+        row = dict(row)
+        delta.grouped[row['group_id']] = {
+            f: row[f] for f in FINANCIAL_FIELDS if row.get(f)}
+
+    # 日结数据按日期拆分成多条 baseline 事件（每条事件只有一个日期）
+    daily_by_date: Dict[str, Dict[Optional[str], Dict[str, float]]] = {}
+    cursor.execute('SELECT * FROM daily_data ORDER BY date')
+    for row in cursor.fetchall():
+        row = dict(row)
+        daily_by_date.setdefault(row['date'], {})[row['group_id']] = {
+            f: row[f] for f in DAILY_FIELDS if row.get(f)}
+
+    _append_order_event(cursor, delta)
+    for date, daily in daily_by_date.items():
+        day_delta = StatsDelta(date, event_type='baseline')
+        day_delta.daily = daily
+        _append_order_event(cursor, day_delta)
+    return True
+
+
+def _fold_deltas(target: Dict, fields: Dict[str, float]):
+    for field, value in fields.items():
+        target[field] = target.get(field, 0) + value
+
+
+def _compare_rows(label: str, current: Dict, replayed: Dict, fields: set, drift: List[str]):
+    for field in sorted(fields):
+        old = current.get(field) or 0
+        new = replayed.get(field) or 0
+        if abs(old - new) > LEDGER_TOLERANCE:
+            drift.append(f"{label}.{field}: 当前 {old:.2f} / 流水 {new:.2f}")
+
+
+@db_transaction
+def rebuild_stats_from_ledger(conn, cursor, apply: bool = False) -> Dict:
+    """
+    按 order_events 流水顺序重放（流式读取），重新计算 financial_data / grouped_data / daily_data
+    :param apply: False 只校验差异，True 用重放结果覆盖三张统计表
+    :return: {'events': 事件数, 'drift': [差异...], 'applied': bool}
+    """
+    financial: Dict[str, float] = {}
+    grouped: Dict[str, Dict[str, float]] = {}
+    daily: Dict[Tuple[str, Optional[str]], Dict[str, float]] = {}
+    events = 0
+
+    reader = conn.execute('SELECT date, deltas FROM order_events ORDER BY id')
+    while True:
+        rows = reader.fetchmany(1000)
+        if not rows:
+            break
+        for row in rows:
+            events += 1
+            data = json.loads(row['deltas'])
+            _fold_deltas(financial, data.get('financial', {}))
+            for group_id, fields in data.get('grouped', {}).items():
+                _fold_deltas(grouped.setdefault(group_id, {}), fields)
+            for group_id, fields in data.get('daily', []):
+                _fold_deltas(daily.setdefault((row['date'], group_id), {}), fields)
+
+    # 与当前数据对比
+    drift: List[str] = []
+    cursor.execute('SELECT * FROM financial_data ORDER BY id DESC LIMIT 1')
+    row = cursor.fetchone()
+    _compare_rows('financial', dict(row) if row else {},
+                  financial, FINANCIAL_FIELDS, drift)
+
+    cursor.execute('SELECT * FROM grouped_data')
+    current_grouped = {row['group_id']: dict(row) for row in cursor.fetchall()}
+    for group_id in sorted(set(current_grouped) | set(grouped)):
+        _compare_rows(f"grouped[{group_id}]", current_grouped.get(group_id, {}),
+                      grouped.get(group_id, {}), FINANCIAL_FIELDS, drift)
+
+    cursor.execute('SELECT * FROM daily_data')
+    current_daily = {(row['date'], row['group_id']): dict(row)
+                     for row in cursor.fetchall()}
+    for key in sorted(set(current_daily) | set(daily), key=lambda k: (k[0], k[1] or '')):
+        _compare_rows(f"daily[{key[0]}/{key[1] or 'ALL'}]", current_daily.get(key, {}),
+                      daily.get(key, {}), DAILY_FIELDS, drift)
+
+    if apply:
+        cursor.execute('DELETE FROM financial_data')
+        cursor.execute('DELETE FROM grouped_data')
+        cursor.execute('DELETE FROM daily_data')
+
+        columns = sorted(FINANCIAL_FIELDS)
+        cursor.execute(
+            f"INSERT INTO financial_data ({', '.join(columns)}) "
+            f"VALUES ({', '.join('?' for _ in columns)})",
+            [financial.get(c, 0) for c in columns])
+
+        cursor.executemany(
+            f"INSERT INTO grouped_data (group_id, {', '.join(columns)}) "
+            f"VALUES (?, {', '.join('?' for _ in columns)})",
+            [[group_id] + [fields.get(c, 0) for c in columns]
+             for group_id, fields in grouped.items()])
+
+        daily_columns = sorted(DAILY_FIELDS)
+        cursor.executemany(
+            f"INSERT INTO daily_data (date, group_id, {', '.join(daily_columns)}) "
+            f"VALUES (?, ?, {', '.join('?' for _ in daily_columns)})",
+            [[date, group_id] + [fields.get(c, 0) for c in daily_columns]
+             for (date, group_id), fields in daily.items()])
+        rebuild_daily_rollups(cursor)
+        rebuild_daily_stock(cursor)
+        conn.commit()
+        db_pool.after_commit(db_cache.report_stats.clear)
+        db_pool.after_commit(db_cache.rendered_reports.clear)
+
+    return {'events': events, 'drift': drift, 'applied': apply}
+
 # ========== 授权用户操作 ==========
 
 
@@ -584,6 +1758,7 @@ def add_authorized_user(conn, cursor, user_id: int) -> bool:
     cursor.execute(
         'INSERT OR IGNORE INTO authorized_users (user_id) VALUES (?)', (user_id,))
     conn.commit()
+    db_pool.after_commit(lambda: db_cache.authorized_users.add(user_id))
     return True
 
 
@@ -593,6 +1768,7 @@ def remove_authorized_user(conn, cursor, user_id: int) -> bool:
     cursor.execute(
         'DELETE FROM authorized_users WHERE user_id = ?', (user_id,))
     conn.commit()
+    db_pool.after_commit(lambda: db_cache.authorized_users.discard(user_id))
     return True
 
 
@@ -604,12 +1780,20 @@ def get_authorized_users(conn, cursor) -> List[int]:
     return [row[0] for row in rows]
 
 
-@db_query
-def is_user_authorized(conn, cursor, user_id: int) -> bool:
-    """检查用户是否授权"""
-    cursor.execute(
-        'SELECT 1 FROM authorized_users WHERE user_id = ?', (user_id,))
-    return cursor.fetchone() is not None
+async def load_authorized_users() -> set:
+    """从数据库加载授权用户到内存缓存（启动时及缓存过期后调用）"""
+    version = db_cache.authorized_users.version()
+    users = set(await get_authorized_users())
+    db_cache.authorized_users.load(users, version)
+    return users
+
+
+async def is_user_authorized(user_id: int) -> bool:
+    """检查用户是否授权（查内存缓存，缓存未加载或过期时才读数据库）"""
+    cached = db_cache.authorized_users.contains(user_id)
+    if cached is not None:
+        return cached
+    return user_id in await load_authorized_users()
 
 # ========== 支付账号操作 ==========
 
@@ -717,14 +1901,15 @@ def update_payment_account(conn, cursor, account_type: str, account_number: str
     
     if row:
         # 更新现有记录
+        # 在同一事务中调用未装饰的原函数（装饰后的函数是协程）
         account_id = row['id']
-        return update_payment_account_by_id(conn, cursor, account_id, 
-                                           account_number, account_name, balance)
+        return update_payment_account_by_id.__wrapped__(
+            conn, cursor, account_id, account_number, account_name, balance)
     else:
         # 创建新记录
         if account_number:
-            create_payment_account(conn, cursor, account_type, account_number, 
-                                  account_name or '', balance or 0)
+            create_payment_account.__wrapped__(
+                conn, cursor, account_type, account_number, account_name or '', balance or 0)
             return True
         return False
 
@@ -738,65 +1923,12 @@ def record_expense(conn, cursor, date: str, type: str, amount: float, note: str)
     VALUES (?, ?, ?, ?)
     ''', (date, type, amount, note))
 
-    # 2. 更新日结数据
-    field = 'company_expenses' if type == 'company' else 'other_expenses'
-
-    # 复用 update_daily_data 逻辑的简化版
-    cursor.execute(
-        'SELECT * FROM daily_data WHERE date = ? AND group_id IS NULL', (date,))
-    row = cursor.fetchone()
-
-    if not row:
-        cursor.execute('''
-        INSERT INTO daily_data (
-            date, group_id, new_clients, new_clients_amount,
-            old_clients, old_clients_amount,
-            interest, completed_orders, completed_amount,
-            breach_orders, breach_amount,
-            breach_end_orders, breach_end_amount,
-            liquid_flow, company_expenses, other_expenses
-        ) VALUES (?, NULL, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, ?, ?)
-        ''', (date, amount if field == 'company_expenses' else 0, amount if field == 'other_expenses' else 0))
-    else:
-        cursor.execute(f'''
-        UPDATE daily_data 
-        SET "{field}" = "{field}" + ?, updated_at = CURRENT_TIMESTAMP
-        WHERE date = ? AND group_id IS NULL
-        ''', (amount, date))
-
-    # 3. 更新全局流动资金 (扣除开销)
-
-    # 先获取当前值
-    cursor.execute('SELECT * FROM financial_data ORDER BY id DESC LIMIT 1')
-    row = cursor.fetchone()
-    if not row:
-        # 如果不存在，创建新记录
-        cursor.execute('''
-        INSERT INTO financial_data (
-            valid_orders, valid_amount, liquid_funds,
-            new_clients, new_clients_amount,
-            old_clients, old_clients_amount,
-            interest, completed_orders, completed_amount,
-            breach_orders, breach_amount,
-            breach_end_orders, breach_end_amount
-        ) VALUES (0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0)
-        ''')
-        current_value = 0
-    else:
-        row_dict = dict(row)
-        current_value = row_dict.get('liquid_funds', 0)
-
-    # 更新值 (减少)
-    new_value = current_value - amount
-
-    # 使用参数化查询防止SQL注入
-    cursor.execute('''
-    UPDATE financial_data 
-    SET "liquid_funds" = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE id = (SELECT id FROM financial_data ORDER BY id DESC LIMIT 1)
-    ''', (new_value,))
+    # 2. 更新日结数据，扣除全局流动资金（同时写入流水）
+    delta = StatsDelta(date).for_event('expense', amount=amount, note=f"{type}: {note}")
+    _apply_stats_delta(cursor, delta.add_expense(type, amount))
 
     conn.commit()
+    _invalidate_report_cache(delta)
     return True
 
 
@@ -827,73 +1959,288 @@ def get_expense_records(conn, cursor, start_date: str, end_date: str = None, typ
 # ========== 定时播报操作 ==========
 
 
+def _attach_schedule_targets(cursor, schedules: List[Dict]) -> List[Dict]:
+    """为定时播报加上目标群列表 targets（一条时按ID查询，多条时一次读取全部目标）"""
+    by_id = {schedule['id']: schedule for schedule in schedules}
+    for schedule in schedules:
+        schedule['targets'] = []
+    if len(schedules) == 1:
+        cursor.execute('SELECT * FROM schedule_targets WHERE schedule_id = ? ORDER BY chat_id',
+                       (schedules[0]['id'],))
+    elif schedules:
+        cursor.execute('SELECT * FROM schedule_targets ORDER BY schedule_id, chat_id')
+    else:
+        return schedules
+    for row in cursor.fetchall():
+        if row['schedule_id'] in by_id:
+            by_id[row['schedule_id']]['targets'].append(dict(row))
+    return schedules
+
+
 @db_query
-def get_scheduled_broadcast(conn, cursor, slot: int) -> Optional[Dict]:
-    """获取指定槽位的定时播报"""
-    cursor.execute('SELECT * FROM scheduled_broadcasts WHERE slot = ?', (slot,))
+def get_schedule(conn, cursor, schedule_id: int) -> Optional[Dict]:
+    """获取定时播报（含目标群 targets）"""
+    cursor.execute('SELECT * FROM schedules WHERE id = ?', (schedule_id,))
     row = cursor.fetchone()
-    return dict(row) if row else None
+    return _attach_schedule_targets(cursor, [dict(row)])[0] if row else None
 
 
 @db_query
-def get_all_scheduled_broadcasts(conn, cursor) -> List[Dict]:
-    """获取所有定时播报"""
-    cursor.execute('SELECT * FROM scheduled_broadcasts ORDER BY slot')
-    rows = cursor.fetchall()
-    return [dict(row) for row in rows]
+def get_all_schedules(conn, cursor) -> List[Dict]:
+    """获取所有定时播报（含目标群 targets）"""
+    cursor.execute('SELECT * FROM schedules ORDER BY id')
+    return _attach_schedule_targets(cursor, [dict(row) for row in cursor.fetchall()])
 
 
-@db_query
-def get_active_scheduled_broadcasts(conn, cursor) -> List[Dict]:
-    """获取所有激活的定时播报"""
-    cursor.execute('SELECT * FROM scheduled_broadcasts WHERE is_active = 1 ORDER BY slot')
-    rows = cursor.fetchall()
-    return [dict(row) for row in rows]
+@db_transaction
+def create_schedule(conn, cursor, cron: str, timezone: str, message: str,
+                    targets: List[Tuple[int, Optional[str]]],
+                    created_by: Optional[int] = None) -> int:
+    """
+    创建定时播报，返回播报ID
+    :param targets: [(chat_id, 群名或None)]
+    """
+    cursor.execute('''
+    INSERT INTO schedules (cron, timezone, message, created_by)
+    VALUES (?, ?, ?, ?)
+    ''', (cron, timezone, message, created_by))
+    schedule_id = cursor.lastrowid
+    cursor.executemany('''
+    INSERT OR IGNORE INTO schedule_targets (schedule_id, chat_id, chat_title)
+    VALUES (?, ?, ?)
+    ''', [(schedule_id, chat_id, title) for chat_id, title in targets])
+    conn.commit()
+    return schedule_id
 
 
 @db_transaction
-def create_or_update_scheduled_broadcast(conn, cursor, slot: int, time: str, 
-                                       chat_id: Optional[int], chat_title: Optional[str], 
-                                       message: str, is_active: int = 1) -> bool:
-    """创建或更新定时播报"""
-    # 检查是否已存在
-    cursor.execute('SELECT * FROM scheduled_broadcasts WHERE slot = ?', (slot,))
-    row = cursor.fetchone()
-    
-    if row:
-        # 更新现有记录
-        cursor.execute('''
-        UPDATE scheduled_broadcasts 
-        SET time = ?, chat_id = ?, chat_title = ?, message = ?, 
-            is_active = ?, updated_at = CURRENT_TIMESTAMP
-        WHERE slot = ?
-        ''', (time, chat_id, chat_title, message, is_active, slot))
-    else:
-        # 创建新记录
-        cursor.execute('''
-        INSERT INTO scheduled_broadcasts (slot, time, chat_id, chat_title, message, is_active)
-        VALUES (?, ?, ?, ?, ?, ?)
-        ''', (slot, time, chat_id, chat_title, message, is_active))
-    
+def update_schedule(conn, cursor, schedule_id: int, cron: Optional[str] = None,
+                    timezone: Optional[str] = None, message: Optional[str] = None,
+                    is_active: Optional[int] = None) -> bool:
+    """修改定时播报（只修改传入的字段）"""
+    fields = {'cron': cron, 'timezone': timezone, 'message': message, 'is_active': is_active}
+    changes = {name: value for name, value in fields.items() if value is not None}
+    if not changes:
+        return False
+    assignments = ', '.join(f"{name} = ?" for name in changes)
+    cursor.execute(f'''
+    UPDATE schedules SET {assignments}, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', [*changes.values(), schedule_id])
+    conn.commit()
+    return cursor.rowcount > 0
+
+
+@db_transaction
+def set_schedule_targets(conn, cursor, schedule_id: int,
+                         targets: List[Tuple[int, Optional[str]]]) -> bool:
+    """替换定时播报的目标群"""
+    cursor.execute('SELECT 1 FROM schedules WHERE id = ?', (schedule_id,))
+    if not cursor.fetchone():
+        return False
+    cursor.execute('DELETE FROM schedule_targets WHERE schedule_id = ?', (schedule_id,))
+    cursor.executemany('''
+    INSERT OR IGNORE INTO schedule_targets (schedule_id, chat_id, chat_title)
+    VALUES (?, ?, ?)
+    ''', [(schedule_id, chat_id, title) for chat_id, title in targets])
+    cursor.execute(
+        'UPDATE schedules SET updated_at = CURRENT_TIMESTAMP WHERE id = ?', (schedule_id,))
     conn.commit()
     return True
 
 
 @db_transaction
-def delete_scheduled_broadcast(conn, cursor, slot: int) -> bool:
-    """删除定时播报"""
-    cursor.execute('DELETE FROM scheduled_broadcasts WHERE slot = ?', (slot,))
+def delete_schedule(conn, cursor, schedule_id: int) -> bool:
+    """删除定时播报及其目标群"""
+    cursor.execute('DELETE FROM schedule_targets WHERE schedule_id = ?', (schedule_id,))
+    cursor.execute('DELETE FROM schedules WHERE id = ?', (schedule_id,))
+    conn.commit()
+    return cursor.rowcount > 0
+
+# ========== 群发任务 ==========
+
+
+@db_transaction
+def create_broadcast_job(conn, cursor, text: str, targets: List[Tuple[int, Optional[str]]],
+                         created_by: Optional[int] = None,
+                         status_chat_id: Optional[int] = None) -> int:
+    """
+    创建群发任务及其全部目标，返回任务ID
+    :param targets: [(chat_id, 单独文本或None)]，None 表示使用任务文本
+    """
+    cursor.execute('''
+    INSERT INTO broadcast_jobs (text, created_by, status_chat_id, total)
+    VALUES (?, ?, ?, ?)
+    ''', (text, created_by, status_chat_id, len(targets)))
+    job_id = cursor.lastrowid
+    cursor.executemany('''
+    INSERT OR IGNORE INTO broadcast_targets (job_id, chat_id, text)
+    VALUES (?, ?, ?)
+    ''', [(job_id, chat_id, target_text) for chat_id, target_text in targets])
+    # 重复的 chat_id 只发送一次
+    cursor.execute('''
+    UPDATE broadcast_jobs
+    SET total = (SELECT COUNT(*) FROM broadcast_targets WHERE job_id = ?)
+    WHERE id = ?
+    ''', (job_id, job_id))
+    conn.commit()
+    return job_id
+
+
+@db_query
+def get_broadcast_job(conn, cursor, job_id: int) -> Optional[Dict]:
+    """获取群发任务"""
+    cursor.execute('SELECT * FROM broadcast_jobs WHERE id = ?', (job_id,))
+    row = cursor.fetchone()
+    return dict(row) if row else None
+
+
+@db_query
+def get_unfinished_broadcast_jobs(conn, cursor) -> List[Dict]:
+    """获取未完成的群发任务（重启后继续发送）"""
+    cursor.execute(
+        "SELECT * FROM broadcast_jobs WHERE status = 'running' ORDER BY id")
+    return [dict(row) for row in cursor.fetchall()]
+
+
+@db_query
+def get_pending_broadcast_targets(conn, cursor, job_id: int) -> List[Dict]:
+    """获取群发任务中尚未发送的目标"""
+    cursor.execute('''
+    SELECT chat_id, text FROM broadcast_targets
+    WHERE job_id = ? AND status = 'pending'
+    ''', (job_id,))
+    return [dict(row) for row in cursor.fetchall()]
+
+
+@db_transaction
+def set_broadcast_status_message(conn, cursor, job_id: int, message_id: int) -> bool:
+    """记录用于显示进度的消息ID"""
+    cursor.execute('''
+    UPDATE broadcast_jobs SET status_message_id = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (message_id, job_id))
     conn.commit()
     return cursor.rowcount > 0
 
 
 @db_transaction
-def toggle_scheduled_broadcast(conn, cursor, slot: int, is_active: int) -> bool:
-    """切换定时播报的激活状态"""
+def mark_broadcast_target(conn, cursor, job_id: int, chat_id: int, success: bool,
+                          error: Optional[str] = None) -> bool:
+    """记录单个目标的发送结果，并累加任务计数"""
     cursor.execute('''
-    UPDATE scheduled_broadcasts 
-    SET is_active = ?, updated_at = CURRENT_TIMESTAMP
-    WHERE slot = ?
-    ''', (is_active, slot))
+    UPDATE broadcast_targets
+    SET status = ?, error = ?, sent_at = CURRENT_TIMESTAMP
+    WHERE job_id = ? AND chat_id = ? AND status = 'pending'
+    ''', ('sent' if success else 'failed', error, job_id, chat_id))
+    if cursor.rowcount == 0:
+        return False
+    counter = 'sent' if success else 'failed'
+    cursor.execute(f'''
+    UPDATE broadcast_jobs SET {counter} = {counter} + 1, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (job_id,))
+    conn.commit()
+    return True
+
+
+@db_transaction
+def finish_broadcast_job(conn, cursor, job_id: int, status: str = 'done') -> bool:
+    """结束群发任务（done / cancelled）"""
+    cursor.execute('''
+    UPDATE broadcast_jobs SET status = ?, updated_at = CURRENT_TIMESTAMP
+    WHERE id = ?
+    ''', (status, job_id))
     conn.commit()
     return cursor.rowcount > 0
+
+# ========== 数据导出 ==========
+
+# 每次从游标读取的行数（导出内存占用只与该值有关，与总行数无关）
+EXPORT_FETCH_SIZE = 1000
+EXPORT_KINDS = ('orders', 'daily', 'expenses')
+
+
+def _export_query(kind: str, start_date: Optional[str], end_date: Optional[str],
+                  group_id: Optional[str]) -> Tuple[str, list]:
+    """导出查询（按日期范围/归属ID筛选）"""
+    conditions, params = [], []
+    if kind == 'orders':
+        # 订单日期带时间（YYYY-MM-DD HH:MM:SS）
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(f"{end_date} 23:59:59")
+        if group_id:
+            conditions.append('group_id = ?')
+            params.append(group_id)
+        sql = ('SELECT order_id, group_id, chat_id, date, weekday_group, customer, '
+               'amount, state, created_at, updated_at FROM orders')
+        if start_date or end_date:
+            order_by = ' ORDER BY date'
+        elif group_id:
+            # 按索引 (group_id, state, date) 的顺序输出，避免排序
+            order_by = ' ORDER BY state, date'
+        else:
+            order_by = ' ORDER BY id'
+    elif kind == 'daily':
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
+        if group_id:
+            # 'ALL' 表示全局日结（group_id 为空）
+            conditions.append('group_id IS ?')
+            params.append(None if group_id == 'ALL' else group_id)
+        sql = f"SELECT date, group_id, {', '.join(DAILY_STATS_KEYS)} FROM daily_data"
+        order_by = ' ORDER BY date, group_id'
+    elif kind == 'expenses':
+        if start_date:
+            conditions.append('date >= ?')
+            params.append(start_date)
+        if end_date:
+            conditions.append('date <= ?')
+            params.append(end_date)
+        sql = 'SELECT date, type, amount, note, created_at FROM expense_records'
+        order_by = ' ORDER BY date, id'
+    else:
+        raise ValueError(f"Unknown export kind: {kind}")
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    return sql + order_by, params
+
+
+def iter_export_rows(cursor, sql: str, params: list):
+    """逐批读取查询结果（第一行为列名）"""
+    cursor.execute(sql, params)
+    yield [column[0] for column in cursor.description]
+    while True:
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+        if not rows:
+            break
+        for row in rows:
+            yield tuple(row)
+
+
+@db_export
+def export_csv(conn, cursor, kind: str, path: str, start_date: Optional[str] = None,
+               end_date: Optional[str] = None, group_id: Optional[str] = None,
+               compress: bool = False) -> int:
+    """
+    流式导出到 CSV 文件（compress=True 时写入 gzip）
+    :param kind: orders / daily / expenses
+    :return: 导出的行数（不含表头）
+    """
+    sql, params = _export_query(kind, start_date, end_date, group_id)
+    opener = gzip.open if compress else open
+    count = -1
+    with opener(path, 'wt', encoding='utf-8-sig', newline='') as f:
+        writer = csv.writer(f)
+        for row in iter_export_rows(cursor, sql, params):
+            writer.writerow(row)
+            count += 1
+    return count
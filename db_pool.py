@@ -0,0 +1,341 @@
+"""数据库连接池：每个读线程一个长连接，外加一个专用写连接
+
+写操作通过写队列（WriteQueue）执行：同一时间窗口内到达的写请求合并为一个事务，
+每个请求在自己的 SAVEPOINT 中执行，整批只提交（fsync）一次。
+"""
+import os
+import time
+import sqlite3
+import threading
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 连接池配置（可通过环境变量调整）
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '4'))
+# cache_size 以 KB 为单位（PRAGMA 中使用负数表示 KB）
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '16384'))
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(128 * 1024 * 1024)))
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '5000'))
+# 写请求合并：第一个请求最多等待的时间（毫秒），以及每批最多的请求数
+DB_WRITE_BATCH_WINDOW_MS = float(os.getenv('DB_WRITE_BATCH_WINDOW_MS', '2'))
+DB_WRITE_BATCH_MAX = int(os.getenv('DB_WRITE_BATCH_MAX', '64'))
+
+# 当前写线程正在执行的请求的提交后回调列表
+_write_context = threading.local()
+
+
+def after_commit(callback: Callable[[], None]):
+    """
+    注册提交后执行的回调（例如回写缓存）
+    在写队列中执行时，回调在整批提交成功后按顺序执行，请求失败则丢弃；
+    不在写队列中（脚本直接调用）时立即执行
+    """
+    callbacks = getattr(_write_context, 'callbacks', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+
+class _SavepointConnection:
+    """批量事务中传给写函数的连接
+
+    写函数自己调用的 commit() / rollback() 只作用于该请求的 SAVEPOINT，
+    真正的提交由写队列在整批结束后统一执行
+    """
+
+    SAVEPOINT = 'write_request'
+
+    def __init__(self, conn: sqlite3.Connection):
+        self._conn = conn
+
+    def commit(self):
+        # 保留到目前为止的改动，之后的改动放入新的 SAVEPOINT
+        self._conn.execute(f'RELEASE {self.SAVEPOINT}')
+        self._conn.execute(f'SAVEPOINT {self.SAVEPOINT}')
+
+    def rollback(self):
+        self._conn.execute(f'ROLLBACK TO {self.SAVEPOINT}')
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class _BatchAborted(Exception):
+    """SQLite 中止了整个事务（例如磁盘错误），本批需要逐个重试"""
+
+
+class WriteQueue:
+    """写请求队列（group commit）
+
+    - 所有写请求在写线程中串行执行
+    - 第一个请求到达后最多等待 window 秒收集更多请求，达到 max_batch 立即执行
+    - 每批一个事务、一次提交；每个请求在自己的 SAVEPOINT 中执行，
+      出错只回滚该请求，结果（或异常）分别返回给各自的调用方
+    - 整批提交失败时回滚，并逐个单独重试
+    """
+
+    # 批大小分布统计的区间上限
+    SIZE_BUCKETS = (1, 4, 16, 64)
+
+    def __init__(self, pool: 'ConnectionPool', window: float = DB_WRITE_BATCH_WINDOW_MS / 1000,
+                 max_batch: int = DB_WRITE_BATCH_MAX):
+        self.pool = pool
+        self.window = max(0.0, window)
+        self.max_batch = max(1, max_batch)
+        self._cond = threading.Condition()
+        self._pending: List[Tuple[Callable, Future, float]] = []
+        self._scheduled = False
+        # 统计
+        self.batches = 0
+        self.requests = 0
+        self.max_batch_seen = 0
+        self.fallbacks = 0
+        self.wait_time = 0.0
+        self.commit_time = 0.0
+        self.size_histogram = [0] * (len(self.SIZE_BUCKETS) + 1)
+
+    def submit(self, work: Callable[[sqlite3.Connection], object]) -> Future:
+        """提交写请求 work(conn)，返回 concurrent.futures.Future"""
+        future: Future = Future()
+        with self._cond:
+            self._pending.append((work, future, time.monotonic()))
+            if not self._scheduled:
+                try:
+                    self.pool.writer.submit(self._drain)
+                except RuntimeError:
+                    # 连接池已关闭
+                    self._pending.pop()
+                    raise
+                self._scheduled = True
+            elif len(self._pending) >= self.max_batch:
+                self._cond.notify()
+        return future
+
+    def _drain(self):
+        """在写线程中循环取出并执行批次，直到队列为空"""
+        while True:
+            with self._cond:
+                if not self._pending:
+                    self._scheduled = False
+                    return
+                deadline = self._pending[0][2] + self.window
+                while len(self._pending) < self.max_batch:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._pending[:self.max_batch]
+                del self._pending[:self.max_batch]
+            try:
+                self._run_batch(batch)
+            except Exception as e:
+                # 兜底：不能让调用方永远等待
+                logger.error(f"写队列执行批次失败: {e}", exc_info=True)
+                for _, future, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+
+    def _run_request(self, conn: sqlite3.Connection, work: Callable,
+                     callbacks: List[Callable]) -> Tuple[bool, object]:
+        """在 SAVEPOINT 中执行一个请求，返回 (是否成功, 结果或异常)"""
+        request_callbacks: List[Callable] = []
+        _write_context.callbacks = request_callbacks
+        conn.execute(f'SAVEPOINT {_SavepointConnection.SAVEPOINT}')
+        try:
+            outcome = (True, work(_SavepointConnection(conn)))
+        except Exception as e:
+            outcome = (False, e)
+        finally:
+            _write_context.callbacks = None
+
+        if not conn.in_transaction:
+            raise _BatchAborted(outcome[1])
+        # 与原先 "未提交的改动在结束时回滚" 的行为一致
+        conn.execute(f'ROLLBACK TO {_SavepointConnection.SAVEPOINT}')
+        conn.execute(f'RELEASE {_SavepointConnection.SAVEPOINT}')
+        if outcome[0]:
+            callbacks.extend(request_callbacks)
+        return outcome
+
+    def _run_batch(self, batch: List[Tuple[Callable, Future, float]]):
+        conn = self.pool.writer_connection()
+        started = time.monotonic()
+        callbacks: List[Callable] = []
+        outcomes = []
+        try:
+            if conn.in_transaction:
+                conn.rollback()
+            conn.execute('BEGIN IMMEDIATE')
+            for work, _, _ in batch:
+                outcomes.append(self._run_request(conn, work, callbacks))
+            commit_start = time.monotonic()
+            conn.commit()
+            commit_elapsed = time.monotonic() - commit_start
+        except (sqlite3.Error, _BatchAborted) as e:
+            if conn.in_transaction:
+                conn.rollback()
+            if len(batch) > 1:
+                logger.warning(f"批量写入失败，逐个重试 {len(batch)} 个请求: {e}")
+                with self._cond:
+                    self.fallbacks += 1
+                for item in batch:
+                    self._run_batch([item])
+                return
+            error = e.args[0] if isinstance(e, _BatchAborted) else e
+            if not isinstance(error, BaseException):
+                error = sqlite3.OperationalError(str(error))
+            batch[0][1].set_exception(error)
+            return
+
+        with self._cond:
+            self.batches += 1
+            self.requests += len(batch)
+            self.max_batch_seen = max(self.max_batch_seen, len(batch))
+            self.wait_time += sum(started - enqueued for _, _, enqueued in batch)
+            self.commit_time += commit_elapsed
+            for i, bound in enumerate(self.SIZE_BUCKETS):
+                if len(batch) <= bound:
+                    self.size_histogram[i] += 1
+                    break
+            else:
+                self.size_histogram[-1] += 1
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.error(f"提交后回调执行失败: {e}", exc_info=True)
+
+        for (_, future, _), (ok, value) in zip(batch, outcomes):
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def stats(self) -> Dict:
+        with self._cond:
+            labels = []
+            lower = 1
+            for bound in self.SIZE_BUCKETS:
+                labels.append(str(bound) if bound == lower else f"{lower}-{bound}")
+                lower = bound + 1
+            labels.append(f">{self.SIZE_BUCKETS[-1]}")
+            return {
+                'batches': self.batches,
+                'requests': self.requests,
+                'pending': len(self._pending),
+                'avg_batch': self.requests / self.batches if self.batches else 0.0,
+                'max_batch': self.max_batch_seen,
+                'avg_wait_ms': self.wait_time / self.requests * 1000 if self.requests else 0.0,
+                'avg_commit_ms': self.commit_time / self.batches * 1000 if self.batches else 0.0,
+                'fallbacks': self.fallbacks,
+                'histogram': dict(zip(labels, self.size_histogram)),
+            }
+
+
+class ConnectionPool:
+    """SQLite 连接池
+
+    - 读操作在固定大小的线程池中执行，每个线程持有一个长连接
+    - 写操作在单线程执行器中执行，所有写入共用一个写连接，天然串行
+    - 写请求经写队列合并提交（见 WriteQueue）
+    - PRAGMA 只在连接创建时设置一次
+    """
+
+    def __init__(self, db_path: str, pool_size: int = DB_POOL_SIZE):
+        self.db_path = db_path
+        self.pool_size = max(1, pool_size)
+        self._local = threading.local()
+        self._connections = []
+        self._lock = threading.Lock()
+        self._writer_conn = None
+        self.reader = ThreadPoolExecutor(
+            max_workers=self.pool_size, thread_name_prefix='db-read')
+        self.writer = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix='db-write')
+        self.write_queue = WriteQueue(self)
+
+    def _connect(self, writer: bool = False) -> sqlite3.Connection:
+        """创建新连接并设置 PRAGMA"""
+        conn = sqlite3.connect(
+            self.db_path,
+            check_same_thread=False,
+            timeout=DB_BUSY_TIMEOUT_MS / 1000
+        )
+        conn.row_factory = sqlite3.Row
+        if writer:
+            # journal_mode 持久化在数据库文件中，由写连接设置一次即可
+            conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+        conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+        conn.execute('PRAGMA temp_store=MEMORY')
+        conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+        with self._lock:
+            self._connections.append(conn)
+        return conn
+
+    def writer_connection(self) -> sqlite3.Connection:
+        """获取写连接（仅在写线程中调用）"""
+        if self._writer_conn is None:
+            self._writer_conn = self._connect(writer=True)
+        return self._writer_conn
+
+    def reader_connection(self) -> sqlite3.Connection:
+        """获取当前读线程的长连接（仅在读线程中调用）"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            # 确保 WAL 模式已由写连接开启，读连接才能与写并发
+            if self._writer_conn is None:
+                self.writer.submit(self.writer_connection).result()
+            conn = self._connect()
+            self._local.conn = conn
+        return conn
+
+    def close(self):
+        """关闭执行器和所有连接"""
+        self.reader.shutdown(wait=True)
+        self.writer.shutdown(wait=True)
+        with self._lock:
+            for conn in self._connections:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logger.debug(f"关闭数据库连接失败: {e}")
+            self._connections.clear()
+        self._writer_conn = None
+
+
+# 全局连接池
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(db_path: str) -> ConnectionPool:
+    """获取（必要时创建）指定数据库文件的连接池"""
+    global _pool
+    pool = _pool
+    if pool is not None and pool.db_path == db_path:
+        return pool
+    with _pool_lock:
+        if _pool is not None and _pool.db_path != db_path:
+            _pool.close()
+            _pool = None
+        if _pool is None:
+            _pool = ConnectionPool(db_path)
+            logger.info(
+                f"数据库连接池已创建: {db_path} (读线程: {_pool.pool_size})")
+        return _pool
+
+
+def close_pool():
+    """关闭全局连接池（程序退出时调用）"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.close()
+            _pool = None
@@ -8,7 +8,10 @@ from .command_handlers import (
     list_attributions,
     add_employee,
     remove_employee,
-    list_employees
+    list_employees,
+    rebuild_stats,
+    show_cache_stats,
+    show_update_stats
 )
 from .order_handlers import (
     set_normal,
@@ -28,6 +31,9 @@ from .message_handlers import (
 from .broadcast_handlers import broadcast_payment
 from .payment_handlers import show_gcash, show_paymaya, show_all_accounts
 from .schedule_handlers import show_schedule_menu, handle_schedule_input
+from .import_handlers import show_import_help, handle_import_document
+from .export_handlers import export_data
+from .reminder_handlers import remind_all
 import os
 import sys
 from pathlib import Path
@@ -50,6 +56,9 @@ __all__ = [
     'add_employee',
     'remove_employee',
     'list_employees',
+    'rebuild_stats',
+    'show_cache_stats',
+    'show_update_stats',
     'set_normal',
     'set_overdue',
     'set_end',
@@ -66,5 +75,9 @@ __all__ = [
     'show_paymaya',
     'show_all_accounts',
     'show_schedule_menu',
-    'handle_schedule_input'
+    'handle_schedule_input',
+    'show_import_help',
+    'handle_import_document',
+    'export_data',
+    'remind_all'
 ]
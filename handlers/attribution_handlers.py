@@ -3,11 +3,37 @@ import logging
 from telegram import Update
 from telegram.ext import ContextTypes
 import db_operations
-from utils.stats_helpers import update_all_stats
+from utils.date_helpers import get_daily_period_date
 
 logger = logging.getLogger(__name__)
 
 
+async def preview_orders_attribution(orders: list, new_group_id: str) -> dict:
+    """预览批量修改归属（不修改数据），返回 db_operations.reassign_orders 的汇总结果"""
+    return await db_operations.reassign_orders(
+        get_daily_period_date(), [order['order_id'] for order in orders],
+        new_group_id, dry_run=True)
+
+
+def format_attribution_preview(preview: dict, new_group_id: str) -> str:
+    """归属变更预览文本：按旧归属列出将迁移的有效/违约订单"""
+    lines = [f"🔄 归属变更预览 → {new_group_id}\n"]
+    for old_group_id in sorted(preview['groups']):
+        stats = preview['groups'][old_group_id]
+        lines.append(
+            f"{old_group_id}: 有效 {stats['valid_orders']} 个 ({stats['valid_amount']:,.2f}), "
+            f"违约 {stats['breach_orders']} 个 ({stats['breach_amount']:,.2f}), "
+            f"已完成 {stats['closed_orders']} 个")
+    lines.append("")
+    lines.append(f"将修改: {preview['moved']} 个订单")
+    if preview['unchanged']:
+        lines.append(f"已是 {new_group_id}: {preview['unchanged']} 个订单")
+    missing = preview['requested'] - preview['matched']
+    if missing:
+        lines.append(f"未找到: {missing} 个订单")
+    return "\n".join(lines)
+
+
 async def change_orders_attribution(
     update: Update,
     context: ContextTypes.DEFAULT_TYPE,
@@ -15,7 +41,7 @@ async def change_orders_attribution(
     new_group_id: str
 ) -> tuple[int, int]:
     """
-    批量修改订单归属
+    批量修改订单归属（一个事务：批量更新订单 + 按旧归属汇总迁移有效/违约统计）
     
     Args:
         update: Telegram Update对象
@@ -26,112 +52,23 @@ async def change_orders_attribution(
     Returns:
         (success_count, fail_count): 成功和失败的数量
     """
-    success_count = 0
-    fail_count = 0
-    
-    # 按旧归属ID分组，统计需要迁移的数据（只统计成功更新的订单）
-    old_group_stats = {}  # {old_group_id: {'valid': {'count': 0, 'amount': 0}, 'breach': {...}}}
-    
-    for order in orders:
-        chat_id = order['chat_id']
-        old_group_id = order['group_id']
-        amount = order.get('amount', 0)
-        state = order.get('state', 'normal')
-        
-        # 跳过已完成和违约完成的订单（这些订单的统计数据已经固定，不需要迁移）
-        if state in ['end', 'breach_end']:
-            # 仍然更新订单的归属ID（虽然不迁移统计数据）
-            try:
-                if await db_operations.update_order_group_id(chat_id, new_group_id):
-                    success_count += 1
-                else:
-                    fail_count += 1
-            except Exception as e:
-                logger.error(f"更新订单归属出错: {e}", exc_info=True)
-                fail_count += 1
-            continue
-        
-        # 先更新订单的归属ID
-        update_success = False
-        try:
-            if await db_operations.update_order_group_id(chat_id, new_group_id):
-                update_success = True
-                success_count += 1
-            else:
-                fail_count += 1
-                logger.warning(f"更新订单归属失败: chat_id={chat_id}, new_group_id={new_group_id}")
-        except Exception as e:
-            logger.error(f"更新订单归属出错: {e}", exc_info=True)
-            fail_count += 1
-        
-        # 只有成功更新的订单才统计迁移数据
-        if not update_success:
-            continue
-        
-        # 初始化旧归属统计
-        if old_group_id not in old_group_stats:
-            old_group_stats[old_group_id] = {
-                'valid': {'count': 0, 'amount': 0},
-                'breach': {'count': 0, 'amount': 0}
-            }
-        
-        # 根据订单状态分类统计
-        if state in ['normal', 'overdue']:
-            old_group_stats[old_group_id]['valid']['count'] += 1
-            old_group_stats[old_group_id]['valid']['amount'] += amount
-        elif state == 'breach':
-            old_group_stats[old_group_id]['breach']['count'] += 1
-            old_group_stats[old_group_id]['breach']['amount'] += amount
-    
-    # 迁移统计数据
-    # 从旧归属减少
-    for old_group_id, stats in old_group_stats.items():
-        # 减少有效订单
-        if stats['valid']['count'] > 0:
-            await update_all_stats(
-                'valid',
-                -stats['valid']['amount'],
-                -stats['valid']['count'],
-                old_group_id
-            )
-        
-        # 减少违约订单
-        if stats['breach']['count'] > 0:
-            await update_all_stats(
-                'breach',
-                -stats['breach']['amount'],
-                -stats['breach']['count'],
-                old_group_id
-            )
-    
-    # 汇总所有需要迁移的数据
-    total_valid_count = sum(s['valid']['count'] for s in old_group_stats.values())
-    total_valid_amount = sum(s['valid']['amount'] for s in old_group_stats.values())
-    total_breach_count = sum(s['breach']['count'] for s in old_group_stats.values())
-    total_breach_amount = sum(s['breach']['amount'] for s in old_group_stats.values())
-    
-    # 到新归属增加
-    if total_valid_count > 0:
-        await update_all_stats(
-            'valid',
-            total_valid_amount,
-            total_valid_count,
-            new_group_id
-        )
-    
-    if total_breach_count > 0:
-        await update_all_stats(
-            'breach',
-            total_breach_amount,
-            total_breach_count,
-            new_group_id
-        )
-    
+    order_ids = [order['order_id'] for order in orders]
+    result = await db_operations.reassign_orders(
+        get_daily_period_date(), order_ids, new_group_id)
+    if not result:
+        logger.warning(f"批量修改归属失败: {len(order_ids)} 个订单 -> {new_group_id}")
+        return 0, len(order_ids)
+
+    # 已经是新归属的订单也算成功
+    success_count = result['matched']
+    fail_count = result['requested'] - result['matched']
+    groups = result['groups'].values()
     logger.info(
         f"归属变更完成: {success_count} 成功, {fail_count} 失败, "
-        f"迁移到 {new_group_id}: 有效订单 {total_valid_count} 个 ({total_valid_amount:.2f}), "
-        f"违约订单 {total_breach_count} 个 ({total_breach_amount:.2f})"
+        f"迁移到 {new_group_id}: "
+        f"有效订单 {sum(s['valid_orders'] for s in groups)} 个 "
+        f"({sum(s['valid_amount'] for s in groups):.2f}), "
+        f"违约订单 {sum(s['breach_orders'] for s in groups)} 个 "
+        f"({sum(s['breach_amount'] for s in groups):.2f})"
     )
-    
     return success_count, fail_count
-
@@ -1,11 +1,11 @@
 """播报功能处理器"""
 import logging
-from datetime import datetime, timedelta
 from telegram import Update
 from telegram.ext import ContextTypes
 import db_operations
 from utils.chat_helpers import is_group_chat
 from decorators import authorized_required, group_chat_only
+from utils.payment_reminder import next_payment_date, render_order_reminder, render_payment_reminder
 
 logger = logging.getLogger(__name__)
 
@@ -22,30 +22,8 @@ async def broadcast_payment(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ 当前群组没有活跃订单")
         return
     
-    # 从订单获取本金
-    principal = order.get('amount', 0)
-    principal_12 = principal * 0.12
-    
-    # 计算下一个付款日期（下周五）
-    today = datetime.now()
-    days_until_friday = (4 - today.weekday()) % 7
-    if days_until_friday == 0:
-        days_until_friday = 7
-    next_friday = today + timedelta(days=days_until_friday)
-    
-    # 格式化日期（格式：October 31,2025）
-    date_str = next_friday.strftime("%B %d,%Y")
-    weekday_str = next_friday.strftime("%A")
-    
-    # 格式化金额（添加千位分隔符）
-    principal_formatted = f"{principal:,.0f}"
-    principal_12_formatted = f"{principal_12:,.0f}"
-    
-    # 构建并发送模板消息
-    message = (
-        f"Your next payment is due on {date_str} ({weekday_str}) "
-        f"for {principal_formatted} or {principal_12_formatted} to defer the principal payment for one week."
-    )
+    # 按订单本金生成提醒（本金 或 本金12%，下周五付款）
+    message = render_order_reminder(order.get('amount', 0))
     
     try:
         await context.bot.send_message(chat_id=chat_id, text=message)
@@ -132,23 +110,10 @@ async def send_broadcast_message(update: Update, context: ContextTypes.DEFAULT_T
     principal_12 = data.get('principal_12', 0)
     outstanding_interest = data.get('outstanding_interest', 0)
     
-    # 计算下一个付款日期（假设是下周五）
-    today = datetime.now()
-    days_until_friday = (4 - today.weekday()) % 7
-    if days_until_friday == 0:
-        days_until_friday = 7
-    next_friday = today + timedelta(days=days_until_friday)
-    
-    # 格式化日期
-    date_str = next_friday.strftime("%B %d, %Y")
-    weekday_str = next_friday.strftime("%A")
-    
-    # 构建消息 - 发送本金版本
-    message = (
-        f"Your next payment is due on {date_str} ({weekday_str}) "
-        f"for {principal:.2f} to defer the principal payment for one week.\n\n"
-        f"Your outstanding interest is {outstanding_interest:.2f}."
-    )
+    # 本金版本（下周五付款）
+    due = next_payment_date()
+    message = render_payment_reminder(
+        [principal], due, outstanding_interest=outstanding_interest, decimals=2)
     
     # 发送消息到当前群组
     try:
@@ -157,8 +122,7 @@ async def send_broadcast_message(update: Update, context: ContextTypes.DEFAULT_T
         # 保存数据到context，用于后续发送
         context.user_data['broadcast_principal_12'] = principal_12
         context.user_data['broadcast_outstanding_interest'] = outstanding_interest
-        context.user_data['broadcast_date_str'] = date_str
-        context.user_data['broadcast_weekday_str'] = weekday_str
+        context.user_data['broadcast_due_date'] = due
         
         # 询问是否发送本金12%版本
         from telegram import InlineKeyboardButton, InlineKeyboardMarkup
@@ -3,9 +3,10 @@ import logging
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import db_operations
+import db_cache
 from utils.chat_helpers import is_group_chat
 from utils.order_helpers import try_create_order_from_title
-from utils.stats_helpers import update_liquid_capital, update_all_stats
+from utils.stats_helpers import new_stats_delta, apply_stats
 from utils.date_helpers import get_daily_period_date
 from utils.message_helpers import display_search_results_helper
 from decorators import error_handler, admin_required, authorized_required, private_chat_only, group_chat_only
@@ -52,7 +53,12 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         "/list_attributions - 列出归属ID\n"
         "/add_employee <ID> - 添加员工\n"
         "/remove_employee <ID> - 移除员工\n"
-        "/list_employees - 列出员工\n\n"
+        "/list_employees - 列出员工\n"
+        "/rebuild_stats [apply] - 按流水校验/重建统计\n"
+        "/cache_stats - 查看缓存命中率\n"
+        "/update_stats - 查看消息处理队列\n"
+        "/import - 批量导入历史订单\n"
+        "/export - 导出订单/日结/开销 CSV\n\n"
         "⚠️ 部分操作需要管理员权限".format(
             financial_data['liquid_funds'])
     )
@@ -157,7 +163,7 @@ async def adjust_funds(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     # 更新财务数据
-    await update_liquid_capital(amount)
+    await apply_stats(new_stats_delta('adjust', amount=amount, note=note).add_liquid(amount))
 
     financial_data = await db_operations.get_financial_data()
     await update.message.reply_text(
@@ -199,15 +205,16 @@ async def create_attribution(update: Update, context: ContextTypes.DEFAULT_TYPE)
 @private_chat_only
 async def list_attributions(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """列出所有归属ID"""
-    group_ids = await db_operations.get_all_group_ids()
+    # 一次查询取出所有归属ID的数据
+    all_data = await db_operations.get_grouped_data()
 
-    if not group_ids:
+    if not all_data:
         await update.message.reply_text("暂无归属ID，使用 /create_attribution <ID> 创建")
         return
 
     message = "📋 所有归属ID:\n\n"
-    for i, group_id in enumerate(sorted(group_ids), 1):
-        data = await db_operations.get_grouped_data(group_id)
+    for i, group_id in enumerate(sorted(all_data), 1):
+        data = all_data[group_id]
         message += (
             f"{i}. {group_id}\n"
             f"   有效订单: {data['valid_orders']} | "
@@ -267,3 +274,98 @@ async def list_employees(update: Update, context: ContextTypes.DEFAULT_TYPE):
         message += f"👤 `{uid}`\n"
 
     await update.message.reply_text(message, parse_mode='Markdown')
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def rebuild_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """按 order_events 流水重放统计数据（默认只校验，/rebuild_stats apply 覆盖写入）"""
+    apply = bool(context.args) and context.args[0].lower() == 'apply'
+    await update.message.reply_text("⏳ 正在重放流水...")
+
+    result = await db_operations.rebuild_stats_from_ledger(apply)
+    if not result:
+        await update.message.reply_text("❌ 重放失败，请查看日志")
+        return
+
+    drift = result['drift']
+    message = f"📒 流水事件数: {result['events']}\n"
+    if not drift:
+        message += "✅ 统计数据与流水一致"
+    else:
+        message += f"⚠️ 发现 {len(drift)} 处差异:\n"
+        message += "\n".join(drift[:20])
+        if len(drift) > 20:
+            message += f"\n... 另有 {len(drift) - 20} 处"
+        if result['applied']:
+            message += "\n\n✅ 已按流水重建统计数据"
+        else:
+            message += "\n\n使用 /rebuild_stats apply 按流水重建"
+    await update.message.reply_text(message)
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def show_cache_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """查看进程内缓存的命中情况和写入批次统计"""
+    auth = db_cache.authorized_users.stats()
+    orders = db_cache.active_orders.stats()
+    reports = db_cache.report_stats.stats()
+    rendered = db_cache.rendered_reports.stats()
+    writes = db_operations.get_write_stats()
+    histogram = ", ".join(f"{size}: {count}" for size, count in writes['histogram'].items())
+    message = (
+        "🗄️ 缓存统计\n\n"
+        "👤 授权用户:\n"
+        f"  数量: {auth['size']}\n"
+        f"  命中/未命中: {auth['hits']}/{auth['misses']} ({auth['hit_ratio']:.1%})\n"
+        f"  加载次数: {auth['loads']}\n\n"
+        "📋 有效订单:\n"
+        f"  条目: {orders['size']}/{orders['max_size']}\n"
+        f"  命中/空结果命中/未命中: {orders['hits']}/{orders['negative_hits']}/{orders['misses']}"
+        f" ({orders['hit_ratio']:.1%})\n"
+        f"  淘汰次数: {orders['evictions']}\n\n"
+        "📊 报表区间统计:\n"
+        f"  条目: {reports['size']}/{reports['max_size']}\n"
+        f"  命中/未命中: {reports['hits']}/{reports['misses']} ({reports['hit_ratio']:.1%})\n"
+        f"  失效条目: {reports['invalidations']}\n\n"
+        "🧾 预先生成的今日报表:\n"
+        f"  日期: {rendered['date'] or '无'} | 条目: {rendered['size']}\n"
+        f"  命中/未命中: {rendered['hits']}/{rendered['misses']} ({rendered['hit_ratio']:.1%})\n"
+        f"  失效条目: {rendered['invalidations']}\n\n"
+        "✍️ 写入批次:\n"
+        f"  批次/请求: {writes['batches']}/{writes['requests']} (排队中: {writes['pending']})\n"
+        f"  平均/最大批大小: {writes['avg_batch']:.1f}/{writes['max_batch']}\n"
+        f"  平均等待: {writes['avg_wait_ms']:.2f} ms | 平均提交: {writes['avg_commit_ms']:.2f} ms\n"
+        f"  批大小分布: {histogram}\n"
+        f"  整批失败重试: {writes['fallbacks']}"
+    )
+    await update.message.reply_text(message)
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def show_update_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """查看更新处理器的并发和按群/用户排队情况"""
+    processor = context.application.update_processor
+    if not hasattr(processor, 'stats'):
+        await update.message.reply_text("⚠️ 未启用按群并发处理")
+        return
+
+    stats = processor.stats()
+    message = (
+        "⚙️ 消息处理队列\n\n"
+        f"执行中: {stats['active']}/{stats['concurrency']}\n"
+        f"已接收未完成: {stats['in_flight']}/{stats['max_in_flight']}\n"
+        f"已处理: {stats['processed']}\n"
+        f"排队的群/用户: {stats['queued_keys']}\n"
+        f"历史最大排队: {stats['max_depth']}\n"
+    )
+    if stats['top_queues']:
+        message += "\n排队最多:\n"
+        for (kind, key_id), depth in stats['top_queues']:
+            message += f"  {'群' if kind == 'chat' else '用户'} {key_id}: {depth}\n"
+    await update.message.reply_text(message)
@@ -0,0 +1,91 @@
+"""数据导出处理器（/export，管理员私聊）"""
+import os
+import re
+import tempfile
+import logging
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes
+import db_operations
+from decorators import error_handler, admin_required, private_chat_only
+
+logger = logging.getLogger(__name__)
+
+# Telegram 机器人上传文件大小上限（字节）
+EXPORT_MAX_UPLOAD_BYTES = 50 * 1024 * 1024
+
+EXPORT_HELP = (
+    "📤 数据导出\n\n"
+    "/export orders [开始日期] [结束日期] [归属ID] [gz]\n"
+    "/export daily [开始日期] [结束日期] [归属ID|ALL] [gz]\n"
+    "/export expenses [开始日期] [结束日期] [gz]\n\n"
+    "日期格式 YYYY-MM-DD，只写一个日期表示当天；gz 表示压缩\n"
+    "daily 不写归属ID导出全部（全局+各归属），ALL 只导出全局"
+)
+
+
+def parse_export_args(args: list) -> dict:
+    """解析 /export 参数，格式错误时抛出 ValueError"""
+    if not args or args[0].lower() not in db_operations.EXPORT_KINDS:
+        raise ValueError("unknown export kind")
+    options = {'kind': args[0].lower(), 'start_date': None, 'end_date': None,
+               'group_id': None, 'compress': False}
+    dates = []
+    for arg in args[1:]:
+        if re.fullmatch(r'\d{4}-\d{2}-\d{2}', arg):
+            datetime.strptime(arg, '%Y-%m-%d')
+            dates.append(arg)
+        elif arg.lower() in ('gz', 'gzip'):
+            options['compress'] = True
+        elif options['kind'] != 'expenses' and options['group_id'] is None:
+            options['group_id'] = arg.upper()
+        else:
+            raise ValueError(f"unexpected argument: {arg}")
+    if len(dates) > 2:
+        raise ValueError("too many dates")
+    if dates:
+        options['start_date'] = dates[0]
+        options['end_date'] = dates[-1]
+    return options
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def export_data(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """导出订单/日结/开销为 CSV 文件（流式写入临时文件后发送）"""
+    try:
+        options = parse_export_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(EXPORT_HELP)
+        return
+
+    kind = options.pop('kind')
+    compress = options['compress']
+    suffix = '.csv.gz' if compress else '.csv'
+    parts = [kind, options['group_id'], options['start_date'], options['end_date']]
+    filename = '_'.join(p for p in parts if p) + suffix
+
+    status_message = await update.message.reply_text(f"⏳ 正在导出 {filename} ...")
+    fd, path = tempfile.mkstemp(prefix='export_', suffix=suffix)
+    os.close(fd)
+    try:
+        # 导出在独立线程和只读连接中执行，不阻塞事件循环
+        count = await db_operations.export_csv(kind, path, **options)
+        size = os.path.getsize(path)
+        if size > EXPORT_MAX_UPLOAD_BYTES:
+            await status_message.edit_text(
+                f"❌ 文件过大（{size / 1024 / 1024:.1f} MB，{count} 行），"
+                f"请缩小日期范围{'' if compress else '或加 gz 压缩'}")
+            return
+
+        with open(path, 'rb') as f:
+            await update.message.reply_document(
+                document=f, filename=filename,
+                caption=f"📤 {kind}: {count} 行 ({size / 1024:.1f} KB)")
+        await status_message.delete()
+    finally:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"删除导出临时文件失败: {e}")
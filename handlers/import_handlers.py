@@ -0,0 +1,91 @@
+"""历史订单导入处理器（管理员私聊发送 CSV/JSONL 文件，附言 /import）"""
+import os
+import time
+import logging
+import tempfile
+from datetime import datetime
+from telegram import Update
+from telegram.ext import ContextTypes
+from utils.order_import import detect_import_format, read_import_rows, import_orders
+from decorators import error_handler, admin_required, private_chat_only
+
+logger = logging.getLogger(__name__)
+
+# 导入进度消息的刷新间隔（秒）
+IMPORT_PROGRESS_INTERVAL = 3
+
+IMPORT_HELP = (
+    "📥 历史订单导入\n\n"
+    "发送 CSV 或 JSONL 文件，并在文件附言中填写 /import\n\n"
+    "每行二选一：\n"
+    "1. chat_id, title（群名，如 A2401150105）[, state, group_id]\n"
+    "2. chat_id, order_id, date, amount [, customer, state, group_id]\n\n"
+    "只导入历史订单（不扣流动资金），被拒绝的行会以文件形式返回"
+)
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def show_import_help(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """/import 导入说明"""
+    await update.message.reply_text(IMPORT_HELP)
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def handle_import_document(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """导入附言为 /import 的文件"""
+    document = update.message.document
+    fmt = detect_import_format(document.file_name)
+    if not fmt:
+        await update.message.reply_text("❌ 仅支持 .csv / .jsonl 文件")
+        return
+
+    status_message = await update.message.reply_text(f"⏳ 正在导入 {document.file_name} ...")
+    # 文件先下载到临时文件，逐行读取、分块导入；被拒绝的行也写入临时文件，不整份读入内存
+    fd, source_path = tempfile.mkstemp(prefix='import_', suffix=f'.{fmt}')
+    os.close(fd)
+    fd, rejected_path = tempfile.mkstemp(prefix='import_rejected_', suffix='.csv')
+    os.close(fd)
+    last_edit = time.monotonic()
+
+    async def progress(stats):
+        nonlocal last_edit
+        if time.monotonic() - last_edit < IMPORT_PROGRESS_INTERVAL:
+            return
+        last_edit = time.monotonic()
+        try:
+            await status_message.edit_text(
+                f"⏳ 导入中: {stats['total']} 行, 已导入 {stats['inserted']}, "
+                f"拒绝 {stats['rejected']} ({stats['rows_per_sec']:.0f} 行/秒)")
+        except Exception as e:
+            logger.debug(f"更新导入进度失败: {e}")
+
+    try:
+        tg_file = await document.get_file()
+        await tg_file.download_to_drive(source_path)
+        with open(source_path, encoding='utf-8-sig', newline='') as source, \
+                open(rejected_path, 'w', encoding='utf-8-sig', newline='') as rejected:
+            stats = await import_orders(read_import_rows(source, fmt), rejected, progress=progress)
+
+        await status_message.edit_text(
+            f"✅ 导入完成\n\n"
+            f"总行数: {stats['total']}\n"
+            f"已导入: {stats['inserted']}\n"
+            f"拒绝: {stats['rejected']}\n"
+            f"耗时: {stats['seconds']:.2f} 秒 ({stats['rows_per_sec']:.0f} 行/秒)")
+
+        if stats['rejected']:
+            filename = f"rejected_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+            with open(rejected_path, 'rb') as f:
+                await update.message.reply_document(
+                    document=f, filename=filename,
+                    caption=f"❌ 被拒绝的 {stats['rejected']} 行")
+    finally:
+        for path in (source_path, rejected_path):
+            try:
+                os.remove(path)
+            except OSError as e:
+                logger.warning(f"删除导入临时文件失败: {e}")
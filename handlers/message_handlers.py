@@ -5,10 +5,10 @@ from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import db_operations
 from utils.chat_helpers import is_group_chat
-from utils.order_helpers import try_create_order_from_title, update_order_state_from_title
+from utils.order_helpers import try_create_order_from_title, update_order_state_from_title, check_order_command
 from utils.date_helpers import get_daily_period_date
 from utils.message_helpers import display_search_results_helper
-from utils.stats_helpers import update_all_stats, update_liquid_capital
+from utils.broadcast_engine import start_broadcast
 from constants import USER_STATES
 
 logger = logging.getLogger(__name__)
@@ -180,22 +180,14 @@ async def _handle_breach_end_amount(update: Update, context: ContextTypes.DEFAUL
             context.user_data['state'] = None
             return
 
-        order = await db_operations.get_order_by_chat_id(chat_id)
-        if not order or order['state'] != 'breach':
-            msg = "❌ Order state changed or not found"
-            await update.message.reply_text(msg)
+        # 执行完成逻辑：订单状态、违约完成统计、流动资金在同一事务中更新
+        result = await db_operations.end_breach_order(
+            get_daily_period_date(), chat_id, amount)
+        if not await check_order_command(
+                result, update.message.reply_text, "❌ Order state changed or not found"):
             context.user_data['state'] = None
             return
-
-        # 执行完成逻辑
-        await db_operations.update_order_state(chat_id, 'breach_end')
-        group_id = order['group_id']
-
-        # 违约完成订单增加，金额增加
-        await update_all_stats('breach_end', amount, 1, group_id)
-
-        # 更新流动资金
-        await update_liquid_capital(amount)
+        order = result['order']
 
         msg_en = f"✅ Breach Order Ended\nAmount: {amount:.2f}"
 
@@ -700,22 +692,11 @@ async def _handle_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE,
         context.user_data['state'] = None
         return
 
-    success_count = 0
-    fail_count = 0
-
-    await update.message.reply_text(f"⏳ Sending message to {len(locked_groups)} groups...")
-
-    for chat_id in locked_groups:
-        try:
-            await context.bot.send_message(chat_id=chat_id, text=text)
-            success_count += 1
-        except Exception as e:
-            logger.error(f"群发失败 {chat_id}: {e}")
-            fail_count += 1
-
-    await update.message.reply_text(
-        f"✅ Broadcast Completed\n"
-        f"Success: {success_count}\n"
-        f"Failed: {fail_count}"
-    )
+    # 后台限速发送，进度通过编辑同一条消息显示
+    job_id = await start_broadcast(
+        context.bot, text, locked_groups,
+        created_by=update.effective_user.id if update.effective_user else None,
+        status_chat_id=update.effective_chat.id)
+    if not job_id:
+        await update.message.reply_text("❌ Failed to create broadcast job")
     context.user_data['state'] = None
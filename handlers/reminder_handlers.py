@@ -0,0 +1,71 @@
+"""付款提醒活动处理器（/remind_all，管理员私聊）"""
+import logging
+from telegram import Update
+from telegram.ext import ContextTypes
+import db_operations
+from constants import WEEKDAY_GROUP
+from decorators import error_handler, admin_required, private_chat_only
+from utils.payment_reminder import (
+    REMINDER_STATES, build_reminder_targets, describe_campaign, start_reminder_campaign
+)
+
+logger = logging.getLogger(__name__)
+
+REMIND_HELP = (
+    "🔔 付款提醒活动\n\n"
+    "/remind_all [星期] [归属ID] [normal|overdue|breach ...] [preview]\n\n"
+    "星期为 一 ~ 日，不写表示全部；状态默认 normal overdue\n"
+    "preview 只显示群数和示例文本，不发送"
+)
+
+
+def parse_remind_args(args: list) -> dict:
+    """解析 /remind_all 参数，格式错误时抛出 ValueError"""
+    options = {'weekday_group': None, 'group_id': None, 'states': [], 'preview': False}
+    for arg in args:
+        lowered = arg.lower()
+        if arg in WEEKDAY_GROUP.values() and options['weekday_group'] is None:
+            options['weekday_group'] = arg
+        elif lowered in db_operations.REMINDER_ORDER_STATES:
+            if lowered not in options['states']:
+                options['states'].append(lowered)
+        elif lowered == 'preview':
+            options['preview'] = True
+        elif options['group_id'] is None:
+            options['group_id'] = arg.upper()
+        else:
+            raise ValueError(f"unexpected argument: {arg}")
+    options['states'] = tuple(options['states']) or REMINDER_STATES
+    return options
+
+
+@error_handler
+@admin_required
+@private_chat_only
+async def remind_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """向所有符合条件的有效订单群发送付款提醒（后台群发，显示进度）"""
+    try:
+        options = parse_remind_args(context.args or [])
+    except ValueError:
+        await update.message.reply_text(REMIND_HELP)
+        return
+
+    description = describe_campaign(options['weekday_group'], options['group_id'], options['states'])
+    if options['preview']:
+        orders = await db_operations.get_reminder_orders(
+            options['weekday_group'], options['group_id'], options['states'])
+        targets = build_reminder_targets(orders)
+        if not targets:
+            await update.message.reply_text(f"❌ {description}: 没有符合条件的订单")
+            return
+        await update.message.reply_text(
+            f"🔔 {description}: {len(targets)} 个群\n\n示例:\n{targets[0][1]}")
+        return
+
+    job_id, count = await start_reminder_campaign(
+        context.bot, options['weekday_group'], options['group_id'], options['states'],
+        created_by=update.effective_user.id, status_chat_id=update.effective_chat.id)
+    if not job_id:
+        await update.message.reply_text(f"❌ {description}: 没有符合条件的订单")
+        return
+    await update.message.reply_text(f"✅ {description}: 已开始向 {count} 个群发送（任务 #{job_id}）")
@@ -1,50 +1,60 @@
 """报表相关处理器"""
+import html
 import logging
 from datetime import datetime
+from typing import Dict, List, Tuple
 import pytz
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 import db_operations
+import db_cache
 from utils.date_helpers import get_daily_period_date
 from decorators import error_handler, authorized_required, private_chat_only
 
 logger = logging.getLogger(__name__)
 
 
-async def generate_report_text(period_type: str, start_date: str, end_date: str, group_id: str = None) -> str:
-    """生成报表文本"""
-    # 获取当前状态数据（资金和有效订单）
+def _format_stock_change(stock: Dict) -> str:
+    """期初 → 期末存量（变化）"""
+    opening, closing, change = stock['opening'], stock['closing'], stock['change']
+    return (
+        f"💰 【期初 → 期末】\n"
+        f"有效订单数: {opening['valid_orders']:.0f} → {closing['valid_orders']:.0f} "
+        f"({change['valid_orders']:+.0f})\n"
+        f"有效订单金额: {opening['valid_amount']:.2f} → {closing['valid_amount']:.2f} "
+        f"({change['valid_amount']:+.2f})\n"
+        f"现金余额: {opening['liquid_funds']:.2f} → {closing['liquid_funds']:.2f} "
+        f"({change['liquid_funds']:+.2f})\n"
+    )
+
+
+async def _current_stock_text(group_id: str = None) -> Tuple[str, float]:
+    """当前状态（有效订单和现金余额），返回 (文本, 现金余额)"""
     if group_id:
         current_data = await db_operations.get_grouped_data(group_id)
-        report_title = f"归属ID {group_id} 的报表"
     else:
         current_data = await db_operations.get_financial_data()
-        report_title = "全局报表"
-
-    # 获取周期统计数据
-    stats = await db_operations.get_stats_by_date_range(
-        start_date, end_date, group_id)
+    stock_text = (
+        f"💰 【当前状态】\n"
+        f"有效订单数: {current_data['valid_orders']}\n"
+        f"有效订单金额: {current_data['valid_amount']:.2f}\n"
+    )
+    return stock_text, current_data['liquid_funds']
 
-    # 格式化时间
-    tz = pytz.timezone('Asia/Shanghai')
-    now = datetime.now(tz).strftime("%Y-%m-%d %H:%M")
 
-    period_display = ""
+def _period_display(period_type: str, start_date: str, end_date: str) -> str:
     if period_type == "today":
-        period_display = f"今日数据 ({start_date})"
-    elif period_type == "month":
-        period_display = f"本月数据 ({start_date[:-3]})"
-    else:
-        period_display = f"区间数据 ({start_date} 至 {end_date})"
+        return f"今日数据 ({start_date})"
+    if period_type == "month":
+        return f"本月数据 ({start_date[:-3]})"
+    if period_type == "close":
+        return f"日结数据 ({start_date})"
+    return f"区间数据 ({start_date} 至 {end_date})"
 
-    report = (
-        f"=== {report_title} ===\n"
-        f"📅 {now}\n"
-        f"{'─' * 25}\n"
-        f"💰 【当前状态】\n"
-        f"有效订单数: {current_data['valid_orders']}\n"
-        f"有效订单金额: {current_data['valid_amount']:.2f}\n"
-        f"{'─' * 25}\n"
+
+def _format_period_stats(period_display: str, stats: Dict) -> str:
+    """周期统计和开销（不含余额，只随日结数据变化）"""
+    return (
         f"📈 【{period_display}】\n"
         f"流动资金: {stats['liquid_flow']:.2f}\n"
         f"新客户数: {stats['new_clients']}\n"
@@ -62,9 +72,133 @@ async def generate_report_text(period_type: str, start_date: str, end_date: str,
         f"💸 【开销与余额】\n"
         f"公司开销: {stats['company_expenses']:.2f}\n"
         f"其他开销: {stats['other_expenses']:.2f}\n"
-        f"现金余额: {current_data['liquid_funds']:.2f}\n"
     )
-    return report
+
+
+def _assemble_report(group_id: str, stock_text: str, period_text: str, liquid_funds: float) -> str:
+    """标题、时间、存量、周期统计、现金余额"""
+    report_title = f"归属ID {group_id} 的报表" if group_id else "全局报表"
+    # 格式化时间
+    tz = pytz.timezone('Asia/Shanghai')
+    now = datetime.now(tz).strftime("%Y-%m-%d %H:%M")
+    return (
+        f"=== {report_title} ===\n"
+        f"📅 {now}\n"
+        f"{'─' * 25}\n"
+        f"{stock_text}"
+        f"{'─' * 25}\n"
+        f"{period_text}"
+        f"现金余额: {liquid_funds:.2f}\n"
+    )
+
+
+async def generate_report_text(period_type: str, start_date: str, end_date: str, group_id: str = None) -> str:
+    """生成报表文本（今日报表显示当前存量，其他周期显示期初/期末存量）"""
+    if period_type == "today":
+        stock_text, liquid_funds = await _current_stock_text(group_id)
+    else:
+        # 按日终存量：期初为开始日期前一天日终，期末为结束日期日终
+        stock = await db_operations.get_stock_change(start_date, end_date, group_id)
+        stock_text = _format_stock_change(stock)
+        liquid_funds = stock['closing']['liquid_funds']
+
+    # 获取周期统计数据
+    stats = await db_operations.get_stats_by_date_range(
+        start_date, end_date, group_id)
+    period_text = _format_period_stats(_period_display(period_type, start_date, end_date), stats)
+    return _assemble_report(group_id, stock_text, period_text, liquid_funds)
+
+
+async def _today_period_text(date: str, group_id: str = None) -> str:
+    """今日统计部分：优先使用缓存，该日期全局/该归属的日结数据写入后重新生成"""
+    key = (date, group_id)
+    period_text = db_cache.rendered_reports.get(key)
+    if period_text is None:
+        version = db_cache.rendered_reports.version()
+        stats = await db_operations.get_stats_by_date_range(date, date, group_id)
+        period_text = _format_period_stats(_period_display("today", date, date), stats)
+        db_cache.rendered_reports.put(key, period_text, version)
+    return period_text
+
+
+async def get_today_report_text(date: str, group_id: str = None) -> str:
+    """今日报表：统计部分使用日结时预先生成的文本，当前余额和时间在读取时填入"""
+    period_text = await _today_period_text(date, group_id)
+    stock_text, liquid_funds = await _current_stock_text(group_id)
+    return _assemble_report(group_id, stock_text, period_text, liquid_funds)
+
+
+async def prerender_today_reports(date: str, group_ids: List[str]) -> int:
+    """预先生成全局和各归属今日报表的统计部分，返回生成的数量"""
+    for group_id in [None] + list(group_ids):
+        await _today_period_text(date, group_id)
+    return len(group_ids) + 1
+
+
+# Telegram 单条消息上限 4096 字符，留出 <pre> 标签和标题的余量
+LEADERBOARD_CHUNK_SIZE = 3800
+
+
+async def generate_leaderboard_text(period_type: str, start_date: str, end_date: str) -> List[str]:
+    """
+    生成所有归属ID的排行榜（一次查询，按周期利息从高到低排序）
+    :return: 消息列表（HTML，每条不超过 Telegram 长度限制）
+    """
+    rows = await db_operations.get_attribution_report(start_date, end_date)
+
+    if period_type == "today":
+        period_display = f"今日排行 ({start_date})"
+    elif period_type == "month":
+        period_display = f"本月排行 ({start_date[:-3]})"
+    else:
+        period_display = f"区间排行 ({start_date} 至 {end_date})"
+
+    if not rows:
+        return [f"🏆 {html.escape(period_display)}\n\n暂无归属ID"]
+
+    rows.sort(key=lambda r: (-r['period']['interest'], r['group_id']))
+
+    id_width = max(4, max(len(r['group_id']) for r in rows))
+    # 中文标题在等宽字体中占两个字符宽度
+    header = f"{'ID':<{id_width}}" + "".join(
+        " " * (width - 2 * len(name)) + name
+        for name, width in (('有效金额', 13), ('新客', 6), ('利息', 12), ('完成', 6), ('违约', 6)))
+    lines = []
+    for row in rows:
+        current, period = row['current'], row['period']
+        lines.append(
+            f"{row['group_id']:<{id_width}} "
+            f"{current['valid_amount']:>12.2f} "
+            f"{period['new_clients']:>5} "
+            f"{period['interest']:>11.2f} "
+            f"{period['completed_orders']:>5} "
+            f"{period['breach_orders']:>5}"
+        )
+
+    total_interest = sum(r['period']['interest'] for r in rows)
+    title = (f"🏆 {html.escape(period_display)}\n"
+             f"归属ID: {len(rows)} 个 | 利息合计: {total_interest:.2f}\n")
+
+    # 按行切分，每条消息都带表头
+    chunks = []
+    current_lines: List[str] = []
+    size = 0
+    for line in lines:
+        if current_lines and size + len(line) + 1 > LEADERBOARD_CHUNK_SIZE:
+            chunks.append(current_lines)
+            current_lines, size = [], 0
+        current_lines.append(line)
+        size += len(line) + 1
+
+    if current_lines:
+        chunks.append(current_lines)
+
+    messages = []
+    for i, chunk in enumerate(chunks):
+        body = html.escape("\n".join([header] + chunk))
+        prefix = title if i == 0 else f"🏆 ({i + 1}/{len(chunks)})\n"
+        messages.append(f"{prefix}<pre>{body}</pre>")
+    return messages
 
 
 @error_handler
@@ -72,19 +206,14 @@ async def generate_report_text(period_type: str, start_date: str, end_date: str,
 @authorized_required
 async def show_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """显示报表"""
-    # 默认为今日报表
-    period_type = "today"
     group_id = None
 
     # 处理参数
     if context.args:
         group_id = context.args[0]
 
-    # 获取今日日期
-    daily_date = get_daily_period_date()
-
-    # 生成报表
-    report_text = await generate_report_text(period_type, daily_date, daily_date, group_id)
+    # 今日报表（日结后第一次查询直接使用预先生成的文本）
+    report_text = await get_today_report_text(get_daily_period_date(), group_id)
 
     # 构建按钮（中文）
     keyboard = [
@@ -1,194 +1,207 @@
-"""定时播报处理器"""
-import logging
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import ContextTypes
-import db_operations
-from constants import USER_STATES
-
-logger = logging.getLogger(__name__)
-
-
-async def show_schedule_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """显示定时播报菜单"""
-    broadcasts = await db_operations.get_all_scheduled_broadcasts()
-    
-    # 创建槽位字典
-    slots = {1: None, 2: None, 3: None}
-    for broadcast in broadcasts:
-        slots[broadcast['slot']] = broadcast
-    
-    message = "⏰ 定时播报管理\n\n"
-    for slot in [1, 2, 3]:
-        broadcast = slots[slot]
-        if broadcast and broadcast['is_active']:
-            status = "✅ 激活"
-            time_str = broadcast['time']
-            # 计算群组显示文本（避免复杂的条件表达式）
-            if broadcast['chat_title']:
-                chat_str = broadcast['chat_title']
-            elif broadcast['chat_id']:
-                chat_str = f"群组ID: {broadcast['chat_id']}"
-            else:
-                chat_str = "未设置"
-            msg_preview = broadcast['message'][:20] + "..." if len(broadcast['message']) > 20 else broadcast['message']
-        else:
-            status = "❌ 未设置"
-            time_str = "未设置"
-            chat_str = "未设置"
-            msg_preview = "未设置"
-        
-        message += f"📌 播报 {slot}:\n"
-        message += f"   状态: {status}\n"
-        message += f"   时间: {time_str}\n"
-        message += f"   群组: {chat_str}\n"
-        message += f"   内容: {msg_preview}\n\n"
-    
-    keyboard = []
-    for slot in [1, 2, 3]:
-        broadcast = slots[slot]
-        if broadcast:
-            button_text = f"编辑播报 {slot}" if broadcast['is_active'] else f"设置播报 {slot}"
-        else:
-            button_text = f"设置播报 {slot}"
-        keyboard.append([InlineKeyboardButton(button_text, callback_data=f"schedule_setup_{slot}")])
-    
-    keyboard.append([InlineKeyboardButton("刷新", callback_data="schedule_refresh")])
-    
-    await update.message.reply_text(
-        message,
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
-
-
-async def handle_schedule_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """处理定时播报的文本输入"""
-    user_state = context.user_data.get('state', '')
-    
-    if not user_state.startswith('SCHEDULE_'):
-        return False
-    
-    # 解析状态：SCHEDULE_TIME_1, SCHEDULE_CHAT_1, SCHEDULE_MESSAGE_1
-    parts = user_state.split('_')
-    if len(parts) < 3:
-        return False
-    
-    field = parts[1]  # TIME, CHAT, MESSAGE
-    slot = int(parts[2])  # 1, 2, 3
-    
-    text = update.message.text.strip()
-    
-    if field == 'TIME':
-        # 验证时间格式 (HH:MM 或 HH)
-        time_parts = text.split(':')
-        if len(time_parts) == 1:
-            # 只有小时，如 "22"
-            try:
-                hour = int(time_parts[0])
-                if 0 <= hour <= 23:
-                    time_str = f"{hour:02d}:00"
-                else:
-                    await update.message.reply_text("❌ 小时必须在0-23之间")
-                    return True
-            except ValueError:
-                await update.message.reply_text("❌ 时间格式错误，请输入小时（0-23）或小时:分钟（如 22:30）")
-                return True
-        elif len(time_parts) == 2:
-            # 小时:分钟，如 "22:30"
-            try:
-                hour = int(time_parts[0])
-                minute = int(time_parts[1])
-                if 0 <= hour <= 23 and 0 <= minute <= 59:
-                    time_str = f"{hour:02d}:{minute:02d}"
-                else:
-                    await update.message.reply_text("❌ 时间格式错误，小时必须在0-23之间，分钟必须在0-59之间")
-                    return True
-            except ValueError:
-                await update.message.reply_text("❌ 时间格式错误，请输入小时（0-23）或小时:分钟（如 22:30）")
-                return True
-        else:
-            await update.message.reply_text("❌ 时间格式错误，请输入小时（0-23）或小时:分钟（如 22:30）")
-            return True
-        
-        # 保存时间
-        if 'schedule_data' not in context.user_data:
-            context.user_data['schedule_data'] = {}
-        if slot not in context.user_data['schedule_data']:
-            context.user_data['schedule_data'][slot] = {}
-        context.user_data['schedule_data'][slot]['time'] = time_str
-        
-        await update.message.reply_text(f"✅ 时间已设置为: {time_str}\n\n请选择或输入群组：")
-        context.user_data['state'] = f'SCHEDULE_CHAT_{slot}'
-        return True
-    
-    elif field == 'CHAT':
-        # 尝试查找群组
-        # 首先尝试通过群名查找（从订单中）
-        # 这里简化处理：如果输入的是数字，当作chat_id；否则当作群名
-        chat_id = None
-        chat_title = None
-        
-        try:
-            # 尝试作为chat_id解析
-            chat_id = int(text)
-            chat_title = f"群组ID: {chat_id}"
-        except ValueError:
-            # 作为群名处理
-            chat_title = text
-            # 尝试从订单中查找匹配的chat_id
-            # 这里简化：直接使用输入的文本作为群名
-        
-        # 保存群组信息
-        if 'schedule_data' not in context.user_data:
-            context.user_data['schedule_data'] = {}
-        if slot not in context.user_data['schedule_data']:
-            context.user_data['schedule_data'][slot] = {}
-        context.user_data['schedule_data'][slot]['chat_id'] = chat_id
-        context.user_data['schedule_data'][slot]['chat_title'] = chat_title
-        
-        await update.message.reply_text(f"✅ 群组已设置为: {chat_title}\n\n请输入播报内容：")
-        context.user_data['state'] = f'SCHEDULE_MESSAGE_{slot}'
-        return True
-    
-    elif field == 'MESSAGE':
-        # 保存消息内容
-        if 'schedule_data' not in context.user_data:
-            context.user_data['schedule_data'] = {}
-        if slot not in context.user_data['schedule_data']:
-            context.user_data['schedule_data'][slot] = {}
-        context.user_data['schedule_data'][slot]['message'] = text
-        
-        # 检查是否所有字段都已填写
-        slot_data = context.user_data['schedule_data'][slot]
-        if 'time' in slot_data and 'message' in slot_data:
-            # 保存到数据库
-            time_str = slot_data['time']
-            chat_id = slot_data.get('chat_id')
-            chat_title = slot_data.get('chat_title')
-            message = slot_data['message']
-            
-            await db_operations.create_or_update_scheduled_broadcast(
-                slot, time_str, chat_id, chat_title, message, is_active=1
-            )
-            
-            # 重新加载定时任务
-            from utils.schedule_executor import reload_scheduled_broadcasts
-            await reload_scheduled_broadcasts(context.bot)
-            
-            # 清除状态和数据
-            context.user_data.pop('state', None)
-            context.user_data['schedule_data'].pop(slot, None)
-            
-            await update.message.reply_text(
-                f"✅ 定时播报 {slot} 已设置成功！\n\n"
-                f"时间: {time_str}\n"
-                f"群组: {chat_title}\n"
-                f"内容: {message}\n\n"
-                f"使用 /schedule 查看所有定时播报"
-            )
-        else:
-            await update.message.reply_text("❌ 数据不完整，请重新设置")
-        
-        return True
-    
-    return False
-
+"""定时播报处理器"""
+import re
+import logging
+from typing import Dict, List, Tuple
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram.ext import ContextTypes
+import db_operations
+from utils.schedule_executor import (
+    SCHEDULE_TIMEZONE, normalize_cron, validate_timezone, describe_schedule,
+    reconcile_schedule, get_next_run_time
+)
+
+logger = logging.getLogger(__name__)
+
+# 菜单每页显示的播报数
+SCHEDULE_PAGE_SIZE = 10
+
+TIME_HELP = (
+    "格式：\n"
+    "- 22 （每天22:00）\n"
+    "- 22:30 （每天22:30）\n"
+    "- cron 表达式：分 时 日 月 星期，如 0 9 * * 1-5 （周一到周五9:00）"
+)
+
+
+def _preview(text: str, length: int = 20) -> str:
+    return text[:length] + "..." if len(text) > length else text
+
+
+def _targets_text(schedule: Dict) -> str:
+    targets = schedule['targets']
+    if not targets:
+        return "未设置"
+    names = [t['chat_title'] or str(t['chat_id']) for t in targets[:3]]
+    more = f" 等 {len(targets)} 个群" if len(targets) > 3 else ""
+    return ", ".join(names) + more
+
+
+def build_schedule_menu(schedules: List[Dict], page: int = 0) -> Tuple[str, InlineKeyboardMarkup]:
+    """定时播报列表（分页）"""
+    pages = max(1, (len(schedules) + SCHEDULE_PAGE_SIZE - 1) // SCHEDULE_PAGE_SIZE)
+    page = min(max(page, 0), pages - 1)
+    shown = schedules[page * SCHEDULE_PAGE_SIZE:(page + 1) * SCHEDULE_PAGE_SIZE]
+
+    message = f"⏰ 定时播报管理（共 {len(schedules)} 条）\n\n"
+    if not schedules:
+        message += "还没有定时播报，点击“新建播报”添加\n"
+    for schedule in shown:
+        status = "✅" if schedule['is_active'] else "⏸"
+        message += f"📌 #{schedule['id']} {status} {describe_schedule(schedule)}\n"
+        message += f"   群组: {_targets_text(schedule)}\n"
+        message += f"   内容: {_preview(schedule['message'])}\n\n"
+
+    keyboard = []
+    buttons = [InlineKeyboardButton(f"编辑 #{s['id']}", callback_data=f"schedule_setup_{s['id']}")
+               for s in shown]
+    for i in range(0, len(buttons), 2):
+        keyboard.append(buttons[i:i + 2])
+    if pages > 1:
+        nav = []
+        if page > 0:
+            nav.append(InlineKeyboardButton("⬅️ 上一页", callback_data=f"schedule_page_{page - 1}"))
+        if page < pages - 1:
+            nav.append(InlineKeyboardButton("下一页 ➡️", callback_data=f"schedule_page_{page + 1}"))
+        keyboard.append(nav)
+    keyboard.append([
+        InlineKeyboardButton("➕ 新建播报", callback_data="schedule_new"),
+        InlineKeyboardButton("刷新", callback_data=f"schedule_page_{page}"),
+    ])
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+def build_schedule_detail(schedule: Dict) -> Tuple[str, InlineKeyboardMarkup]:
+    """单条定时播报的详情和编辑按钮"""
+    schedule_id = schedule['id']
+    next_run = get_next_run_time(schedule_id)
+    message = (
+        f"📝 定时播报 #{schedule_id}\n\n"
+        f"状态: {'✅ 激活' if schedule['is_active'] else '⏸ 停用'}\n"
+        f"时间: {describe_schedule(schedule)}\n"
+        f"下次发送: {next_run.strftime('%Y-%m-%d %H:%M %Z') if next_run else '无'}\n"
+        f"群组: {_targets_text(schedule)}\n"
+        f"内容: {schedule['message']}\n\n"
+        "请选择要编辑的项："
+    )
+    keyboard = [
+        [
+            InlineKeyboardButton("⏰ 设置时间", callback_data=f"schedule_time_{schedule_id}"),
+            InlineKeyboardButton("🌐 设置时区", callback_data=f"schedule_tz_{schedule_id}"),
+        ],
+        [
+            InlineKeyboardButton("👥 设置群组", callback_data=f"schedule_chat_{schedule_id}"),
+            InlineKeyboardButton("📝 设置内容", callback_data=f"schedule_message_{schedule_id}"),
+        ],
+        [
+            InlineKeyboardButton("⏸ 停用" if schedule['is_active'] else "▶️ 激活",
+                                 callback_data=f"schedule_toggle_{schedule_id}"),
+            InlineKeyboardButton("❌ 删除播报", callback_data=f"schedule_delete_{schedule_id}"),
+        ],
+        [InlineKeyboardButton("🔙 返回", callback_data="schedule_page_0")],
+    ]
+    return message, InlineKeyboardMarkup(keyboard)
+
+
+def parse_chat_ids(text: str) -> List[Tuple[int, None]]:
+    """解析目标群组ID（逗号、空格或换行分隔），格式错误时抛出 ValueError"""
+    targets = []
+    for part in re.split(r'[,，\s]+', text.strip()):
+        if not part:
+            continue
+        try:
+            targets.append((int(part), None))
+        except ValueError:
+            raise ValueError(f"群组ID必须是数字: {part}")
+    if not targets:
+        raise ValueError("请至少输入一个群组ID")
+    return targets
+
+
+async def show_schedule_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """显示定时播报菜单"""
+    schedules = await db_operations.get_all_schedules()
+    message, markup = build_schedule_menu(schedules)
+    await update.message.reply_text(message, reply_markup=markup)
+
+
+async def _update_field(update: Update, schedule_id: int, field: str, text: str):
+    """修改已有播报的一个字段，并只调整这一条播报的任务"""
+    if field == 'TIME':
+        await db_operations.update_schedule(schedule_id, cron=normalize_cron(text))
+    elif field == 'TZ':
+        await db_operations.update_schedule(schedule_id, timezone=validate_timezone(text))
+    elif field == 'CHAT':
+        await db_operations.set_schedule_targets(schedule_id, parse_chat_ids(text))
+    elif field == 'MESSAGE':
+        await db_operations.update_schedule(schedule_id, message=text)
+    await reconcile_schedule(schedule_id)
+
+    schedule = await db_operations.get_schedule(schedule_id)
+    if not schedule:
+        await update.message.reply_text("❌ 播报不存在")
+        return
+    message, markup = build_schedule_detail(schedule)
+    await update.message.reply_text("✅ 已保存\n\n" + message, reply_markup=markup)
+
+
+async def _new_schedule_step(update: Update, context: ContextTypes.DEFAULT_TYPE,
+                             field: str, text: str):
+    """新建播报：依次输入时间、群组、内容"""
+    draft = context.user_data.setdefault('schedule_data', {}).setdefault('new', {})
+    if field == 'TIME':
+        draft['cron'] = normalize_cron(text)
+        context.user_data['state'] = 'SCHEDULE_CHAT_new'
+        await update.message.reply_text(
+            f"✅ 时间已设置为: {describe_schedule({'cron': draft['cron'], 'timezone': SCHEDULE_TIMEZONE})}\n\n"
+            "请输入目标群组ID（多个用逗号或空格分隔）：")
+    elif field == 'CHAT':
+        draft['targets'] = parse_chat_ids(text)
+        context.user_data['state'] = 'SCHEDULE_MESSAGE_new'
+        await update.message.reply_text(
+            f"✅ 已设置 {len(draft['targets'])} 个群组\n\n请输入播报内容：")
+    elif field == 'MESSAGE':
+        if 'cron' not in draft or 'targets' not in draft:
+            context.user_data.pop('state', None)
+            context.user_data['schedule_data'].pop('new', None)
+            await update.message.reply_text("❌ 数据不完整，请重新设置")
+            return
+        schedule_id = await db_operations.create_schedule(
+            draft['cron'], SCHEDULE_TIMEZONE, text, draft['targets'],
+            created_by=update.effective_user.id if update.effective_user else None)
+        context.user_data.pop('state', None)
+        context.user_data['schedule_data'].pop('new', None)
+        if not schedule_id:
+            await update.message.reply_text("❌ 保存失败")
+            return
+        await reconcile_schedule(schedule_id)
+        schedule = await db_operations.get_schedule(schedule_id)
+        message, markup = build_schedule_detail(schedule)
+        await update.message.reply_text(
+            f"✅ 定时播报 #{schedule_id} 已设置成功！\n\n" + message, reply_markup=markup)
+
+
+async def handle_schedule_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """处理定时播报的文本输入"""
+    user_state = context.user_data.get('state', '')
+
+    if not user_state.startswith('SCHEDULE_'):
+        return False
+
+    # 解析状态：SCHEDULE_<TIME|TZ|CHAT|MESSAGE>_<播报ID|new>
+    parts = user_state.split('_')
+    if len(parts) < 3:
+        return False
+    field, target = parts[1], parts[2]
+    text = update.message.text.strip()
+
+    try:
+        if target == 'new':
+            await _new_schedule_step(update, context, field, text)
+        else:
+            context.user_data.pop('state', None)
+            await _update_field(update, int(target), field, text)
+    except ValueError as e:
+        # 输入有误时保持当前状态，可以直接重新输入
+        context.user_data['state'] = user_state
+        await update.message.reply_text(f"❌ {e}\n\n请重新输入，或输入 'cancel' 取消")
+    return True
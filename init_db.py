@@ -1,5 +1,6 @@
 import sqlite3
 import os
+import db_operations
 
 # 数据库文件路径 - 支持持久化存储
 # 如果设置了 DATA_DIR 环境变量，使用该目录；否则使用当前目录
@@ -9,11 +10,48 @@ os.makedirs(DATA_DIR, exist_ok=True)
 DB_NAME = os.path.join(DATA_DIR, 'loan_bot.db')
 
 
-def init_database():
-    """初始化数据库，创建所有必要的表"""
-    conn = sqlite3.connect(DB_NAME)
-    cursor = conn.cursor()
+# 查询索引（迁移 3 创建）
+# 以后新增索引请写成新的迁移；修改 db_operations 中的查询时，用 scripts/check_query_plans.py 检查是否命中索引
+INDEXES = [
+    # 当前有效订单（每条 + 消息、回调、群名变更都会查询）
+    # 查询中的状态条件必须与这里的 WHERE 字面量一致，才能使用部分索引
+    """CREATE INDEX IF NOT EXISTS idx_orders_active_chat
+       ON orders(chat_id) WHERE state NOT IN ('end', 'breach_end')""",
+    'CREATE INDEX IF NOT EXISTS idx_orders_chat ON orders(chat_id)',
+    # 查找/报表：按归属、状态、星期分组、客户、日期筛选
+    'CREATE INDEX IF NOT EXISTS idx_orders_group_state_date ON orders(group_id, state, date)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_weekday_state ON orders(weekday_group, state)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_state_date ON orders(state, date)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_customer_date ON orders(customer, date)',
+    'CREATE INDEX IF NOT EXISTS idx_orders_date ON orders(date)',
+    # 日结数据：按归属ID查日期范围（全局按 UNIQUE(date, group_id) 查询）
+    'CREATE INDEX IF NOT EXISTS idx_daily_data_group_date ON daily_data(group_id, date)',
+    'CREATE INDEX IF NOT EXISTS idx_payment_accounts_type ON payment_accounts(account_type)',
+]
+
+
+def create_indexes(cursor):
+    """创建查询索引（已存在则跳过）"""
+    for sql in INDEXES:
+        cursor.execute(sql)
+
+
+# ========== 数据库迁移 ==========
+# 每个迁移是一个 (cursor) 函数，第 N 个迁移把 PRAGMA user_version 从 N-1 升到 N，
+# 在独立事务中执行（失败整体回滚，版本号不变）。
+# 引入版本号之前的数据库 user_version 都是 0，表结构可能停在任何一次旧的 init_database，
+# 所以迁移 1-6 必须可以在已有的表上重复执行（IF NOT EXISTS / 检查列是否存在）。
+# 新的迁移只追加到 MIGRATIONS 末尾，已发布的迁移不要再修改。
+
+
+def _column_names(cursor, table: str) -> list:
+    """返回表的列名列表"""
+    cursor.execute(f"PRAGMA table_info({table})")
+    return [row[1] for row in cursor.fetchall()]
 
+
+def _migration_base_tables(cursor):
+    """基础表：订单、统计、员工、支付账号、定时播报"""
     # 创建订单表
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS orders (
@@ -77,6 +115,22 @@ def init_database():
     ''')
 
     # 创建日结数据表（按日期和归属ID存储）
+    # 表已存在时补充旧版本缺失的列
+    columns = _column_names(cursor, 'daily_data')
+    if columns:
+
+        # 添加缺失的列
+        if 'liquid_flow' not in columns:
+            cursor.execute(
+                'ALTER TABLE daily_data ADD COLUMN liquid_flow REAL DEFAULT 0')
+        if 'company_expenses' not in columns:
+            cursor.execute(
+                'ALTER TABLE daily_data ADD COLUMN company_expenses REAL DEFAULT 0')
+        if 'other_expenses' not in columns:
+            cursor.execute(
+                'ALTER TABLE daily_data ADD COLUMN other_expenses REAL DEFAULT 0')
+
+    # 创建表（如果不存在）
     cursor.execute('''
     CREATE TABLE IF NOT EXISTS daily_data (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
@@ -93,6 +147,9 @@ def init_database():
         breach_amount REAL DEFAULT 0,
         breach_end_orders INTEGER DEFAULT 0,
         breach_end_amount REAL DEFAULT 0,
+        liquid_flow REAL DEFAULT 0,
+        company_expenses REAL DEFAULT 0,
+        other_expenses REAL DEFAULT 0,
         updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
         UNIQUE(date, group_id)
     )
@@ -194,9 +251,306 @@ def init_database():
     )
     ''')
 
-    conn.commit()
-    conn.close()
-    print(f"数据库 {DB_NAME} 初始化完成！")
+
+def _migration_order_events(cursor):
+    """订单事件流水表，已有统计数据写成 baseline 事件"""
+    # 只追加，统计表可由流水重放得到
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS order_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        event_type TEXT NOT NULL,
+        order_id TEXT,
+        chat_id INTEGER,
+        group_id TEXT,
+        date TEXT,
+        amount REAL DEFAULT 0,
+        note TEXT,
+        deltas TEXT NOT NULL,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_order_events_order ON order_events(order_id)')
+
+    # 流水为空时，把现有统计数据记为 baseline 事件
+    cursor.row_factory = sqlite3.Row
+    if db_operations.seed_order_events_baseline(cursor):
+        print("已写入统计数据 baseline 流水")
+
+
+def _migration_indexes(cursor):
+    """订单、日结、支付账号的查询索引"""
+    create_indexes(cursor)
+
+
+def _migration_broadcast_jobs(cursor):
+    """群发任务表（记录进度，重启后继续发送未完成的目标）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_jobs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        text TEXT NOT NULL,
+        created_by INTEGER,
+        status_chat_id INTEGER,
+        status_message_id INTEGER,
+        status TEXT NOT NULL DEFAULT 'running',
+        total INTEGER DEFAULT 0,
+        sent INTEGER DEFAULT 0,
+        failed INTEGER DEFAULT 0,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS broadcast_targets (
+        job_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        text TEXT,
+        status TEXT NOT NULL DEFAULT 'pending',
+        error TEXT,
+        sent_at TEXT,
+        PRIMARY KEY (job_id, chat_id)
+    )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_broadcast_jobs_status ON broadcast_jobs(status)')
+
+
+def _migration_daily_rollups(cursor):
+    """日结月/周汇总表，已有日结数据时生成汇总"""
+    # 按自然月 M / 自然周 W 预先求和，与 daily_data 同步累加
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_rollups (
+        period TEXT NOT NULL CHECK(period IN ('M', 'W')),
+        period_start TEXT NOT NULL,
+        group_id TEXT,
+        new_clients INTEGER DEFAULT 0,
+        new_clients_amount REAL DEFAULT 0,
+        old_clients INTEGER DEFAULT 0,
+        old_clients_amount REAL DEFAULT 0,
+        interest REAL DEFAULT 0,
+        completed_orders INTEGER DEFAULT 0,
+        completed_amount REAL DEFAULT 0,
+        breach_orders INTEGER DEFAULT 0,
+        breach_amount REAL DEFAULT 0,
+        breach_end_orders INTEGER DEFAULT 0,
+        breach_end_amount REAL DEFAULT 0,
+        liquid_flow REAL DEFAULT 0,
+        company_expenses REAL DEFAULT 0,
+        other_expenses REAL DEFAULT 0,
+        UNIQUE(period, period_start, group_id)
+    )
+    ''')
+
+    # 汇总表为空而已有日结数据时，从 daily_data 生成
+    cursor.execute('SELECT 1 FROM daily_rollups LIMIT 1')
+    if not cursor.fetchone():
+        cursor.execute('SELECT 1 FROM daily_data LIMIT 1')
+        if cursor.fetchone():
+            db_operations.rebuild_daily_rollups(cursor)
+            print("已根据日结数据生成月/周汇总")
+
+
+def _migration_order_version(cursor):
+    """订单版本号列（已不再维护，保留该迁移以保持已升级数据库的版本编号）"""
+    if 'version' not in _column_names(cursor, 'orders'):
+        cursor.execute(
+            'ALTER TABLE orders ADD COLUMN version INTEGER NOT NULL DEFAULT 1')
+
+
+def _migration_expense_records(cursor):
+    """开销明细表（record_expense / get_expense_records）"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS expense_records (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        type TEXT NOT NULL,
+        amount REAL NOT NULL,
+        note TEXT,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_expense_records_date_type ON expense_records(date, type)')
+
+
+def _migration_schedules(cursor):
+    """定时播报不限数量（cron + 时区 + 多个目标群），调度任务持久化到 scheduler_jobs"""
+    from utils.schedule_executor import SCHEDULE_TIMEZONE
+
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schedules (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        cron TEXT NOT NULL,
+        timezone TEXT NOT NULL,
+        message TEXT NOT NULL,
+        is_active INTEGER DEFAULT 1,
+        created_by INTEGER,
+        created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+        updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS schedule_targets (
+        schedule_id INTEGER NOT NULL,
+        chat_id INTEGER NOT NULL,
+        chat_title TEXT,
+        PRIMARY KEY (schedule_id, chat_id)
+    )
+    ''')
+    # 与 APScheduler SQLAlchemyJobStore 相同的表结构
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS scheduler_jobs (
+        id TEXT PRIMARY KEY,
+        next_run_time REAL,
+        job_state BLOB NOT NULL
+    )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_scheduler_jobs_next_run_time ON scheduler_jobs(next_run_time)')
+
+    # 旧的 3 个槽位（每天 HH:MM，一个群）转为 cron 播报
+    cursor.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'scheduled_broadcasts'")
+    if not cursor.fetchone():
+        return
+    cursor.execute('SELECT * FROM scheduled_broadcasts ORDER BY slot')
+    columns = [d[0] for d in cursor.description]
+    for row in [dict(zip(columns, r)) for r in cursor.fetchall()]:
+        hour, _, minute = row['time'].partition(':')
+        cursor.execute('''
+        INSERT INTO schedules (cron, timezone, message, is_active, created_at, updated_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        ''', (f"{int(minute or 0)} {int(hour)} * * *", SCHEDULE_TIMEZONE, row['message'],
+              row['is_active'], row['created_at'], row['updated_at']))
+        if row['chat_id']:
+            cursor.execute('''
+            INSERT INTO schedule_targets (schedule_id, chat_id, chat_title) VALUES (?, ?, ?)
+            ''', (cursor.lastrowid, row['chat_id'], row['chat_title']))
+        else:
+            print(f"定时播报 {row['slot']} 没有群组ID（{row['chat_title'] or '未设置'}），请重新设置目标群")
+    cursor.execute('DROP TABLE scheduled_broadcasts')
+
+
+
+def _migration_last_payment_date(cursor):
+    """订单最近付款日期（利息/本金减少），逾期扫描按星期分组的付款日判断是否逾期"""
+    if 'last_payment_date' not in _column_names(cursor, 'orders'):
+        cursor.execute('ALTER TABLE orders ADD COLUMN last_payment_date TEXT')
+    # 从流水中取最近一次付款；没有付款记录的未完成订单按库中最后记账的日期计
+    # （流水、日结数据和订单日期取最晚），避免流水启用前已付过款的订单在第一次扫描时全部转为逾期。
+    # 只用库中已有的数据，无论何时升级结果都相同
+    cursor.execute('''
+    SELECT MAX(date) FROM (
+        SELECT MAX(date) AS date FROM order_events
+        UNION ALL SELECT MAX(date) FROM daily_data
+    )''')
+    last_recorded = cursor.fetchone()[0] or ''
+    cursor.execute('''
+    UPDATE orders SET last_payment_date = COALESCE((
+        SELECT MAX(e.date) FROM order_events e
+        WHERE e.order_id = orders.order_id
+          AND e.event_type IN ('interest', 'principal_reduction')
+    ), MAX(?, substr(date, 1, 10)))
+    WHERE state NOT IN ('end', 'breach_end') AND last_payment_date IS NULL
+    ''', (last_recorded,))
+
+
+
+def _migration_day_close(cursor):
+    """日结：已日结的日期（冻结）和每天日终的全局/各归属存量"""
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS day_closes (
+        date TEXT PRIMARY KEY,
+        closed_at TEXT DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    # group_id 为 NULL 表示全局
+    cursor.execute('''
+    CREATE TABLE IF NOT EXISTS daily_stock (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        date TEXT NOT NULL,
+        group_id TEXT,
+        valid_orders INTEGER DEFAULT 0,
+        valid_amount REAL DEFAULT 0,
+        liquid_funds REAL DEFAULT 0,
+        UNIQUE(date, group_id)
+    )
+    ''')
+    cursor.execute(
+        'CREATE INDEX IF NOT EXISTS idx_daily_stock_group_date ON daily_stock(group_id, date)')
+
+
+def _migration_daily_stock_history(cursor):
+    """每天的存量随统计变动增量写入 daily_stock，升级时根据当前存量和流水生成历史每天的存量"""
+    if db_operations.rebuild_daily_stock(cursor):
+        print("已根据流水生成每日存量")
+
+
+# 按顺序执行，第 N 个迁移完成后 user_version = N
+MIGRATIONS = [
+    _migration_base_tables,
+    _migration_order_events,
+    _migration_indexes,
+    _migration_broadcast_jobs,
+    _migration_daily_rollups,
+    _migration_order_version,
+    _migration_expense_records,
+    _migration_schedules,
+    _migration_last_payment_date,
+    _migration_day_close,
+    _migration_daily_stock_history,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+
+def get_schema_version(conn) -> int:
+    """读取数据库结构版本（PRAGMA user_version）"""
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+def migrate(conn, target: int = SCHEMA_VERSION) -> list:
+    """
+    把数据库升级到 target 版本，返回本次执行的迁移版本号
+    结构已是最新时只读取一次 user_version
+    """
+    version = get_schema_version(conn)
+    if version > SCHEMA_VERSION:
+        raise RuntimeError(
+            f"数据库结构版本 {version} 高于程序支持的版本 {SCHEMA_VERSION}，请升级程序")
+
+    applied = []
+    while version < target:
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 加写锁后重新读取，其他进程可能刚完成迁移
+            version = get_schema_version(conn)
+            if version >= target:
+                conn.rollback()
+                break
+            migration = MIGRATIONS[version]
+            migration(conn.cursor())
+            # user_version 写在数据库头中，随事务一起提交或回滚
+            conn.execute(f'PRAGMA user_version = {version + 1}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        version += 1
+        applied.append(version)
+        print(f"数据库迁移 {version}: {migration.__doc__.splitlines()[0]}")
+    return applied
+
+
+def init_database():
+    """初始化数据库：执行未完成的迁移"""
+    conn = sqlite3.connect(DB_NAME)
+    try:
+        applied = migrate(conn)
+    finally:
+        conn.close()
+    if applied:
+        print(f"数据库 {DB_NAME} 已升级到版本 {SCHEMA_VERSION}")
 
 
 if __name__ == "__main__":
@@ -1,6 +1,12 @@
 """Telegram订单管理机器人主入口"""
 from decorators import error_handler, admin_required, authorized_required, private_chat_only, group_chat_only
-from utils.schedule_executor import setup_scheduled_broadcasts
+from utils.schedule_executor import setup_scheduled_broadcasts, shutdown_scheduler
+from utils.payment_reminder import setup_reminder_campaign
+from utils.overdue_sweeper import OVERDUE_SWEEP_ENABLED, setup_overdue_sweep, run_overdue_sweep
+from utils.day_close import DAY_CLOSE_ENABLED, setup_day_close, run_day_close
+from utils.broadcast_engine import resume_broadcast_jobs
+from utils.update_processor import ChatSerializedUpdateProcessor
+from utils.update_backlog import UPDATE_BACKLOG_MODE, catch_up_backlog
 from callbacks import button_callback, handle_order_action_callback, handle_schedule_callback
 from handlers import (
     start,
@@ -13,6 +19,9 @@ from handlers import (
     add_employee,
     remove_employee,
     list_employees,
+    rebuild_stats,
+    show_cache_stats,
+    show_update_stats,
     set_normal,
     set_overdue,
     set_end,
@@ -28,10 +37,16 @@ from handlers import (
     show_gcash,
     show_paymaya,
     show_all_accounts,
-    show_schedule_menu
+    show_schedule_menu,
+    show_import_help,
+    handle_import_document,
+    export_data,
+    remind_all
 )
-from config import BOT_TOKEN, ADMIN_IDS
+from config import BOT_TOKEN, ADMIN_IDS, UPDATE_MODE, get_webhook_options
 import init_db
+import db_pool
+import db_operations
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -74,56 +89,8 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
-def main() -> None:
-    """启动机器人"""
-    # 验证配置
-    if not BOT_TOKEN:
-        logger.error("BOT_TOKEN 未设置，无法启动机器人")
-        print("\n❌ 错误: BOT_TOKEN 未设置")
-        print("请检查 config.py 文件或环境变量")
-        return
-
-    if not ADMIN_IDS:
-        logger.error("ADMIN_USER_IDS 未设置，无法启动机器人")
-        print("\n❌ 错误: ADMIN_USER_IDS 未设置")
-        print("请检查 config.py 文件或环境变量")
-        return
-
-    logger.info(f"机器人启动中... 管理员数量: {len(ADMIN_IDS)}")
-    try:
-        print(f"\n机器人启动中...")
-        print(f"管理员数量: {len(ADMIN_IDS)}")
-    except UnicodeEncodeError:
-        print("\nBot starting...")
-        print(f"Admin count: {len(ADMIN_IDS)}")
-
-    # 初始化数据库（如果不存在）
-    try:
-        print("检查数据库...")
-    except UnicodeEncodeError:
-        print("Checking database...")
-    try:
-        init_db.init_database()
-        try:
-            print("数据库已就绪")
-        except UnicodeEncodeError:
-            print("Database ready")
-    except Exception as e:
-        logger.error(f"数据库初始化失败: {e}")
-        try:
-            print(f"数据库初始化失败: {e}")
-        except UnicodeEncodeError:
-            print(f"Database init failed: {e}")
-        return
-
-    try:
-        # 创建Application并传入bot的token
-        application = Application.builder().token(BOT_TOKEN).build()
-    except Exception as e:
-        logger.error(f"创建应用时出错: {e}")
-        print(f"\n❌ 创建应用时出错: {e}")
-        return
-
+def register_handlers(application: Application) -> None:
+    """注册所有命令、消息和回调处理器"""
     # 添加命令处理器
     # 基础命令（私聊，需要授权）
     application.add_handler(CommandHandler(
@@ -175,6 +142,27 @@ def main() -> None:
     application.add_handler(CommandHandler(
         "list_employees", private_chat_only(admin_required(list_employees))))
 
+    # 统计流水校验/重建（私聊，仅管理员）
+    application.add_handler(CommandHandler(
+        "rebuild_stats", private_chat_only(admin_required(rebuild_stats))))
+    application.add_handler(CommandHandler(
+        "cache_stats", private_chat_only(admin_required(show_cache_stats))))
+    application.add_handler(CommandHandler(
+        "update_stats", private_chat_only(admin_required(show_update_stats))))
+
+    # 历史订单导入（私聊，仅管理员）：/import 查看说明，发送文件并附言 /import 开始导入
+    application.add_handler(CommandHandler(
+        "import", private_chat_only(admin_required(show_import_help))))
+    application.add_handler(MessageHandler(
+        filters.Document.ALL & filters.CaptionRegex(r'^/import'),
+        private_chat_only(admin_required(handle_import_document))))
+    # 数据导出（私聊，仅管理员）
+    application.add_handler(CommandHandler(
+        "export", private_chat_only(admin_required(export_data))))
+    # 付款提醒活动（私聊，仅管理员）
+    application.add_handler(CommandHandler(
+        "remind_all", private_chat_only(admin_required(remind_all))))
+
     # 自动订单创建（新成员入群监听 & 群名变更监听）
     application.add_handler(MessageHandler(
         filters.StatusUpdate.NEW_CHAT_MEMBERS, handle_new_chat_members))
@@ -203,6 +191,82 @@ def main() -> None:
     application.add_handler(CallbackQueryHandler(
         authorized_required(button_callback)))
 
+
+def main() -> None:
+    """启动机器人"""
+    # 验证配置
+    if not BOT_TOKEN:
+        logger.error("BOT_TOKEN 未设置，无法启动机器人")
+        print("\n❌ 错误: BOT_TOKEN 未设置")
+        print("请检查 config.py 文件或环境变量")
+        return
+
+    if not ADMIN_IDS:
+        logger.error("ADMIN_USER_IDS 未设置，无法启动机器人")
+        print("\n❌ 错误: ADMIN_USER_IDS 未设置")
+        print("请检查 config.py 文件或环境变量")
+        return
+
+    if UPDATE_MODE not in ('polling', 'webhook'):
+        logger.error(f"UPDATE_MODE={UPDATE_MODE} 无效")
+        print(f"\n❌ 错误: UPDATE_MODE 只能是 polling 或 webhook（当前 {UPDATE_MODE}）")
+        return
+    if UPDATE_BACKLOG_MODE not in ('catchup', 'drop'):
+        logger.error(f"UPDATE_BACKLOG_MODE={UPDATE_BACKLOG_MODE} 无效")
+        print(f"\n❌ 错误: UPDATE_BACKLOG_MODE 只能是 catchup 或 drop（当前 {UPDATE_BACKLOG_MODE}）")
+        return
+    webhook_options = None
+    if UPDATE_MODE == 'webhook':
+        try:
+            webhook_options = get_webhook_options()
+        except ValueError as e:
+            logger.error(f"webhook 配置错误: {e}")
+            print(f"\n❌ 错误: {e}")
+            return
+
+    logger.info(f"机器人启动中... 管理员数量: {len(ADMIN_IDS)}")
+    try:
+        print(f"\n机器人启动中...")
+        print(f"管理员数量: {len(ADMIN_IDS)}")
+    except UnicodeEncodeError:
+        print("\nBot starting...")
+        print(f"Admin count: {len(ADMIN_IDS)}")
+
+    # 初始化数据库（如果不存在）
+    try:
+        print("检查数据库...")
+    except UnicodeEncodeError:
+        print("Checking database...")
+    try:
+        init_db.init_database()
+        try:
+            print("数据库已就绪")
+        except UnicodeEncodeError:
+            print("Database ready")
+    except Exception as e:
+        logger.error(f"数据库初始化失败: {e}")
+        try:
+            print(f"数据库初始化失败: {e}")
+        except UnicodeEncodeError:
+            print(f"Database init failed: {e}")
+        return
+
+    try:
+        # 创建Application并传入bot的token
+        # 不同群的更新并发处理，同一群/同一用户的更新按顺序处理
+        application = (
+            Application.builder()
+            .token(BOT_TOKEN)
+            .concurrent_updates(ChatSerializedUpdateProcessor())
+            .build()
+        )
+    except Exception as e:
+        logger.error(f"创建应用时出错: {e}")
+        print(f"\n❌ 创建应用时出错: {e}")
+        return
+
+    register_handlers(application)
+
     # 启动机器人
     try:
         # 设置命令菜单
@@ -219,25 +283,70 @@ def main() -> None:
         ]
 
         async def post_init(application: Application):
+            # 加载授权用户缓存（之后权限检查不再读数据库）
+            await db_operations.load_authorized_users()
+            # 处理重启期间积压的消息（+金额、/end 等照常执行，过期的菜单和输入丢弃）
+            if UPDATE_BACKLOG_MODE == 'catchup':
+                try:
+                    await catch_up_backlog(application, ADMIN_IDS)
+                except Exception as e:
+                    logger.error(f"处理积压消息失败: {e}", exc_info=True)
             await application.bot.set_my_commands(commands)
             try:
                 print("命令菜单已更新")
             except UnicodeEncodeError:
                 print("Commands menu updated")
-            # 初始化定时播报任务
+            # 启动定时播报调度器（任务从数据库恢复，只调整与播报设置不一致的任务）
             await setup_scheduled_broadcasts(application.bot)
             try:
                 print("定时播报任务已初始化")
             except UnicodeEncodeError:
                 print("Scheduled broadcasts initialized")
+            # 定时付款提醒活动（REMINDER_CRON 为空时移除任务），进度发给第一个管理员
+            try:
+                setup_reminder_campaign(next(iter(ADMIN_IDS), None))
+            except Exception as e:
+                logger.error(f"付款提醒活动设置失败: {e}", exc_info=True)
+            # 每天日切时的逾期扫描；启动时先补扫一次（扫描可重复执行，停机期间错过的日切不会漏掉）
+            try:
+                setup_overdue_sweep(ADMIN_IDS)
+                if OVERDUE_SWEEP_ENABLED:
+                    await run_overdue_sweep(ADMIN_IDS)
+            except Exception as e:
+                logger.error(f"逾期扫描失败: {e}", exc_info=True)
+            # 每天日切时的日结；启动时补做停机期间错过的日结，并预先生成今日报表
+            try:
+                setup_day_close(ADMIN_IDS)
+                if DAY_CLOSE_ENABLED:
+                    await run_day_close(ADMIN_IDS)
+            except Exception as e:
+                logger.error(f"日结失败: {e}", exc_info=True)
+            # 继续执行重启前未完成的群发任务
+            resumed = await resume_broadcast_jobs(application.bot)
+            if resumed:
+                logger.info(f"继续执行 {resumed} 个未完成的群发任务")
+
+        async def post_shutdown(application: Application):
+            # 停止定时播报调度器，再关闭数据库连接池
+            shutdown_scheduler()
+            db_pool.close_pool()
 
         try:
             print("机器人已启动，等待消息...")
         except UnicodeEncodeError:
             print("Bot started, waiting for messages...")
         application.post_init = post_init
+        application.post_shutdown = post_shutdown
         # 启动机器人
-        application.run_polling(drop_pending_updates=True)
+        if webhook_options:
+            # 内置 HTTP 服务器接收推送：校验密钥后立即返回 200，更新放入队列交给处理器
+            logger.info(
+                f"webhook 模式: 监听 {webhook_options['listen']}:{webhook_options['port']}"
+                f"/{webhook_options['url_path']}，最大连接数 {webhook_options['max_connections']}")
+            application.run_webhook(
+                drop_pending_updates=(UPDATE_BACKLOG_MODE == 'drop'), **webhook_options)
+        else:
+            application.run_polling(drop_pending_updates=(UPDATE_BACKLOG_MODE == 'drop'))
     except telegram_error.InvalidToken:
         print("\n" + "="*60)
         print("❌ Token 无效或被拒绝！")
@@ -0,0 +1,181 @@
+"""积压消息基准测试：模拟重启期间积压的几千条更新，测试启动时分类和处理（catch_up_backlog）的耗时
+
+用法:
+    python scripts/bench_backlog.py [--updates 3000] [--chats 300] [--latency-ms 0]
+
+在临时数据库中为每个群建一个订单，本地假 Telegram 服务器（见 bench_webhook.py）的 getUpdates 中放入积压更新:
+    +金额（利息）、/end、订单按钮（同一消息点两次）、菜单按钮、群名多次变更、
+    私聊等待输入的文本、过期的 /report。
+机器人注册与 main.py 相同的处理器，输出处理耗时、分类汇总，并核对每条保留的 +金额 都写入了利息流水。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+# 必须在导入 db_operations / config 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench_backlog_')
+os.environ.setdefault('BOT_TOKEN', '1:bench')
+os.environ.setdefault('ADMIN_USER_IDS', '1')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import tornado.web
+import tornado.httpserver
+from telegram.ext import Application
+import init_db
+import db_operations
+import db_pool
+from config import BOT_TOKEN, ADMIN_IDS
+from main import register_handlers
+from utils.update_processor import ChatSerializedUpdateProcessor
+from utils.update_backlog import catch_up_backlog, format_backlog_summary
+from bench_webhook import FakeTelegram, BotApiHandler, free_port
+
+ADMIN_ID = next(iter(ADMIN_IDS))
+
+
+def staff_id(chat_id: int) -> int:
+    """每个群由不同的员工操作（同一用户的更新按顺序处理）"""
+    return 5000000 - chat_id
+
+
+def seed_orders(chats: int):
+    """每个群一个进行中的订单和一个员工"""
+    conn = db_operations.get_connection()
+    conn.executemany('INSERT INTO authorized_users (user_id) VALUES (?)',
+                     [(staff_id(-1000000 - i),) for i in range(chats)])
+    conn.executemany('''
+    INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group, customer, amount, state)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(f"BACKLOG{i:06d}", f"S{i % 10 + 1:02d}", -1000000 - i, '2025-12-01 12:00:00',
+           '一二三四五六日'[i % 7], 'AB'[i % 2], 10000, 'normal') for i in range(chats)])
+    conn.execute('UPDATE financial_data SET liquid_funds = 1e12')
+    conn.commit()
+    conn.close()
+
+
+def build_backlog(count: int, chats: int) -> tuple:
+    """生成积压更新，返回 (更新列表, 应处理的 +金额 数量)"""
+    now = int(time.time())
+    updates = []
+    amounts = 0
+
+    def message(chat_id: int, chat_type: str = 'supergroup', age: int = 30, **fields) -> dict:
+        user_id = ADMIN_ID if chat_type == 'private' else staff_id(chat_id)
+        return {
+            'message_id': len(updates) + 1, 'date': now - age,
+            'chat': {'id': chat_id, 'type': chat_type, 'title': 'bench'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': 'staff'},
+            **fields,
+        }
+
+    def callback(chat_id: int, message_id: int, data: str) -> dict:
+        return {
+            'id': str(len(updates)), 'chat_instance': '1', 'data': data,
+            'from': {'id': ADMIN_ID if chat_id > 0 else staff_id(chat_id),
+                     'is_bot': False, 'first_name': 'staff'},
+            'message': {'message_id': message_id, 'date': now - 60,
+                        'chat': {'id': chat_id, 'type': 'supergroup', 'title': 'bench'}},
+        }
+
+    for i in range(count):
+        chat_id = -1000000 - i % chats
+        slot = i % 20
+        update = {'update_id': i + 1}
+        if slot < 12:
+            update['message'] = message(chat_id, text=f"+{(i % 9 + 1) * 10}")
+            amounts += 1
+        elif slot in (12, 13):
+            # 同一条消息上先点“正常”再点“逾期”，只执行最后一次
+            button_chat = -1000000 - (i - slot + 12) % chats
+            data = 'order_action_normal' if slot == 12 else 'order_action_overdue'
+            update['callback_query'] = callback(button_chat, 900000 + i // 20, data)
+        elif slot == 14:
+            update['callback_query'] = callback(ADMIN_ID, 800000 + i, 'report_view_today_ALL')
+        elif slot in (15, 16):
+            # 群名多次变更，只处理最后一次
+            update['message'] = message(chat_id, new_chat_title=f"bench title {i}")
+        elif slot == 17:
+            update['message'] = message(ADMIN_ID, 'private', text='2025-12-01')
+        elif slot == 18:
+            update['message'] = message(ADMIN_ID, 'private', age=600, text='/report')
+        else:
+            update['message'] = message(chat_id, text='/order')
+        updates.append(update)
+    return updates, amounts
+
+
+async def run(args) -> dict:
+    fake = FakeTelegram(args.latency_ms / 1000, 40)
+    updates, expected_amounts = build_backlog(args.updates, args.chats)
+    fake.pending = updates
+    api_port = free_port()
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (rf'/bot{BOT_TOKEN}/(\w+)', BotApiHandler, {'fake': fake}),
+    ]))
+    server.listen(api_port, '127.0.0.1')
+
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f'http://127.0.0.1:{api_port}/bot')
+        .concurrent_updates(ChatSerializedUpdateProcessor())
+        .build()
+    )
+    register_handlers(application)
+    await application.initialize()
+    await db_operations.load_authorized_users()
+
+    start = time.perf_counter()
+    summary = await catch_up_backlog(application, ADMIN_IDS)
+    elapsed = time.perf_counter() - start
+
+    await application.shutdown()
+    server.stop()
+    await server.close_all_connections()
+
+    conn = db_operations.get_connection()
+    interest_events = conn.execute(
+        "SELECT COUNT(*) FROM order_events WHERE event_type = 'interest'").fetchone()[0]
+    conn.close()
+    return {'summary': summary, 'elapsed': elapsed, 'expected_amounts': expected_amounts,
+            'interest_events': interest_events, 'remaining': len(fake.pending),
+            'requests': fake.requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=3000, help='积压更新数')
+    parser.add_argument('--chats', type=int, default=300, help='群数量')
+    parser.add_argument('--latency-ms', type=float, default=0, help='模拟 Bot API 单程网络延迟（毫秒）')
+    args = parser.parse_args()
+
+    # main.py 导入时已按 INFO 配置日志
+    logging.getLogger().setLevel(logging.WARNING)
+    init_db.init_database()
+    seed_orders(args.chats)
+    try:
+        result = asyncio.run(run(args))
+    finally:
+        db_pool.close_pool()
+
+    print()
+    print(format_backlog_summary(result['summary']))
+    print(f"总耗时（取出 + 处理 + 确认）: {result['elapsed']:.2f} 秒 "
+          f"({args.updates / result['elapsed']:,.0f} updates/sec)")
+    print(f"Bot API 调用: {result['requests']}")
+    print(f"+金额: 积压 {result['expected_amounts']} 条，写入利息流水 {result['interest_events']} 条")
+    print(f"确认后 getUpdates 剩余: {result['remaining']}")
+    if result['interest_events'] != result['expected_amounts'] or result['remaining']:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+"""连接池基准测试：对比连接池与每次调用新建连接的吞吐量（ops/sec）
+
+用法:
+    python scripts/bench_db_pool.py [--ops 5000] [--concurrency 32] [--orders 2000]
+
+在临时目录中创建数据库，不会影响正式数据。
+"""
+import os
+import sys
+import time
+import random
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench_db_pool_')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_pool
+
+
+def seed_orders(count: int):
+    """写入测试订单"""
+    conn = db_operations.get_connection()
+    rows = []
+    for i in range(count):
+        rows.append((
+            f"BENCH{i:06d}", f"S{(i % 20) + 1:02d}", -100000 - i,
+            f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d} 12:00:00",
+            '一二三四五六日'[i % 7], 'AB'[i % 2], 10000, 'normal'
+        ))
+    conn.executemany('''
+    INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group,
+                        customer, amount, state)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def legacy_call(func, *args, write: bool = False):
+    """模拟旧实现：每次调用新建连接，在默认执行器中运行"""
+    sync_func = func.__wrapped__
+
+    def sync_work():
+        conn = db_operations.get_connection()
+        cursor = conn.cursor()
+        try:
+            return sync_func(conn, cursor, *args)
+        except Exception:
+            if write:
+                conn.rollback()
+                return False
+            raise
+        finally:
+            conn.close()
+
+    return asyncio.get_running_loop().run_in_executor(None, sync_work)
+
+
+def pooled_call(func, *args, write: bool = False):
+    """使用连接池的正式实现"""
+    return func(*args)
+
+
+async def run_workload(call, ops: int, concurrency: int, orders: int) -> float:
+    """执行混合负载（约 80% 读、20% 写），返回 ops/sec"""
+    rng = random.Random(42)
+    plan = []
+    for _ in range(ops):
+        chat_id = -100000 - rng.randrange(orders)
+        roll = rng.random()
+        if roll < 0.5:
+            plan.append((db_operations._fetch_order_by_chat_id, (chat_id,), False))
+        elif roll < 0.65:
+            plan.append((db_operations.get_financial_data, (), False))
+        elif roll < 0.8:
+            plan.append((db_operations.get_grouped_data, ('S01',), False))
+        else:
+            plan.append((db_operations.record_interest,
+                         ('2025-12-01', chat_id, rng.randrange(10, 100)), True))
+
+    queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+
+    async def worker():
+        while True:
+            try:
+                func, args, write = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            await call(func, *args, write=write)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    return ops / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--ops', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--orders', type=int, default=2000)
+    args = parser.parse_args()
+
+    init_db.init_database()
+    seed_orders(args.orders)
+
+    legacy = asyncio.run(run_workload(
+        legacy_call, args.ops, args.concurrency, args.orders))
+    pooled = asyncio.run(run_workload(
+        pooled_call, args.ops, args.concurrency, args.orders))
+    db_pool.close_pool()
+
+    print(f"数据库: {db_operations.DB_NAME}")
+    print(f"操作数: {args.ops}, 并发: {args.concurrency}, 订单数: {args.orders}")
+    print(f"每次新建连接: {legacy:,.0f} ops/sec")
+    print(f"连接池:       {pooled:,.0f} ops/sec")
+    print(f"提升:         {pooled / legacy:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
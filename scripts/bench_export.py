@@ -0,0 +1,120 @@
+"""导出基准测试：在临时数据库中生成大量订单，测试 /export 的流式导出速度、内存和事件循环延迟
+
+用法:
+    python scripts/bench_export.py [--rows 1000000] [--gzip]
+
+导出期间同时在事件循环中做订单查询，输出事件循环的最大延迟和查询 p99，
+用于确认导出不阻塞其他群的消息处理。在临时目录中创建数据库，不会影响正式数据。
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+import tempfile
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench_export_')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_pool
+
+SEED_CHUNK = 50000
+
+
+def current_rss_mb() -> float:
+    """当前常驻内存（MB），仅 Linux 支持，其他平台返回 0"""
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):
+        return 0.0
+    return pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+
+
+def seed_orders(count: int):
+    """分块写入测试订单"""
+    conn = db_operations.get_connection()
+    for start in range(0, count, SEED_CHUNK):
+        rows = [(
+            f"EXP{i:08d}", f"S{(i % 20) + 1:02d}", -10000000 - i,
+            f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d} 12:00:00",
+            '一二三四五六日'[i % 7], 'AB'[i % 2], 1000 + i % 50 * 1000,
+            ['normal', 'overdue', 'breach', 'end', 'breach_end'][i % 5]
+        ) for i in range(start, min(start + SEED_CHUNK, count))]
+        conn.executemany('''
+        INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group,
+                            customer, amount, state)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    conn.close()
+
+
+async def probe_loop(stop: asyncio.Event, rows: int, lags: list, latencies: list, rss: list):
+    """导出期间持续查询订单，记录事件循环延迟、查询耗时和内存"""
+    i = 0
+    while not stop.is_set():
+        rss.append(current_rss_mb())
+        expected = time.perf_counter() + 0.005
+        await asyncio.sleep(0.005)
+        lags.append(max(0.0, time.perf_counter() - expected))
+        start = time.perf_counter()
+        # 绕过缓存直接读数据库
+        await db_operations._fetch_order_by_chat_id(-10000000 - (i * 7919) % rows)
+        latencies.append(time.perf_counter() - start)
+        i += 1
+
+
+async def run(args):
+    path = os.path.join(os.environ['DATA_DIR'], 'orders.csv' + ('.gz' if args.gzip else ''))
+    stop = asyncio.Event()
+    lags, latencies, rss = [], [], []
+    # 先创建连接池（正式运行时启动即创建），再开始导出
+    await db_operations._fetch_order_by_chat_id(-10000000)
+    rss_before = current_rss_mb()
+    probe = asyncio.create_task(probe_loop(stop, args.rows, lags, latencies, rss))
+
+    start = time.perf_counter()
+    count = await db_operations.export_csv('orders', path, compress=args.gzip)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await probe
+
+    latencies.sort()
+    p99 = latencies[int(len(latencies) * 0.99) - 1] if latencies else 0.0
+    print(f"导出行数: {count:,}")
+    print(f"耗时: {elapsed:.2f} 秒 ({count / elapsed:,.0f} 行/秒)")
+    print(f"文件大小: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+    if rss_before:
+        print(f"导出期间内存: 开始 {rss_before:.1f} MB, 峰值 {max(rss, default=rss_before):.1f} MB")
+    print(f"导出期间查询: {len(latencies)} 次, p99 {p99 * 1000:.2f} ms, "
+          f"事件循环最大延迟 {max(lags, default=0) * 1000:.2f} ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000, help='测试订单数')
+    parser.add_argument('--gzip', action='store_true', help='导出为 gzip')
+    args = parser.parse_args()
+
+    init_db.init_database()
+    print(f"数据库: {db_operations.DB_NAME}")
+    start = time.perf_counter()
+    seed_orders(args.rows)
+    print(f"生成 {args.rows:,} 个订单: {time.perf_counter() - start:.1f} 秒")
+
+    try:
+        asyncio.run(run(args))
+    finally:
+        db_pool.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""处理器基准测试：用假的 Bot 驱动真实的处理器，统计每个处理器的延迟和总吞吐量
+
+覆盖的处理器:
+    amount      handle_amount_operation（+利息 / +本金减少）
+    end         set_end
+    breach      set_breach
+    create      try_create_order_from_title（群名变更自动建单）
+    report      generate_report_text（今日 / 本月 / 随机区间，全局或按归属）
+    broadcast   _handle_broadcast（创建群发任务，发送在后台完成）
+
+用法:
+    python scripts/bench_handlers.py [--ops 5000] [--concurrency 32] [--orders 5000]
+        [--groups 20] [--days 365] [--bot-latency-ms 0] [--output result.json]
+        [--compare 上次结果.json]
+
+在临时目录中创建数据库，不会影响正式数据。
+结果保存为 JSON（含 git 提交号），可用 --compare 与之前的结果对比。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import tempfile
+import subprocess
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# 必须在导入 db_operations / config 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench_handlers_')
+os.environ.setdefault('BOT_TOKEN', '0:bench')
+os.environ.setdefault('ADMIN_USER_IDS', '1')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_pool
+from config import ADMIN_IDS
+from utils import broadcast_engine
+from handlers.amount_handlers import handle_amount_operation
+from handlers.order_handlers import set_end, set_breach
+from handlers.report_handlers import generate_report_text
+from handlers.message_handlers import _handle_broadcast
+from utils.order_helpers import try_create_order_from_title
+
+# 各处理器在负载中的比例
+WORKLOAD_MIX = {
+    'amount': 40,
+    'report': 25,
+    'create': 15,
+    'end': 10,
+    'breach': 5,
+    'broadcast': 5,
+}
+
+BENCH_USER_ID = next(iter(ADMIN_IDS))
+
+
+# ========== 假的 Telegram 对象 ==========
+
+class FakeBot:
+    """只记录调用的 Bot，可模拟网络延迟"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.sent = 0
+        self.edited = 0
+        self._message_id = 0
+
+    async def _roundtrip(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await self._roundtrip()
+        self.sent += 1
+        self._message_id += 1
+        return FakeMessage(self, FakeChat(chat_id), None, text, self._message_id)
+
+    async def edit_message_text(self, text: str, chat_id: int = None, message_id: int = None, **kwargs):
+        await self._roundtrip()
+        self.edited += 1
+        return True
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, chat_type: str = 'supergroup', title: str = ''):
+        self.id = chat_id
+        self.type = chat_type
+        self.title = title
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+
+
+class FakeMessage:
+    def __init__(self, bot: FakeBot, chat: FakeChat, user: Optional[FakeUser],
+                 text: str, message_id: int = 0):
+        self._bot = bot
+        self.chat = chat
+        self.from_user = user
+        self.text = text
+        self.message_id = message_id
+
+    @property
+    def chat_id(self) -> int:
+        return self.chat.id
+
+    async def reply_text(self, text: str, **kwargs):
+        return await self._bot.send_message(chat_id=self.chat.id, text=text, **kwargs)
+
+
+class FakeUpdate:
+    def __init__(self, message: FakeMessage):
+        self.message = message
+        self.callback_query = None
+        self.effective_user = message.from_user
+        self.effective_chat = message.chat
+
+
+class FakeContext:
+    def __init__(self, bot: FakeBot, args: Optional[List[str]] = None):
+        self.bot = bot
+        self.args = args or []
+        self.user_data: Dict = {}
+        self.chat_data: Dict = {}
+
+
+def make_update(bot: FakeBot, chat_id: int, text: str = '',
+                chat_type: str = 'supergroup', title: str = '') -> FakeUpdate:
+    chat = FakeChat(chat_id, chat_type, title)
+    return FakeUpdate(FakeMessage(bot, chat, FakeUser(BENCH_USER_ID), text))
+
+
+# ========== 测试数据 ==========
+
+def seed_database(orders: int, groups: int, days: int, end_day: date) -> Dict[str, List[int]]:
+    """写入订单、归属ID和日结数据，返回按状态分组的 chat_id"""
+    group_ids = [f"S{i + 1:02d}" for i in range(groups)]
+    rng = random.Random(7)
+    conn = db_operations.get_connection()
+    cursor = conn.cursor()
+
+    order_rows = []
+    chats = {'normal': [], 'overdue': [], 'breach': []}
+    for i in range(orders):
+        chat_id = -1000000 - i
+        state = rng.choices(('normal', 'overdue', 'breach'), (6, 3, 1))[0]
+        chats[state].append(chat_id)
+        order_rows.append((
+            f"BENCH{i:07d}", group_ids[i % groups], chat_id,
+            f"{(end_day - timedelta(days=i % 180)).isoformat()} 12:00:00",
+            '一二三四五六日'[i % 7], 'AB'[i % 2], rng.randrange(5, 50) * 1000, state
+        ))
+    cursor.executemany('''
+    INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group,
+                        customer, amount, state)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', order_rows)
+
+    cursor.executemany(
+        'INSERT OR IGNORE INTO grouped_data (group_id, valid_orders, valid_amount) VALUES (?, ?, ?)',
+        [(gid, orders // groups, orders // groups * 20000) for gid in group_ids])
+    # 建单需要足够的流动资金
+    cursor.execute('UPDATE financial_data SET liquid_funds = 1e12')
+
+    daily_rows = []
+    for d in range(days):
+        day = (end_day - timedelta(days=d)).isoformat()
+        for gid in [None] + group_ids:
+            daily_rows.append((
+                day, gid, rng.randrange(5), rng.randrange(5) * 10000.0,
+                rng.randrange(5), rng.randrange(5) * 10000.0, rng.randrange(10000) * 1.0,
+                rng.randrange(3), rng.randrange(3) * 20000.0, rng.randrange(2) * 1.0,
+            ))
+    cursor.executemany('''
+    INSERT OR IGNORE INTO daily_data (date, group_id, new_clients, new_clients_amount,
+                                      old_clients, old_clients_amount, interest,
+                                      completed_orders, completed_amount, liquid_flow)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', daily_rows)
+    db_operations.rebuild_daily_rollups(cursor)
+    conn.commit()
+    conn.close()
+    chats['group_ids'] = group_ids
+    return chats
+
+
+# ========== 负载 ==========
+
+def build_workload(ops: int, chats: Dict[str, List], bot: FakeBot, end_day: date, days: int):
+    """生成 (处理器名, 协程工厂) 列表；完成/违约每次使用不同的订单"""
+    rng = random.Random(42)
+    names = list(WORKLOAD_MIX)
+    weights = [WORKLOAD_MIX[n] for n in names]
+    normal = list(chats['normal'])
+    overdue = list(chats['overdue'])
+    rng.shuffle(normal)
+    rng.shuffle(overdue)
+    all_chats = chats['normal'] + chats['overdue'] + chats['breach']
+    group_ids = chats['group_ids']
+    created = 0
+    plan = []
+
+    for _ in range(ops):
+        name = rng.choices(names, weights)[0]
+        if name == 'end' and not normal:
+            name = 'amount'
+        if name == 'breach' and not overdue:
+            name = 'amount'
+
+        if name == 'amount':
+            chat_id = rng.choice(all_chats)
+            text = f"+{rng.randrange(1, 100) * 100}" + ('b' if rng.random() < 0.2 else '')
+            update = make_update(bot, chat_id, text)
+            plan.append((name, lambda u=update: handle_amount_operation(u, FakeContext(bot))))
+        elif name == 'end':
+            update = make_update(bot, normal.pop(), '/end')
+            plan.append((name, lambda u=update: set_end(u, FakeContext(bot))))
+        elif name == 'breach':
+            update = make_update(bot, overdue.pop(), '/breach')
+            plan.append((name, lambda u=update: set_breach(u, FakeContext(bot))))
+        elif name == 'create':
+            # 群名格式: [A]YYMMDDNNKK，每天最多 100 个序号
+            day = date(2026, 1, 1) + timedelta(days=created // 100)
+            title = f"{'A' if created % 2 else ''}{day.strftime('%y%m%d')}{created % 100:02d}{rng.randrange(5, 50):02d}"
+            chat_id = -2000000 - created
+            created += 1
+            update = make_update(bot, chat_id, '', title=title)
+            plan.append((name, lambda u=update, t=title: try_create_order_from_title(
+                u, FakeContext(bot), u.effective_chat, t)))
+        elif name == 'report':
+            group_id = rng.choice([None] + group_ids)
+            kind = rng.choice(('today', 'month', 'query'))
+            if kind == 'today':
+                start = end = end_day
+            elif kind == 'month':
+                start, end = end_day.replace(day=1), end_day
+            else:
+                end = end_day - timedelta(days=rng.randrange(days))
+                start = end - timedelta(days=rng.randrange(1, days))
+            plan.append((name, lambda k=kind, s=start.isoformat(), e=end.isoformat(), g=group_id:
+                         generate_report_text(k, s, e, g)))
+        else:
+            targets = rng.sample(all_chats, min(len(all_chats), 50))
+            update = make_update(bot, BENCH_USER_ID, 'bench broadcast', chat_type='private')
+
+            async def run_broadcast(u=update, t=targets):
+                context = FakeContext(bot)
+                context.user_data['locked_groups'] = t
+                await _handle_broadcast(u, context, u.message.text)
+            plan.append((name, run_broadcast))
+    return plan
+
+
+async def run_workload(plan, concurrency: int) -> Dict:
+    """并发执行负载，返回每个处理器的延迟列表和总耗时"""
+    queue: asyncio.Queue = asyncio.Queue()
+    for item in plan:
+        queue.put_nowait(item)
+    latencies: Dict[str, List[float]] = {name: [] for name in WORKLOAD_MIX}
+    errors: Dict[str, int] = {name: 0 for name in WORKLOAD_MIX}
+
+    async def worker():
+        while True:
+            try:
+                name, factory = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            try:
+                await factory()
+            except Exception as e:
+                errors[name] += 1
+                logging.getLogger(__name__).error(f"{name} 出错: {e}")
+            latencies[name].append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+
+    # 等待后台群发任务完成（不计入处理器延迟）
+    broadcast_start = time.perf_counter()
+    if broadcast_engine._running:
+        await asyncio.gather(*broadcast_engine._running.values())
+    broadcast_drain = time.perf_counter() - broadcast_start
+    return {'latencies': latencies, 'errors': errors,
+            'elapsed': elapsed, 'broadcast_drain': broadcast_drain}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """最近秩百分位数"""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(p / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(result: Dict, ops: int) -> Dict:
+    handlers = {}
+    for name, values in result['latencies'].items():
+        if not values:
+            continue
+        values = sorted(values)
+        handlers[name] = {
+            'count': len(values),
+            'errors': result['errors'][name],
+            'mean_ms': sum(values) / len(values) * 1000,
+            'p50_ms': percentile(values, 50) * 1000,
+            'p95_ms': percentile(values, 95) * 1000,
+            'p99_ms': percentile(values, 99) * 1000,
+            'max_ms': values[-1] * 1000,
+        }
+    return {
+        'updates_per_sec': ops / result['elapsed'],
+        'elapsed_sec': result['elapsed'],
+        'broadcast_drain_sec': result['broadcast_drain'],
+        'handlers': handlers,
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=project_root,
+            capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_summary(summary: Dict, previous: Optional[Dict] = None):
+    def change(current: float, old: Optional[float], lower_is_better: bool = True) -> str:
+        if not old:
+            return ''
+        ratio = (current - old) / old * 100
+        worse = ratio > 0 if lower_is_better else ratio < 0
+        return f" ({ratio:+.1f}%{' ⚠️' if worse and abs(ratio) > 10 else ''})"
+
+    prev_handlers = (previous or {}).get('handlers', {})
+    print(f"{'处理器':<10} {'次数':>6} {'错误':>4} {'p50(ms)':>10} {'p95(ms)':>10} {'p99(ms)':>10}")
+    for name, stats in summary['handlers'].items():
+        old = prev_handlers.get(name, {})
+        print(f"{name:<10} {stats['count']:>6} {stats['errors']:>4} "
+              f"{stats['p50_ms']:>10.2f} {stats['p95_ms']:>10.2f} {stats['p99_ms']:>10.2f}"
+              f"{change(stats['p95_ms'], old.get('p95_ms'))}")
+    print(f"吞吐量: {summary['updates_per_sec']:,.0f} updates/sec"
+          f"{change(summary['updates_per_sec'], (previous or {}).get('updates_per_sec'), False)}")
+    print(f"后台群发完成耗时: {summary['broadcast_drain_sec']:.2f} 秒")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--ops', type=int, default=5000, help='处理的更新数')
+    parser.add_argument('--concurrency', type=int, default=32, help='同时处理的更新数')
+    parser.add_argument('--orders', type=int, default=5000, help='预置订单数')
+    parser.add_argument('--groups', type=int, default=20, help='归属ID数量')
+    parser.add_argument('--days', type=int, default=365, help='预置日结数据天数')
+    parser.add_argument('--bot-latency-ms', type=float, default=0.0,
+                        help='模拟每次 Telegram API 调用的延迟（毫秒）')
+    parser.add_argument('--output', help='结果 JSON 文件路径')
+    parser.add_argument('--compare', help='与之前保存的结果 JSON 对比')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+
+    init_db.init_database()
+    end_day = date.today()
+    seed_start = time.perf_counter()
+    chats = seed_database(args.orders, args.groups, args.days, end_day)
+    seed_elapsed = time.perf_counter() - seed_start
+
+    # 群发只测引擎本身的开销，不受 Telegram 限速影响
+    broadcast_engine.limiter = broadcast_engine.RateLimiter(
+        global_rate=1e9, per_chat_per_minute=1e9)
+
+    bot = FakeBot(args.bot_latency_ms / 1000)
+    plan = build_workload(args.ops, chats, bot, end_day, args.days)
+    result = asyncio.run(run_workload(plan, args.concurrency))
+    db_pool.close_pool()
+
+    summary = summarize(result, len(plan))
+    summary.update({
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'params': {
+            'ops': len(plan), 'concurrency': args.concurrency, 'orders': args.orders,
+            'groups': args.groups, 'days': args.days, 'bot_latency_ms': args.bot_latency_ms,
+        },
+        'seed_sec': seed_elapsed,
+        'bot_calls': {'send_message': bot.sent, 'edit_message_text': bot.edited},
+    })
+
+    previous = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous.get('params') != summary['params']:
+            print("⚠️  对比结果的测试参数不同，数据仅供参考")
+
+    print(f"数据库: {db_operations.DB_NAME}")
+    print(f"更新数: {len(plan)}, 并发: {args.concurrency}, 订单数: {args.orders}, "
+          f"归属ID: {args.groups}, 日结天数: {args.days}")
+    print_summary(summary, previous)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
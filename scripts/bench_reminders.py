@@ -0,0 +1,176 @@
+"""付款提醒活动基准测试：一次选出全部有效订单，为每个群生成提醒并通过群发引擎发送
+
+用法:
+    python scripts/bench_reminders.py [--orders 1000] [--rate 25] [--latency-ms 80] [--retry-after-every 300]
+
+在临时数据库中生成 --orders 个订单（约 2/3 为有效订单），假的 Bot 模拟网络延迟并定期返回 RetryAfter。
+活动发送到一半时中断（模拟重启），再用 resume_broadcast_jobs 继续，检查：
+  - 每个有效订单群恰好收到一次自己的提醒（本金 / 本金12%），已结束/违约的订单群没有收到
+  - 任务统计（成功/失败/总数）与实际发送一致
+输出选单查询耗时、生成文本耗时和整个活动的耗时。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=1000, help='订单数量')
+    parser.add_argument('--rate', type=float, default=25, help='全局发送速率（条/秒）')
+    parser.add_argument('--latency-ms', type=float, default=80, help='每次发送的模拟延迟')
+    parser.add_argument('--retry-after-every', type=int, default=300,
+                        help='每发送多少条返回一次 RetryAfter(1)，0 表示不返回')
+    return parser.parse_args()
+
+
+args = parse_args()
+# 必须在导入 db_operations / broadcast_engine 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='bench_reminders_')
+os.environ['BROADCAST_GLOBAL_RATE'] = str(args.rate)
+os.environ['BROADCAST_PROGRESS_INTERVAL'] = '1'
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+from telegram.error import RetryAfter
+import init_db
+import db_operations
+import db_pool
+from utils import broadcast_engine
+from utils.payment_reminder import (
+    build_reminder_targets, next_payment_date, render_order_reminder, start_reminder_campaign
+)
+
+STATES = ['normal', 'overdue', 'end', 'normal', 'breach', 'overdue']
+
+
+class FakeBot:
+    """模拟 Telegram 延迟和限流的 Bot"""
+
+    def __init__(self, latency: float, retry_after_every: int):
+        self.latency = latency
+        self.retry_after_every = retry_after_every
+        self.calls = 0
+        self.retry_afters = 0
+        self.sent = {}
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(self.latency)
+        if self.retry_after_every and call % self.retry_after_every == 0:
+            self.retry_afters += 1
+            raise RetryAfter(1)
+        if chat_id > 0:
+            # 状态消息（发给管理员）
+            return type('Message', (), {'message_id': 1})()
+        self.sent.setdefault(chat_id, []).append(text)
+
+    async def edit_message_text(self, **kwargs):
+        pass
+
+
+def seed_orders(count: int):
+    conn = db_operations.get_connection()
+    conn.executemany('''
+    INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group, customer, amount, state)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', [(
+        f"REM{i:06d}", f"S{(i % 10) + 1:02d}", -100000 - i, '2025-12-01 12:00:00',
+        '一二三四五六日'[i % 7], 'AB'[i % 2], 5000 + (i % 40) * 1000, STATES[i % len(STATES)]
+    ) for i in range(count)])
+    conn.commit()
+    expected = {row['chat_id']: row['amount'] for row in conn.execute(
+        "SELECT chat_id, amount FROM orders WHERE state IN ('normal', 'overdue')")}
+    conn.close()
+    return expected
+
+
+async def run(failures: list) -> dict:
+    expected = seed_orders(args.orders)
+    bot = FakeBot(args.latency_ms / 1000, args.retry_after_every)
+    results = {'groups': len(expected)}
+
+    start = time.perf_counter()
+    orders = await db_operations.get_reminder_orders()
+    results['query_ms'] = (time.perf_counter() - start) * 1000
+    start = time.perf_counter()
+    build_reminder_targets(orders)
+    results['render_ms'] = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    job_id, count = await start_reminder_campaign(bot, created_by=1, status_chat_id=1)
+    if count != len(expected):
+        failures.append(f"活动选出 {count} 个群，应为 {len(expected)}")
+
+    # 发送到一半时中断，模拟重启后继续
+    while len(bot.sent) < count // 2:
+        await asyncio.sleep(0.05)
+    task = broadcast_engine._running.get(job_id)
+    if task:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    results['before_restart'] = len(bot.sent)
+    await broadcast_engine.resume_broadcast_jobs(bot)
+    task = broadcast_engine._running.get(job_id)
+    if task:
+        await task
+    results['campaign_s'] = time.perf_counter() - start
+    results['retry_afters'] = bot.retry_afters
+
+    job = await db_operations.get_broadcast_job(job_id)
+    results['sent'], results['failed'] = job['sent'], job['failed']
+    if job['status'] != 'done' or job['sent'] != len(expected) or job['failed']:
+        failures.append(f"任务统计: {job['status']} 成功 {job['sent']} 失败 {job['failed']}")
+
+    due = next_payment_date()
+    # 中断时正在发送的消息可能在继续时重发一次（至少一次），其余群恰好一次
+    duplicated = [chat_id for chat_id, texts in bot.sent.items() if len(texts) > 1]
+    if len(duplicated) > broadcast_engine.BROADCAST_CONCURRENCY:
+        failures.append(f"{len(duplicated)} 个群收到重复提醒")
+    results['duplicated'] = len(duplicated)
+    if set(bot.sent) != set(expected):
+        failures.append(f"收到提醒的群 {len(bot.sent)} 个，应为 {len(expected)} 个")
+    wrong = [chat_id for chat_id, texts in bot.sent.items()
+             if chat_id in expected and texts[-1] != render_order_reminder(expected[chat_id], due)]
+    if wrong:
+        failures.append(f"{len(wrong)} 个群的提醒金额不正确，如 {bot.sent[wrong[0]][-1]!r}")
+    return results
+
+
+def main():
+    logging.basicConfig(level=logging.WARNING)
+    # 限流重试的日志是预期的
+    logging.getLogger('utils.broadcast_engine').setLevel(logging.CRITICAL)
+    init_db.init_database()
+    failures = []
+    try:
+        results = asyncio.run(run(failures))
+    finally:
+        db_pool.close_pool()
+
+    print(f"\n{args.orders} 个订单，{results['groups']} 个有效订单群，"
+          f"全局 {args.rate:g} 条/秒，延迟 {args.latency_ms:g} ms")
+    print(f"  选单查询: {results['query_ms']:.1f} ms")
+    print(f"  生成提醒文本: {results['render_ms']:.1f} ms")
+    print(f"  整个活动（含中断后继续）: {results['campaign_s']:.1f} s，"
+          f"RetryAfter {results['retry_afters']} 次，中断前已发送 {results['before_restart']}，"
+          f"重发 {results['duplicated']}")
+    print(f"  任务统计: 成功 {results['sent']}，失败 {results['failed']}")
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("✅ 付款提醒活动检查通过")
+
+
+if __name__ == "__main__":
+    main()
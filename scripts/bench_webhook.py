@@ -0,0 +1,300 @@
+"""接收方式基准测试：本地假 Telegram 服务器分别以长轮询和 webhook 推送同一批更新，比较送达延迟和吞吐量
+
+用法:
+    python scripts/bench_webhook.py [--updates 2000] [--rate 500] [--chats 50]
+        [--latency-ms 0] [--handler-ms 5] [--max-connections 40] [--modes polling,webhook]
+
+假服务器实现 getMe / getUpdates（长轮询）/ setWebhook / deleteWebhook，
+按 --rate 生成消息更新：polling 模式放入 getUpdates 队列，webhook 模式 POST 到机器人内置的 HTTP 服务器
+（带 X-Telegram-Bot-Api-Secret-Token，并发数不超过 max_connections）。
+--latency-ms 模拟单程网络延迟。webhook 模式另外发送一批错误密钥的请求，确认被拒绝且不会被处理。
+机器人使用与 main.py 相同的 ChatSerializedUpdateProcessor，处理器只 sleep --handler-ms 并记录送达时间。
+"""
+import os
+import sys
+import json
+import time
+import socket
+import asyncio
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+os.environ.setdefault('BOT_TOKEN', '1:bench')
+os.environ.setdefault('ADMIN_USER_IDS', '1')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import tornado.web
+import tornado.httpserver
+from telegram import Update
+from telegram.ext import Application, MessageHandler, filters
+from config import BOT_TOKEN, WEBHOOK_SECRET
+from utils.update_processor import ChatSerializedUpdateProcessor
+
+BAD_SECRET_REQUESTS = 20
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    if not sorted_values:
+        return 0.0
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * p / 100))]
+
+
+class FakeTelegram:
+    """假的 Bot API：生成更新，通过 getUpdates 或 webhook 交给机器人"""
+
+    def __init__(self, latency: float, max_connections: int):
+        self.latency = latency
+        self.max_connections = max_connections
+        self.pending: List[dict] = []
+        self.new_update = asyncio.Event()
+        self.created: Dict[int, float] = {}
+        self.webhook_url: Optional[str] = None
+        self.webhook_secret: Optional[str] = None
+        self.requests: Dict[str, int] = {}
+        self.ack_times: List[float] = []
+        self.rejected = 0
+        self.message_id = 0
+
+    async def travel(self):
+        """模拟单程网络延迟"""
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    def make_update(self, update_id: int, chat_index: int) -> dict:
+        return {
+            'update_id': update_id,
+            'message': {
+                'message_id': update_id,
+                'date': int(time.time()),
+                'chat': {'id': -1000000 - chat_index, 'type': 'supergroup', 'title': f'bench {chat_index}'},
+                'from': {'id': 100000 + chat_index, 'is_bot': False, 'first_name': 'bench'},
+                'text': f'bench {update_id}',
+            },
+        }
+
+    async def api(self, method: str, params: dict):
+        """处理一次 Bot API 调用"""
+        self.requests[method] = self.requests.get(method, 0) + 1
+        if method == 'getMe':
+            return {'id': 1, 'is_bot': True, 'first_name': 'bench', 'username': 'bench_bot'}
+        if method == 'setWebhook':
+            self.webhook_url = params.get('url')
+            self.webhook_secret = params.get('secret_token')
+            self.max_connections = int(params.get('max_connections') or self.max_connections)
+            return True
+        if method == 'deleteWebhook':
+            self.webhook_url = None
+            return True
+        if method in ('sendMessage', 'editMessageText'):
+            # 发送/编辑消息返回一条消息
+            self.message_id += 1
+            return {
+                'message_id': self.message_id, 'date': int(time.time()),
+                'chat': {'id': int(params.get('chat_id') or 0), 'type': 'supergroup'},
+                'text': params.get('text', ''),
+            }
+        if method == 'getUpdates':
+            offset = int(params.get('offset') or 0)
+            timeout = float(params.get('timeout') or 0)
+            # 已确认（update_id < offset）的更新不再返回
+            self.pending = [u for u in self.pending if u['update_id'] >= offset]
+            if not self.pending and timeout:
+                self.new_update.clear()
+                try:
+                    await asyncio.wait_for(self.new_update.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.pending[:100]
+        return True
+
+    async def produce(self, count: int, rate: float, chats: int, mode: str):
+        """按速率生成更新"""
+        queue: asyncio.Queue = asyncio.Queue()
+        workers = []
+        if mode == 'webhook':
+            # 与 Telegram 一样：最多 max_connections 个长连接，每个连接收到响应后再发下一个
+            workers = [asyncio.create_task(self.push_worker(queue))
+                       for _ in range(self.max_connections)]
+        start = time.perf_counter()
+        for i in range(count):
+            # 按计划时间发送，不累积误差
+            delay = start + i / rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            update = self.make_update(i + 1, i % chats)
+            self.created[update['update_id']] = time.perf_counter()
+            if mode == 'polling':
+                self.pending.append(update)
+                self.new_update.set()
+            else:
+                queue.put_nowait((update, self.webhook_secret))
+        if workers:
+            # 错误密钥的请求应被拒绝
+            for i in range(BAD_SECRET_REQUESTS):
+                queue.put_nowait((self.make_update(count + 1 + i, i % chats), 'wrong-secret'))
+            for _ in workers:
+                queue.put_nowait(None)
+            await asyncio.gather(*workers)
+
+    async def push_worker(self, queue: asyncio.Queue):
+        """一个 webhook 连接：依次 POST 队列中的更新，记录确认耗时"""
+        url = urlsplit(self.webhook_url)
+        reader, writer = await asyncio.open_connection(url.hostname, url.port)
+        while True:
+            item = await queue.get()
+            if item is None:
+                break
+            update, secret = item
+            body = json.dumps(update).encode()
+            await self.travel()
+            start = time.perf_counter()
+            writer.write((
+                f"POST {url.path} HTTP/1.1\r\nHost: {url.netloc}\r\n"
+                f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n"
+                f"X-Telegram-Bot-Api-Secret-Token: {secret}\r\n\r\n").encode() + body)
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while (line := await reader.readline()) not in (b'\r\n', b''):
+                name, _, value = line.decode().partition(':')
+                if name.lower() == 'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            if status == 200:
+                self.ack_times.append(time.perf_counter() - start)
+            else:
+                self.rejected += 1
+            await self.travel()
+        writer.close()
+
+
+class BotApiHandler(tornado.web.RequestHandler):
+    """/bot<token>/<method>"""
+
+    def initialize(self, fake: FakeTelegram):
+        self.fake = fake
+
+    async def post(self, method: str):
+        await self.fake.travel()
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            params = json.loads(self.request.body or b'{}')
+        else:
+            params = {k: v[-1].decode() for k, v in self.request.body_arguments.items()}
+        result = await self.fake.api(method, params)
+        await self.fake.travel()
+        self.set_header('Content-Type', 'application/json')
+        self.finish(json.dumps({'ok': True, 'result': result}))
+
+
+async def run_mode(mode: str, args) -> dict:
+    fake = FakeTelegram(args.latency_ms / 1000, args.max_connections)
+    api_port = free_port()
+    server = tornado.httpserver.HTTPServer(tornado.web.Application([
+        (rf'/bot{BOT_TOKEN}/(\w+)', BotApiHandler, {'fake': fake}),
+    ]))
+    server.listen(api_port, '127.0.0.1')
+
+    received: Dict[int, float] = {}
+    done = asyncio.Event()
+
+    async def record(update: Update, context):
+        received[update.update_id] = time.perf_counter()
+        if args.handler_ms:
+            await asyncio.sleep(args.handler_ms / 1000)
+        if len(received) >= args.updates:
+            done.set()
+
+    application = (
+        Application.builder()
+        .token(BOT_TOKEN)
+        .base_url(f'http://127.0.0.1:{api_port}/bot')
+        .concurrent_updates(ChatSerializedUpdateProcessor())
+        .build()
+    )
+    application.add_handler(MessageHandler(filters.TEXT, record))
+    await application.initialize()
+    if mode == 'polling':
+        await application.updater.start_polling(poll_interval=0, timeout=10)
+    else:
+        webhook_port = free_port()
+        await application.updater.start_webhook(
+            listen='127.0.0.1', port=webhook_port, url_path='telegram',
+            webhook_url=f'http://127.0.0.1:{webhook_port}/telegram',
+            secret_token=WEBHOOK_SECRET, max_connections=args.max_connections)
+    await application.start()
+
+    start = time.perf_counter()
+    await fake.produce(args.updates, args.rate, args.chats, mode)
+    try:
+        await asyncio.wait_for(done.wait(), 30)
+    except asyncio.TimeoutError:
+        pass
+    elapsed = max(received.values(), default=start) - start
+
+    await application.updater.stop()
+    await application.stop()
+    await application.shutdown()
+    # 结束还在等待的长轮询请求
+    fake.new_update.set()
+    server.stop()
+    await server.close_all_connections()
+
+    latencies = sorted(received[uid] - fake.created[uid] for uid in received if uid in fake.created)
+    acks = sorted(fake.ack_times)
+    return {
+        'mode': mode,
+        'delivered': sum(1 for uid in received if uid <= args.updates),
+        'bad_secret_processed': sum(1 for uid in received if uid > args.updates),
+        'rejected': fake.rejected,
+        'throughput': len(received) / elapsed if elapsed else 0.0,
+        'p50_ms': percentile(latencies, 50) * 1000,
+        'p99_ms': percentile(latencies, 99) * 1000,
+        'max_ms': (latencies[-1] if latencies else 0.0) * 1000,
+        'ack_p99_ms': percentile(acks, 99) * 1000,
+        'api_requests': sum(fake.requests.values()),
+    }
+
+
+def print_result(result: dict, total: int):
+    print(f"\n[{result['mode']}]")
+    print(f"  送达: {result['delivered']}/{total}  吞吐量: {result['throughput']:,.0f} updates/sec")
+    print(f"  送达延迟: p50 {result['p50_ms']:.2f} ms, p99 {result['p99_ms']:.2f} ms, "
+          f"max {result['max_ms']:.2f} ms")
+    print(f"  Bot API 请求数: {result['api_requests']}")
+    if result['mode'] == 'webhook':
+        print(f"  确认耗时 p99: {result['ack_p99_ms']:.2f} ms")
+        print(f"  错误密钥: 拒绝 {result['rejected']}/{BAD_SECRET_REQUESTS}，"
+              f"被处理 {result['bad_secret_processed']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--updates', type=int, default=2000, help='每种模式发送的更新数')
+    parser.add_argument('--rate', type=float, default=500, help='每秒生成的更新数')
+    parser.add_argument('--chats', type=int, default=50, help='群数量')
+    parser.add_argument('--latency-ms', type=float, default=0, help='模拟单程网络延迟（毫秒）')
+    parser.add_argument('--handler-ms', type=float, default=5, help='每个更新的处理耗时（毫秒）')
+    parser.add_argument('--max-connections', type=int, default=40, help='webhook 最大并发连接数')
+    parser.add_argument('--modes', default='polling,webhook', help='测试的模式（逗号分隔）')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    print(f"{args.updates} 个更新, {args.rate:.0f}/秒, {args.chats} 个群, "
+          f"网络延迟 {args.latency_ms:.0f} ms, 处理耗时 {args.handler_ms:.0f} ms")
+    for mode in args.modes.split(','):
+        print_result(asyncio.run(run_mode(mode.strip(), args)), args.updates)
+
+
+if __name__ == "__main__":
+    main()
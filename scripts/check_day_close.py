@@ -0,0 +1,183 @@
+"""日结检查：日终存量、冻结已日结的日期、预先生成的今日报表、推送给管理员
+
+用法:
+    python scripts/check_day_close.py [--orders 3000] [--groups 30]
+
+在临时数据库中按 --groups 个归属创建 --orders 个订单并记利息，然后日结，依次检查：
+  - daily_stock 中全局和每个归属的日终存量与 financial_data / grouped_data 一致
+  - 日结后提交、日期仍为已日结日期的变动计入下一天（最近付款日也记为下一天），已日结日期的 daily_data 不变
+  - 重复日结不改动存量、不重复推送
+  - 日结后第一次今日报表直接使用预先生成的统计文本，余额在读取时填入
+  - 统计写入后只重新生成全局和该归属的统计文本，其他归属仍使用预先生成的文本
+  - 管理员收到前一天的全局报表和归属排行
+输出日结耗时，以及今日报表使用预生成文本和重新生成的耗时。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='check_day_close_')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_cache
+import db_pool
+from db_operations import StatsDelta
+from utils import schedule_executor
+from utils.day_close import close_day, run_day_close
+from handlers.report_handlers import generate_report_text, get_today_report_text
+
+CLOSED_DATE = '2025-12-10'
+PERIOD_DATE = '2025-12-11'
+STOCK_FIELDS = ('valid_orders', 'valid_amount', 'liquid_funds')
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+async def seed(args):
+    await db_operations.apply_stats_delta(
+        StatsDelta(CLOSED_DATE).for_event('adjust').add_liquid(args.orders * 10000))
+    for start in range(0, args.orders, 200):
+        await asyncio.gather(*(db_operations.open_order(CLOSED_DATE, {
+            'order_id': f"DC{i:06d}", 'group_id': f"S{i % args.groups + 1:02d}",
+            'chat_id': -500000 - i, 'date': f"{CLOSED_DATE} 12:00:00", 'group': '三',
+            'customer': 'AB'[i % 2], 'amount': 1000 + i % 9 * 500, 'state': 'normal'})
+            for i in range(start, min(start + 200, args.orders))))
+    await asyncio.gather(*(db_operations.record_interest(CLOSED_DATE, -500000 - i, 100)
+                           for i in range(0, args.orders, 3)))
+
+
+async def run(args, failures: list) -> dict:
+    await seed(args)
+    timings = {}
+
+    start = time.perf_counter()
+    result = await close_day(PERIOD_DATE)
+    timings['close'] = time.perf_counter() - start
+    if result['status'] != 'ok' or result['date'] != CLOSED_DATE:
+        failures.append(f"日结: {result['status']} {result['date']}")
+
+    # 日终存量
+    stock = {row['group_id']: row for row in await db_operations.get_daily_stock(CLOSED_DATE)}
+    financial = await db_operations.get_financial_data()
+    expected = {None: financial}
+    for group_id in await db_operations.get_all_group_ids():
+        expected[group_id] = await db_operations.get_grouped_data(group_id)
+    if set(stock) != set(expected):
+        failures.append(f"日终存量: {len(stock)} 行，应为 {len(expected)} 行")
+    for group_id, row in expected.items():
+        if group_id in stock and any(stock[group_id][f] != row[f] for f in STOCK_FIELDS):
+            failures.append(f"日终存量 {group_id or '全局'}: {stock[group_id]} != {row}")
+    if await db_operations.get_last_closed_date() != CLOSED_DATE:
+        failures.append("最后日结日期不正确")
+
+    # 日结后第一次今日报表：使用预先生成的文本
+    hits = db_cache.rendered_reports.stats()['hits']
+    start = time.perf_counter()
+    cached = await get_today_report_text(PERIOD_DATE)
+    for group_id in list(expected)[1:]:
+        await get_today_report_text(PERIOD_DATE, group_id)
+    timings['cached'] = (time.perf_counter() - start) / len(expected)
+    if db_cache.rendered_reports.stats()['hits'] - hits != len(expected):
+        failures.append("日结后的今日报表没有全部命中预先生成的文本")
+    # 对比：不使用任何缓存重新生成
+    db_cache.report_stats.clear()
+    start = time.perf_counter()
+    for group_id in expected:
+        await generate_report_text("today", PERIOD_DATE, PERIOD_DATE, group_id)
+    timings['render'] = (time.perf_counter() - start) / len(expected)
+
+    # 冻结：日切前开始、日切后才提交的利息（日期仍为已日结日期）计入下一天
+    closed_before = await db_operations.get_daily_data(CLOSED_DATE)
+    await db_operations.record_interest(CLOSED_DATE, -500001, 777)
+    if await db_operations.get_daily_data(CLOSED_DATE) != closed_before:
+        failures.append("已日结日期的日结数据被修改")
+    if (await db_operations.get_daily_data(PERIOD_DATE))['interest'] != 777:
+        failures.append("日切后提交的利息没有计入下一天")
+    if (await db_operations._fetch_order_by_chat_id(-500001))['last_payment_date'] != PERIOD_DATE:
+        failures.append("日切后提交的利息，最近付款日不是计入统计的日期")
+    # 统计写入后只重新生成全局和该归属的统计部分
+    interest_group = (await db_operations._fetch_order_by_chat_id(-500001))['group_id']
+    refreshed = await get_today_report_text(PERIOD_DATE)
+    if refreshed == cached or '777.00' not in refreshed:
+        failures.append("统计写入后今日报表没有重新生成")
+    misses = db_cache.rendered_reports.stats()['misses']
+    for group_id in list(expected)[1:]:
+        await get_today_report_text(PERIOD_DATE, group_id)
+    if db_cache.rendered_reports.stats()['misses'] - misses != 1:
+        failures.append("统计写入后其他归属的预先生成报表也失效了")
+    if '利息收入: 777.00' not in await get_today_report_text(PERIOD_DATE, interest_group):
+        failures.append(f"归属 {interest_group} 的今日报表没有重新生成")
+    # 只改余额（不写日结数据）时仍使用缓存，报表显示最新余额
+    other_group = next(g for g in list(expected)[1:] if g != interest_group)
+    await db_operations.update_grouped_data(other_group, 'valid_amount', 12345)
+    hits = db_cache.rendered_reports.stats()['hits']
+    balance = (await db_operations.get_grouped_data(other_group))['valid_amount']
+    if f"有效订单金额: {balance:.2f}" not in await get_today_report_text(PERIOD_DATE, other_group) \
+            or db_cache.rendered_reports.stats()['hits'] - hits != 1:
+        failures.append("余额变动后今日报表没有使用缓存或余额不是最新")
+
+    # 重复日结 / 定时任务推送
+    bot = RecordingBot()
+    schedule_executor._bot = bot
+    again = await close_day(PERIOD_DATE)
+    if again['status'] != 'already_closed' or len(again['stock']) != len(expected):
+        failures.append(f"重复日结: {again['status']}")
+    # 定时任务按当前日期日结前一天
+    pushed_day = await run_day_close([1, 2])
+    pushed = {chat_id for chat_id, _ in bot.sent}
+    if pushed != {1, 2} or not any(
+            f"日结数据 ({pushed_day['date']})" in text for _, text in bot.sent):
+        failures.append(f"推送给管理员: {len(bot.sent)} 条")
+    bot.sent.clear()
+    await run_day_close([1, 2])
+    if bot.sent:
+        failures.append("同一天重复推送")
+    timings['groups'] = len(expected)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=3000, help='订单数量')
+    parser.add_argument('--groups', type=int, default=30, help='归属数量')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    init_db.init_database()
+    failures = []
+    try:
+        timings = asyncio.run(run(args, failures))
+    finally:
+        db_pool.close_pool()
+
+    print(f"\n{args.orders} 个订单，{timings['groups']} 份报表（全局 + 各归属）")
+    print(f"  日结（冻结 + 日终存量 + 预先生成报表）: {timings['close'] * 1000:.0f} ms")
+    print(f"  今日报表: 预先生成 {timings['cached'] * 1000:.3f} ms/份，"
+          f"重新生成 {timings['render'] * 1000:.2f} ms/份")
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("✅ 日结检查通过")
+
+
+if __name__ == "__main__":
+    main()
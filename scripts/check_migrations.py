@@ -0,0 +1,370 @@
+"""数据库迁移检查：把每个历史版本的数据库升级到最新版本，检查表结构与新建数据库一致、数据不丢失
+
+用法:
+    python scripts/check_migrations.py
+
+检查的快照：
+  - 引入版本号之前最早的数据库（支付账号表带 UNIQUE、日结表缺少流动资金/开销列）
+  - 每个迁移版本 0..N-1（按 user_version 升级）
+  - 同样的表结构但 user_version = 0（旧版 init_database 创建的数据库没有版本号）
+另外检查：已是最新版本时只执行一条 PRAGMA、迁移失败整体回滚、数据库版本高于程序时拒绝启动。
+在临时目录中创建数据库，不会影响正式数据。新增迁移后直接运行即可，不需要修改本脚本。
+"""
+import io
+import os
+import sys
+import tempfile
+import contextlib
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='check_migrations_')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import sqlite3
+import init_db
+import db_operations
+
+# 引入版本号之前最早的表结构（旧版 init_database 会在启动时修复这些差异）
+LEGACY_SCHEMA = '''
+CREATE TABLE orders (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    order_id TEXT UNIQUE NOT NULL,
+    group_id TEXT NOT NULL,
+    chat_id INTEGER NOT NULL,
+    date TEXT NOT NULL,
+    weekday_group TEXT NOT NULL,
+    customer TEXT NOT NULL,
+    amount REAL NOT NULL,
+    state TEXT NOT NULL,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE financial_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    valid_orders INTEGER DEFAULT 0,
+    valid_amount REAL DEFAULT 0,
+    liquid_funds REAL DEFAULT 0,
+    new_clients INTEGER DEFAULT 0,
+    new_clients_amount REAL DEFAULT 0,
+    old_clients INTEGER DEFAULT 0,
+    old_clients_amount REAL DEFAULT 0,
+    interest REAL DEFAULT 0,
+    completed_orders INTEGER DEFAULT 0,
+    completed_amount REAL DEFAULT 0,
+    breach_orders INTEGER DEFAULT 0,
+    breach_amount REAL DEFAULT 0,
+    breach_end_orders INTEGER DEFAULT 0,
+    breach_end_amount REAL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE grouped_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    group_id TEXT UNIQUE NOT NULL,
+    valid_orders INTEGER DEFAULT 0,
+    valid_amount REAL DEFAULT 0,
+    liquid_funds REAL DEFAULT 0,
+    new_clients INTEGER DEFAULT 0,
+    new_clients_amount REAL DEFAULT 0,
+    old_clients INTEGER DEFAULT 0,
+    old_clients_amount REAL DEFAULT 0,
+    interest REAL DEFAULT 0,
+    completed_orders INTEGER DEFAULT 0,
+    completed_amount REAL DEFAULT 0,
+    breach_orders INTEGER DEFAULT 0,
+    breach_amount REAL DEFAULT 0,
+    breach_end_orders INTEGER DEFAULT 0,
+    breach_end_amount REAL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE daily_data (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    group_id TEXT,
+    new_clients INTEGER DEFAULT 0,
+    new_clients_amount REAL DEFAULT 0,
+    old_clients INTEGER DEFAULT 0,
+    old_clients_amount REAL DEFAULT 0,
+    interest REAL DEFAULT 0,
+    completed_orders INTEGER DEFAULT 0,
+    completed_amount REAL DEFAULT 0,
+    breach_orders INTEGER DEFAULT 0,
+    breach_amount REAL DEFAULT 0,
+    breach_end_orders INTEGER DEFAULT 0,
+    breach_end_amount REAL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(date, group_id)
+);
+CREATE TABLE authorized_users (
+    user_id INTEGER PRIMARY KEY,
+    added_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE payment_accounts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    account_type TEXT UNIQUE NOT NULL,
+    account_number TEXT NOT NULL,
+    account_name TEXT,
+    balance REAL DEFAULT 0,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP
+);
+CREATE TABLE scheduled_broadcasts (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    slot INTEGER NOT NULL CHECK(slot >= 1 AND slot <= 3),
+    time TEXT NOT NULL,
+    chat_id INTEGER,
+    chat_title TEXT,
+    message TEXT NOT NULL,
+    is_active INTEGER DEFAULT 1,
+    created_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    updated_at TEXT DEFAULT CURRENT_TIMESTAMP,
+    UNIQUE(slot)
+);
+INSERT INTO financial_data (valid_orders, valid_amount, liquid_funds, new_clients, new_clients_amount)
+VALUES (2, 3000, 97000, 2, 3000);
+INSERT INTO grouped_data (group_id, valid_orders, valid_amount, new_clients, new_clients_amount)
+VALUES ('S01', 2, 3000, 2, 3000);
+INSERT INTO daily_data (date, group_id, new_clients, new_clients_amount)
+VALUES ('2025-10-01', NULL, 2, 3000), ('2025-10-01', 'S01', 2, 3000);
+INSERT INTO payment_accounts (account_type, account_number, account_name, balance)
+VALUES ('gcash', '0917', 'A', 100), ('paymaya', '0918', 'B', 200);
+INSERT INTO authorized_users (user_id) VALUES (42);
+INSERT INTO scheduled_broadcasts (slot, time, chat_id, message) VALUES (1, '09:00', -1001, 'hi');
+'''
+
+
+def migrate(conn, target: int = init_db.SCHEMA_VERSION) -> list:
+    """执行迁移，不输出每个迁移的日志"""
+    with contextlib.redirect_stdout(io.StringIO()):
+        return init_db.migrate(conn, target)
+
+
+def connect(name: str) -> sqlite3.Connection:
+    path = os.path.join(os.environ['DATA_DIR'], f'{name}.db')
+    if os.path.exists(path):
+        os.remove(path)
+    return sqlite3.connect(path)
+
+
+def table_exists(conn, table: str) -> bool:
+    return conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type='table' AND name=?", (table,)).fetchone() is not None
+
+
+def add_sample_data(conn):
+    """在已迁移到某个版本的数据库中写入数据"""
+    if table_exists(conn, 'orders'):
+        conn.executemany('''
+        INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group, customer, amount, state)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        ''', [('MIG0001', 'S01', -1001, '2025-10-01 12:00:00', '三', 'A', 1000, 'normal'),
+              ('MIG0002', 'S01', -1002, '2025-10-01 12:00:00', '三', 'B', 2000, 'end')])
+    if table_exists(conn, 'order_events'):
+        # 迁移 9 从流水中取最近付款日，迁移 11 从流水生成每日存量
+        conn.execute('''
+        INSERT INTO order_events (event_type, order_id, chat_id, group_id, date, amount, deltas)
+        VALUES ('interest', 'MIG0001', -1001, 'S01', '2025-10-08', 50,
+                '{"financial": {"interest": 50, "liquid_funds": 50}}')
+        ''')
+    if table_exists(conn, 'daily_data'):
+        conn.execute('''
+        INSERT OR IGNORE INTO daily_data (date, group_id, new_clients, new_clients_amount)
+        VALUES ('2025-10-01', NULL, 2, 3000)
+        ''')
+    if table_exists(conn, 'scheduled_broadcasts'):
+        # 迁移 8 之前的 3 个槽位（槽位 3 只有群名，没有群组ID）
+        conn.execute('''
+        INSERT INTO scheduled_broadcasts (slot, time, chat_id, chat_title, message)
+        VALUES (2, '21:30', -1002, 'B', 'reminder'), (3, '08', NULL, 'C', 'no chat')
+        ''')
+    if table_exists(conn, 'daily_rollups'):
+        # 程序写日结数据时同步累加汇总
+        db_operations.rebuild_daily_rollups(conn.cursor())
+    conn.commit()
+
+
+def schema_of(conn) -> dict:
+    """表的列集合和索引（列顺序不比较：ALTER TABLE 添加的列在末尾）"""
+    schema = {}
+    for kind, name, table in conn.execute(
+            "SELECT type, name, tbl_name FROM sqlite_master "
+            "WHERE name NOT LIKE 'sqlite_sequence' ORDER BY name"):
+        if kind == 'table':
+            schema[(kind, name)] = frozenset(
+                tuple(row[1:]) for row in conn.execute(f"PRAGMA table_info({name})"))
+        else:
+            schema[(kind, name)] = table
+    return schema
+
+
+def counts(conn) -> dict:
+    return {table: conn.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+            for table in ('orders', 'payment_accounts', 'daily_data', 'authorized_users')
+            if table_exists(conn, table)}
+
+
+def legacy_schedules(conn) -> list:
+    """旧的定时播报槽位迁移后应有的 (cron, 目标群)"""
+    if not table_exists(conn, 'scheduled_broadcasts'):
+        return []
+    result = []
+    for time_str, chat_id in conn.execute(
+            'SELECT time, chat_id FROM scheduled_broadcasts ORDER BY slot'):
+        hour, _, minute = time_str.partition(':')
+        result.append((f"{int(minute or 0)} {int(hour)} * * *", chat_id))
+    return result
+
+
+def migrated_schedules(conn) -> list:
+    return conn.execute('''
+    SELECT s.cron, t.chat_id FROM schedules s
+    LEFT JOIN schedule_targets t ON t.schedule_id = s.id
+    ORDER BY s.id
+    ''').fetchall()
+
+
+def expected_last_payment(conn) -> dict:
+    """迁移 9 之前的数据库升级后各订单应有的最近付款日（与升级的时间无关）"""
+    if not table_exists(conn, 'orders') or 'last_payment_date' in {
+            row[1] for row in conn.execute('PRAGMA table_info(orders)')}:
+        return {}
+    paid = table_exists(conn, 'order_events') and conn.execute(
+        "SELECT 1 FROM order_events WHERE order_id = 'MIG0001'").fetchone()
+    # 没有付款记录时取库中最后记账的日期（日结数据和订单日期都是 2025-10-01）
+    expected = {'MIG0001': '2025-10-08' if paid else '2025-10-01', 'MIG0002': None}
+    present = {row[0] for row in conn.execute(
+        "SELECT order_id FROM orders WHERE order_id IN ('MIG0001', 'MIG0002')")}
+    return {order_id: value for order_id, value in expected.items() if order_id in present}
+
+
+def check_upgrade(label: str, conn, expected_schema: dict, failures: list):
+    """升级到最新版本并比较表结构、数据"""
+    before = counts(conn)
+    schedules = legacy_schedules(conn)
+    last_payments = expected_last_payment(conn)
+    try:
+        migrate(conn)
+    except Exception as e:
+        failures.append(f"{label}: 迁移失败 {e!r}")
+        return
+    version = init_db.get_schema_version(conn)
+    if version != init_db.SCHEMA_VERSION:
+        failures.append(f"{label}: 升级后版本为 {version}")
+
+    schema = schema_of(conn)
+    for key in sorted(set(schema) | set(expected_schema)):
+        if schema.get(key) != expected_schema.get(key):
+            failures.append(f"{label}: {key[0]} {key[1]} 与新建数据库不一致")
+
+    after = counts(conn)
+    for table, count in before.items():
+        if after.get(table, 0) < count:
+            failures.append(f"{label}: {table} 行数 {count} -> {after.get(table, 0)}")
+    for order_id, expected in last_payments.items():
+        actual = conn.execute(
+            'SELECT last_payment_date FROM orders WHERE order_id = ?', (order_id,)).fetchone()[0]
+        # 已完成订单不回填
+        if actual != expected:
+            failures.append(f"{label}: {order_id} 最近付款日为 {actual}，应为 {expected}")
+    if schedules and migrated_schedules(conn) != schedules:
+        failures.append(f"{label}: 定时播报 {schedules} 迁移为 {migrated_schedules(conn)}")
+    if table_exists(conn, 'order_events') and conn.execute(
+            "SELECT 1 FROM order_events WHERE order_id = 'MIG0001'").fetchone():
+        # 流水中最后一次存量变动当天的日终存量即当前存量
+        stock = conn.execute(
+            "SELECT liquid_funds FROM daily_stock WHERE date = '2025-10-08' AND group_id IS NULL"
+        ).fetchone()
+        current = conn.execute(
+            'SELECT liquid_funds FROM financial_data ORDER BY id DESC LIMIT 1').fetchone()
+        if stock is None or stock[0] != current[0]:
+            failures.append(f"{label}: 每日存量 {stock and stock[0]}，应为当前存量 {current[0]}")
+    if after.get('daily_data'):
+        if not conn.execute('SELECT COUNT(*) FROM daily_rollups').fetchone()[0]:
+            failures.append(f"{label}: 已有日结数据但未生成月/周汇总")
+        if not conn.execute('SELECT COUNT(*) FROM order_events').fetchone()[0]:
+            failures.append(f"{label}: 已有统计数据但未写入 baseline 流水")
+
+    # 再次启动：只读取一次 user_version
+    statements = []
+    conn.set_trace_callback(statements.append)
+    migrate(conn)
+    conn.set_trace_callback(None)
+    if statements != ['PRAGMA user_version']:
+        failures.append(f"{label}: 已是最新版本时执行了 {statements}")
+    conn.close()
+    print(f"  {label}: {before} -> {after}")
+
+
+def check_rollback(expected_schema: dict, failures: list):
+    """迁移出错时整个迁移回滚，版本号不变"""
+    def broken_migration(cursor):
+        """测试用：建表后出错"""
+        cursor.execute('CREATE TABLE migration_probe (id INTEGER)')
+        raise RuntimeError('broken migration')
+
+    conn = connect('rollback')
+    migrate(conn)
+    init_db.MIGRATIONS.append(broken_migration)
+    try:
+        migrate(conn, init_db.SCHEMA_VERSION + 1)
+        failures.append("回滚: 出错的迁移没有抛出异常")
+    except RuntimeError:
+        pass
+    finally:
+        init_db.MIGRATIONS.remove(broken_migration)
+    if init_db.get_schema_version(conn) != init_db.SCHEMA_VERSION:
+        failures.append("回滚: 出错后版本号被修改")
+    if schema_of(conn) != expected_schema:
+        failures.append("回滚: 出错的迁移留下了表结构变更")
+
+    # 数据库版本高于程序
+    conn.execute(f'PRAGMA user_version = {init_db.SCHEMA_VERSION + 1}')
+    try:
+        migrate(conn)
+        failures.append("版本过高: 没有拒绝")
+    except RuntimeError:
+        pass
+    conn.close()
+
+
+def main():
+    failures = []
+
+    fresh = connect('fresh')
+    migrate(fresh)
+    expected_schema = schema_of(fresh)
+    fresh.close()
+    print(f"最新版本: {init_db.SCHEMA_VERSION}")
+
+    conn = connect('legacy')
+    conn.executescript(LEGACY_SCHEMA)
+    check_upgrade('最早的无版本号数据库', conn, expected_schema, failures)
+
+    for version in range(init_db.SCHEMA_VERSION):
+        conn = connect(f'v{version}')
+        migrate(conn, version)
+        add_sample_data(conn)
+        check_upgrade(f'版本 {version}', conn, expected_schema, failures)
+
+        if version:
+            # 旧版 init_database 创建的相同结构，但没有版本号
+            conn = connect(f'v{version}_unversioned')
+            migrate(conn, version)
+            add_sample_data(conn)
+            conn.execute('PRAGMA user_version = 0')
+            check_upgrade(f'版本 {version} 结构（无版本号）', conn, expected_schema, failures)
+
+    check_rollback(expected_schema, failures)
+
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("✅ 所有历史版本均可升级到最新版本")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""逾期扫描检查：付款周期判断、一条 UPDATE 的耗时、重复执行、统计不变、每个归属一条汇总
+
+用法:
+    python scripts/check_overdue_sweep.py [--orders 50000]
+
+在临时数据库中生成 --orders 个订单（各种状态、星期分组、最近付款日），依次检查：
+  - 转为逾期的订单与按付款周期逐个计算的结果一致，其他状态的订单不变
+  - 有效/违约等统计表不变，每个归属写入一条汇总流水
+  - 再次扫描不再变更任何订单
+  - 利息、本金减少记为最近付款日，付款后的订单不会被扫描；非正数的利息被拒绝
+  - 历史订单以导入当天作为最近付款日，导入后的第一次扫描不会转为逾期
+  - 定时任务把每个归属的汇总发给每个管理员
+输出扫描耗时。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='check_overdue_sweep_')
+os.environ['OVERDUE_GRACE_DAYS'] = '0'
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_pool
+from constants import WEEKDAY_GROUP
+from utils import schedule_executor
+from utils.overdue_sweeper import compute_due_before, sweep_overdue, run_overdue_sweep
+
+PERIOD_DATE = '2025-12-11'   # 周四
+STATES = ['normal', 'normal', 'normal', 'overdue', 'breach', 'end', 'normal', 'breach_end']
+GROUP_IDS = ['S01', 'S02', 'S03', 'S04', 'S05']
+
+
+class RecordingBot:
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def seed_orders(count: int) -> set:
+    """生成订单，返回按付款周期逐个计算应转为逾期的订单号"""
+    period = datetime.strptime(PERIOD_DATE, '%Y-%m-%d')
+    groups = list(WEEKDAY_GROUP.items())
+    rows, expected = [], set()
+    for i in range(count):
+        weekday, weekday_group = groups[i % 7]
+        order_date = period - timedelta(days=7 + i % 60)
+        # 约一半订单有付款记录，付款日分布在最近 20 天内
+        last_payment = (period - timedelta(days=i % 20 + 1)).strftime('%Y-%m-%d') if i % 2 else None
+        state = STATES[i % len(STATES)]
+        order_id = f"SWP{i:07d}"
+        rows.append((order_id, GROUP_IDS[i % len(GROUP_IDS)], -1000000 - i,
+                     order_date.strftime('%Y-%m-%d 12:00:00'), weekday_group, 'AB'[i % 2],
+                     1000 + i % 50 * 100, state, last_payment))
+        # 上一个付款日（日结日期之前最近的该星期几）所在周期内没有付款
+        last_due = period - timedelta(days=(period.weekday() - weekday - 1) % 7 + 1)
+        paid = datetime.strptime(last_payment, '%Y-%m-%d') if last_payment else order_date
+        if state == 'normal' and paid.date() <= (last_due - timedelta(days=7)).date():
+            expected.add(order_id)
+
+    conn = db_operations.get_connection()
+    conn.executemany('''
+    INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group, customer, amount,
+                        state, last_payment_date)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+    return expected
+
+
+def snapshot():
+    conn = db_operations.get_connection()
+    states = dict(conn.execute('SELECT order_id, state FROM orders').fetchall())
+    stats = ([tuple(r) for r in conn.execute('SELECT * FROM financial_data')],
+             [tuple(r) for r in conn.execute('SELECT * FROM grouped_data ORDER BY group_id')])
+    events = conn.execute('SELECT COUNT(*) FROM order_events').fetchone()[0]
+    conn.close()
+    return states, stats, events
+
+
+async def run(args, failures: list) -> float:
+    expected = seed_orders(args.orders)
+    before, stats_before, events_before = snapshot()
+
+    # 付款周期：周四日结时，周三分组的上一个付款日是 12-10，截止日期 12-03
+    due_before = compute_due_before(PERIOD_DATE)
+    if due_before['三'] != '2025-12-03' or due_before['四'] != '2025-11-27':
+        failures.append(f"截止日期: {due_before}")
+
+    start = time.perf_counter()
+    summary = await sweep_overdue(PERIOD_DATE)
+    elapsed = time.perf_counter() - start
+
+    after, stats_after, events_after = snapshot()
+    changed = {order_id for order_id in before if before[order_id] != after[order_id]}
+    if changed != expected:
+        failures.append(f"转为逾期 {len(changed)} 个，应为 {len(expected)} 个")
+    if any(after[order_id] != 'overdue' for order_id in changed):
+        failures.append("有订单被改为逾期以外的状态")
+    if sum(group['count'] for group in summary.values()) != len(expected):
+        failures.append(f"汇总数量 {summary}")
+    if stats_after != stats_before:
+        failures.append("扫描改动了统计表")
+    if events_after - events_before != len(summary):
+        failures.append(f"写入 {events_after - events_before} 条流水，应为每个归属一条（{len(summary)}）")
+
+    # 重复执行
+    again = await sweep_overdue(PERIOD_DATE)
+    if again or snapshot()[0] != after:
+        failures.append(f"重复扫描: {again}")
+
+    # 付款后不再扫描：下一周期之前付了利息 / 本金
+    conn = db_operations.get_connection()
+    paid_chats = [row[0] for row in conn.execute(
+        "SELECT chat_id FROM orders WHERE state = 'normal' ORDER BY id LIMIT 2")]
+    conn.close()
+    next_period = (datetime.strptime(PERIOD_DATE, '%Y-%m-%d') + timedelta(days=14)).strftime('%Y-%m-%d')
+    await db_operations.record_interest(next_period, paid_chats[0], 50)
+    await db_operations.reduce_principal(next_period, paid_chats[1], 10)
+    for chat_id in paid_chats:
+        order = await db_operations._fetch_order_by_chat_id(chat_id)
+        if order['last_payment_date'] != next_period:
+            failures.append(f"付款后最近付款日为 {order['last_payment_date']}")
+    # 非正数的利息被拒绝，不记为付款
+    conn = db_operations.get_connection()
+    unpaid_chat = conn.execute(
+        "SELECT chat_id FROM orders WHERE state = 'normal' ORDER BY id LIMIT 1 OFFSET 2").fetchone()[0]
+    conn.close()
+    before_payment = (await db_operations._fetch_order_by_chat_id(unpaid_chat))['last_payment_date']
+    for amount in (0, -50):
+        result = await db_operations.record_interest(next_period, unpaid_chat, amount)
+        if result['status'] != 'invalid_amount':
+            failures.append(f"利息 {amount} 没有被拒绝: {result['status']}")
+    if (await db_operations._fetch_order_by_chat_id(unpaid_chat))['last_payment_date'] != before_payment:
+        failures.append("非正数的利息被记为付款")
+    # 历史订单（导入或按群名新建）与迁移的订单一样，以导入当天作为最近付款日，
+    # 订单日期再早，导入后的第一次扫描也不会转为逾期
+    historical = {'group_id': GROUP_IDS[0], 'date': '2025-11-03 12:00:00', 'group': '一',
+                  'customer': 'B', 'amount': 5000, 'state': 'normal'}
+    await db_operations.import_historical_orders(
+        PERIOD_DATE, [dict(historical, order_id='SWPHIST1', chat_id=-2000001)])
+    await db_operations.open_order(
+        PERIOD_DATE, dict(historical, order_id='SWPHIST2', chat_id=-2000002), historical=True)
+    await sweep_overdue(PERIOD_DATE)
+    for chat_id in (-2000001, -2000002):
+        order = await db_operations._fetch_order_by_chat_id(chat_id)
+        if order['last_payment_date'] != PERIOD_DATE or order['state'] != 'normal':
+            failures.append(f"历史订单 {order['order_id']} 导入后: {order['state']}, "
+                            f"最近付款日 {order['last_payment_date']}")
+    summary = await sweep_overdue(next_period)
+    for chat_id in paid_chats:
+        order = await db_operations._fetch_order_by_chat_id(chat_id)
+        if order['state'] != 'normal':
+            failures.append(f"付款后的订单 {order['order_id']} 被转为逾期")
+    if not summary:
+        failures.append("下一周期没有扫描到未付款的订单")
+
+    # 定时任务（按当前日期扫描）：每个归属一条汇总，发给每个管理员
+    bot = RecordingBot()
+    schedule_executor._bot = bot
+    summary = await run_overdue_sweep([1, 2])
+    if not summary or len(bot.sent) != 2 * len(summary):
+        failures.append(f"发送了 {len(bot.sent)} 条汇总，应为每个归属每个管理员一条")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--orders', type=int, default=50000, help='订单数量')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    init_db.init_database()
+    failures = []
+    try:
+        elapsed = asyncio.run(run(args, failures))
+    finally:
+        db_pool.close_pool()
+
+    print(f"\n{args.orders} 个订单")
+    print(f"  逾期扫描（一条 UPDATE + 汇总流水 + 提交）: {elapsed * 1000:.0f} ms")
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("✅ 逾期扫描检查通过")
+
+
+if __name__ == "__main__":
+    main()
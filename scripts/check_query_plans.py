@@ -0,0 +1,310 @@
+"""查询计划检查：对 db_operations 中每个数据库函数的每条 SQL 执行 EXPLAIN QUERY PLAN，
+发现未经允许的全表扫描（SCAN）时返回非零退出码。
+
+用法:
+    python scripts/check_query_plans.py [-v]
+
+在临时目录中创建数据库，不会影响正式数据。
+新增 @db_query / @db_transaction 函数时，需要在 CASES 中添加对应调用，否则检查失败。
+"""
+import os
+import sys
+import argparse
+import inspect
+import tempfile
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置数据目录
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='check_query_plans_')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import sqlite3
+import init_db
+import db_operations
+from db_operations import StatsDelta
+
+EXPORT_PATH = os.path.join(os.environ['DATA_DIR'], 'export.csv')
+
+# 检查用例: (名称, 函数名, 参数, 允许全表扫描的表)
+# 只有本来就要读取整张表（或表很小）的查询才允许 SCAN
+CASES = [
+    ('create_order', 'create_order', ({
+        'order_id': 'PLAN0001', 'group_id': 'S01', 'chat_id': -1001,
+        'date': '2025-12-01 12:00:00', 'group': '一', 'customer': 'A',
+        'amount': 1000, 'state': 'normal'},), ()),
+    ('_fetch_order_by_chat_id', '_fetch_order_by_chat_id', (-1001,), ()),
+    ('get_order_by_order_id', 'get_order_by_order_id', ('PLAN0001',), ()),
+    ('search_orders_by_group_id', 'search_orders_by_group_id', ('S01',), ()),
+    ('search_orders_by_group_id(state)', 'search_orders_by_group_id', ('S01', 'normal'), ()),
+    ('search_orders_by_date_range', 'search_orders_by_date_range',
+     ('2025-12-01', '2025-12-31'), ()),
+    ('search_orders_by_customer', 'search_orders_by_customer', ('A',), ()),
+    ('search_orders_by_state', 'search_orders_by_state', ('normal',), ()),
+    ('search_orders_all', 'search_orders_all', (), ('orders',)),
+    # 只有默认状态条件（排除完成订单）时需要遍历订单
+    ('search_orders_advanced({})', 'search_orders_advanced', ({},), ('orders',)),
+    ('search_orders_advanced(group_id)', 'search_orders_advanced', ({'group_id': 'S01'},), ()),
+    ('search_orders_advanced(state)', 'search_orders_advanced', ({'state': 'normal'},), ()),
+    ('search_orders_advanced(customer)', 'search_orders_advanced', ({'customer': 'A'},), ()),
+    ('search_orders_advanced(order_id)', 'search_orders_advanced', ({'order_id': 'PLAN0001'},), ()),
+    ('search_orders_advanced(date_range)', 'search_orders_advanced',
+     ({'date_range': ('2025-12-01', '2025-12-31')},), ()),
+    ('search_orders_advanced(weekday_group)', 'search_orders_advanced',
+     ({'weekday_group': '一'},), ()),
+    ('search_orders_advanced(group_id+weekday_group)', 'search_orders_advanced',
+     ({'group_id': 'S01', 'weekday_group': '一'},), ()),
+    ('search_orders_advanced_all_states({})', 'search_orders_advanced_all_states',
+     ({},), ('orders',)),
+    ('search_orders_advanced_all_states(group_id)', 'search_orders_advanced_all_states',
+     ({'group_id': 'S01'},), ()),
+    ('search_orders_advanced_all_states(date_range)', 'search_orders_advanced_all_states',
+     ({'date_range': ('2025-12-01', '2025-12-31')},), ()),
+    ('search_orders_advanced_all_states(weekday_group+state)',
+     'search_orders_advanced_all_states', ({'weekday_group': '一', 'state': 'end'},), ()),
+    ('get_reminder_orders', 'get_reminder_orders', (), ()),
+    ('get_reminder_orders(weekday_group)', 'get_reminder_orders', ('一',), ()),
+    ('get_reminder_orders(group_id)', 'get_reminder_orders', (None, 'S01', ('overdue',)), ()),
+    ('get_reminder_orders(all)', 'get_reminder_orders', ('一', 'S01', ('normal', 'breach')), ()),
+    # financial_data 只有一行
+    ('get_financial_data', 'get_financial_data', (), ('financial_data',)),
+    ('update_financial_data', 'update_financial_data', ('interest', 1), ()),
+    ('get_grouped_data', 'get_grouped_data', ('S01',), ()),
+    ('get_grouped_data(all)', 'get_grouped_data', (), ('grouped_data',)),
+    ('update_grouped_data', 'update_grouped_data', ('S01', 'interest', 1), ()),
+    # 存量变动同步写入当天的 daily_stock
+    ('update_grouped_data(stock)', 'update_grouped_data', ('S01', 'valid_amount', 1), ()),
+    ('update_financial_data(stock)', 'update_financial_data', ('liquid_funds', 1), ()),
+    ('get_all_group_ids', 'get_all_group_ids', (), ('grouped_data',)),
+    # 日终存量：全局 + 全部归属（targets 为全局 + 归属ID列表）
+    ('close_day', 'close_day', ('2025-11-30',), ('grouped_data', 'targets')),
+    ('get_daily_stock', 'get_daily_stock', ('2025-11-30',), ()),
+    ('get_last_closed_date', 'get_last_closed_date', (), ()),
+    # 按日终存量查询某天 / 区间期初期末：每次一个索引查找
+    ('get_stock_as_of', 'get_stock_as_of', ('2025-12-05',), ()),
+    ('get_stock_as_of(group)', 'get_stock_as_of', ('2025-12-05', 'S01'), ()),
+    ('get_stock_change', 'get_stock_change', ('2025-12-01', '2025-12-31'), ()),
+    ('get_stock_change(group)', 'get_stock_change', ('2025-12-01', '2025-12-31', 'S01'), ()),
+    ('get_daily_data', 'get_daily_data', ('2025-12-01',), ()),
+    ('get_daily_data(group)', 'get_daily_data', ('2025-12-01', 'S01'), ()),
+    ('update_daily_data', 'update_daily_data', ('2025-12-01', 'interest', 1), ()),
+    ('_fetch_stats_by_date_range(today)', '_fetch_stats_by_date_range',
+     ('2025-12-10', '2025-12-10'), ()),
+    ('_fetch_stats_by_date_range(month)', '_fetch_stats_by_date_range',
+     ('2025-12-01', '2025-12-31'), ()),
+    ('_fetch_stats_by_date_range(range)', '_fetch_stats_by_date_range',
+     ('2025-10-15', '2025-12-20', 'S01'), ()),
+    # 所有归属ID的报表需要遍历 grouped_data
+    ('get_attribution_report(month)', 'get_attribution_report',
+     ('2025-12-01', '2025-12-31'), ('grouped_data',)),
+    ('get_attribution_report(range)', 'get_attribution_report',
+     ('2025-10-15', '2025-12-20'), ('grouped_data',)),
+    ('apply_stats_delta', 'apply_stats_delta',
+     (StatsDelta('2025-12-01').for_event('interest', amount=5)
+      .add('interest', 5, 0, 'S01').add_liquid(5),), ()),
+    # 订单命令（种子订单按 i % 5 依次为 normal/overdue/breach/end/breach_end，chat_id = -100000 - i）
+    ('open_order', 'open_order', ('2025-12-01', {
+        'order_id': 'PLAN0002', 'group_id': 'S01', 'chat_id': -1002,
+        'date': '2025-12-01 12:00:00', 'group': '一', 'customer': 'B',
+        'amount': 2000, 'state': 'normal'}), ()),
+    ('open_order(historical)', 'open_order', ('2025-12-01', {
+        'order_id': 'PLAN0003', 'group_id': 'S01', 'chat_id': -1003,
+        'date': '2025-10-01 12:00:00', 'group': '一', 'customer': 'A',
+        'amount': 2000, 'state': 'breach'}, True), ()),
+    ('set_order_state', 'set_order_state', ('2025-12-01', -100000, 'overdue'), ()),
+    ('end_order', 'end_order', ('2025-12-01', -100005), ()),
+    ('breach_order', 'breach_order', ('2025-12-01', -100001), ()),
+    ('end_breach_order', 'end_breach_order', ('2025-12-01', -100002, 500), ()),
+    ('sweep_overdue_orders', 'sweep_overdue_orders',
+     ('2025-12-01', {'一': '2025-11-17', '二': '2025-11-18', '三': '2025-11-19'}), ()),
+    ('reduce_principal', 'reduce_principal', ('2025-12-01', -100010, 100), ()),
+    ('record_interest', 'record_interest', ('2025-12-01', -100015, 10), ()),
+    ('reassign_order', 'reassign_order', ('2025-12-01', 'SEED0020', 'S02'), ()),
+    ('reassign_orders(dry_run)', 'reassign_orders',
+     ('2025-12-01', ['SEED0030', 'SEED0031', 'SEED0032', 'NOPE'], 'S03', True), ()),
+    ('reassign_orders', 'reassign_orders',
+     ('2025-12-01', [f'SEED{i:04d}' for i in range(40, 60)], 'S03'), ()),
+    # 导入的订单号/群ID临时表本身就要整表读取
+    ('import_historical_orders', 'import_historical_orders', ('2025-12-01', [
+        {'order_id': f'IMP{i:04d}', 'group_id': 'S04', 'chat_id': -200000 - i,
+         'date': '2025-01-01 12:00:00', 'group': '一', 'customer': 'B',
+         'amount': 1000, 'state': 'normal'} for i in range(20)] + [
+        {'order_id': 'SEED0000', 'group_id': 'S04', 'chat_id': -300000,
+         'date': '2025-01-01 12:00:00', 'group': '一', 'customer': 'B',
+         'amount': 1000, 'state': 'breach'}]), ('import_order_keys',)),
+    # 重放流水需要读取全部流水和统计表
+    ('rebuild_stats_from_ledger', 'rebuild_stats_from_ledger', (),
+     ('order_events', 'financial_data', 'grouped_data', 'daily_data')),
+    ('add_authorized_user', 'add_authorized_user', (10001,), ()),
+    ('get_authorized_users', 'get_authorized_users', (), ('authorized_users',)),
+    ('remove_authorized_user', 'remove_authorized_user', (10001,), ()),
+    ('get_payment_account', 'get_payment_account', ('gcash',), ()),
+    ('get_all_payment_accounts', 'get_all_payment_accounts', (), ('payment_accounts',)),
+    ('get_payment_accounts_by_type', 'get_payment_accounts_by_type', ('gcash',), ()),
+    ('create_payment_account', 'create_payment_account', ('gcash', '0917', 'Plan'), ()),
+    ('get_payment_account_by_id', 'get_payment_account_by_id', (1,), ()),
+    ('update_payment_account_by_id', 'update_payment_account_by_id', (1, '0918'), ()),
+    ('update_payment_account', 'update_payment_account', ('paymaya', '0919'), ()),
+    ('delete_payment_account', 'delete_payment_account', (1,), ()),
+    ('record_expense', 'record_expense', ('2025-12-01', 'company', 10, 'plan'), ()),
+    ('get_expense_records', 'get_expense_records', ('2025-12-01', '2025-12-31', 'company'), ()),
+    ('create_schedule', 'create_schedule',
+     ('0 9 * * *', 'Asia/Shanghai', 'hello', [(-1001, 'Plan'), (-1002, None)], 1), ()),
+    ('get_schedule', 'get_schedule', (1,), ()),
+    # 列出全部播报（启动同步、菜单）需要读取整张表
+    ('get_all_schedules', 'get_all_schedules', (), ('schedules', 'schedule_targets')),
+    ('update_schedule', 'update_schedule', (1, '30 22 * * *', None, None, 0), ()),
+    ('set_schedule_targets', 'set_schedule_targets', (1, [(-1003, None)]), ()),
+    ('delete_schedule', 'delete_schedule', (1,), ()),
+    ('create_broadcast_job', 'create_broadcast_job',
+     ('hello', [(-1001, None), (-1002, 'hi'), (-1001, None)], 1, 1), ()),
+    ('get_broadcast_job', 'get_broadcast_job', (1,), ()),
+    ('get_unfinished_broadcast_jobs', 'get_unfinished_broadcast_jobs', (), ()),
+    ('get_pending_broadcast_targets', 'get_pending_broadcast_targets', (1,), ()),
+    ('set_broadcast_status_message', 'set_broadcast_status_message', (1, 10), ()),
+    ('mark_broadcast_target', 'mark_broadcast_target', (1, -1001, True), ()),
+    ('finish_broadcast_job', 'finish_broadcast_job', (1,), ()),
+    # 全量导出需要读取整张表
+    ('export_csv(orders)', 'export_csv', ('orders', EXPORT_PATH), ('orders',)),
+    ('export_csv(orders, range)', 'export_csv',
+     ('orders', EXPORT_PATH, '2025-03-01', '2025-03-31'), ()),
+    ('export_csv(orders, group)', 'export_csv', ('orders', EXPORT_PATH, None, None, 'S01'), ()),
+    ('export_csv(daily, range)', 'export_csv',
+     ('daily', EXPORT_PATH, '2025-12-01', '2025-12-31', None, True), ()),
+    ('export_csv(daily, group)', 'export_csv',
+     ('daily', EXPORT_PATH, '2025-12-01', '2025-12-31', 'S01'), ()),
+    ('export_csv(expenses)', 'export_csv',
+     ('expenses', EXPORT_PATH, '2025-12-01', '2025-12-31'), ()),
+]
+
+
+class PlanRecorder:
+    """包装连接/游标：执行每条 SQL 前先记录其 EXPLAIN QUERY PLAN"""
+
+    def __init__(self, target, conn: sqlite3.Connection, plans: list):
+        self._target = target
+        self._conn = conn
+        self._plans = plans
+
+    def _explain(self, sql: str, params=()):
+        head = sql.lstrip().split(None, 1)[0].upper()
+        if head not in ('SELECT', 'UPDATE', 'DELETE', 'INSERT', 'WITH'):
+            return
+        rows = self._conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+        self._plans.append((' '.join(sql.split()), [row[3] for row in rows]))
+
+    def execute(self, sql, params=()):
+        self._explain(sql, params)
+        result = self._target.execute(sql, params)
+        # cursor.execute 返回游标本身，继续返回包装对象
+        return self if result is self._target else result
+
+    def executemany(self, sql, seq):
+        seq = list(seq)
+        if seq:
+            self._explain(sql, seq[0])
+        self._target.executemany(sql, seq)
+        return self
+
+    def __getattr__(self, name):
+        return getattr(self._target, name)
+
+    def __setattr__(self, name, value):
+        if name.startswith('_'):
+            object.__setattr__(self, name, value)
+        else:
+            setattr(self._target, name, value)
+
+
+def seed(conn: sqlite3.Connection):
+    """写入少量数据，让查询计划接近真实情况"""
+    rows = []
+    for i in range(200):
+        rows.append((
+            f"SEED{i:04d}", f"S{(i % 5) + 1:02d}", -100000 - i,
+            f"2025-{(i % 12) + 1:02d}-{(i % 28) + 1:02d} 12:00:00",
+            '一二三四五六日'[i % 7], 'AB'[i % 2], 1000 + i,
+            ['normal', 'overdue', 'breach', 'end', 'breach_end'][i % 5]
+        ))
+    conn.executemany('''
+    INSERT INTO orders (order_id, group_id, chat_id, date, weekday_group,
+                        customer, amount, state)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+
+
+def find_scans(details, allowed) -> list:
+    """返回未被允许的全表扫描"""
+    bad = []
+    for detail in details:
+        if not detail.startswith('SCAN '):
+            continue
+        table = detail.split()[1]
+        # SCAN CONSTANT ROW / SCAN (subquery-N) 不是表扫描
+        if table == 'CONSTANT' or table.startswith('(') or table in allowed:
+            continue
+        bad.append(detail)
+    return bad
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('-v', '--verbose', action='store_true', help='输出每条 SQL 的查询计划')
+    args = parser.parse_args()
+
+    init_db.init_database()
+    conn = db_operations.get_connection()
+    seed(conn)
+
+    failures = []
+    covered = set()
+    for label, name, call_args, allowed in CASES:
+        func = getattr(db_operations, name)
+        covered.add(name)
+        plans = []
+        cursor = conn.cursor()
+        try:
+            func.__wrapped__(PlanRecorder(conn, conn, plans),
+                             PlanRecorder(cursor, conn, plans), *call_args)
+        except sqlite3.OperationalError as e:
+            # 数据库结构缺失（表/列未由 init_db 创建）时跳过，单独提示
+            if 'no such table' in str(e) or 'no such column' in str(e):
+                print(f"⚠️  {label}: 跳过（{e}）")
+                conn.rollback()
+                continue
+            raise
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            cursor.close()
+
+        if not plans:
+            failures.append(f"{label}: 没有执行任何 SQL")
+        for sql, details in plans:
+            bad = find_scans(details, allowed)
+            if bad:
+                failures.append(f"{label}: {'; '.join(bad)}\n    {sql}")
+            if args.verbose:
+                print(f"{label}: {sql}")
+                for detail in details:
+                    print(f"    {detail}")
+
+    # 所有数据库函数都必须有检查用例
+    for name, func in inspect.getmembers(db_operations, inspect.iscoroutinefunction):
+        if hasattr(func, '__wrapped__') and func.__module__ == 'db_operations' and name not in covered:
+            failures.append(f"{name}: 缺少查询计划检查用例")
+
+    conn.close()
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print(f"✅ {len(CASES)} 个用例的查询计划均已使用索引")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,203 @@
+"""定时播报调度检查：任务持久化、增量同步、触发时读取内容、重启后的错过处理
+
+用法:
+    python scripts/check_schedules.py [--schedules 1000]
+
+在临时数据库中创建 --schedules 条定时播报（多个目标群），依次检查：
+  - 首次启动为每条激活的播报添加任务，任务写入 scheduler_jobs
+  - 修改一条播报的时间只改动这一个任务，修改内容/群组不改动任务
+  - 数据库被其他连接锁住时，更新任务不等待（经写队列异步保存）
+  - 任务触发时发送的是最新内容，发送到所有目标群
+  - 重启后任务从数据库恢复（不重建），错过多次只补发一次，超过宽限时间的不补发
+输出首次同步、重启同步和单条修改的耗时。
+"""
+import os
+import sys
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='check_schedules_')
+os.environ['SCHEDULE_MISFIRE_GRACE_TIME'] = '300'
+os.environ['SCHEDULE_COALESCE'] = '1'
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_pool
+from utils import schedule_executor
+from utils.schedule_executor import (
+    setup_scheduled_broadcasts, reconcile_schedule, shutdown_scheduler, normalize_cron
+)
+
+
+class RecordingBot:
+    """记录发送的消息"""
+
+    def __init__(self):
+        self.sent = []
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        self.sent.append((chat_id, text))
+
+
+def job_rows() -> dict:
+    # 任务经写队列异步保存，读取前等待写入完成
+    if schedule_executor.scheduler is not None:
+        schedule_executor.scheduler._jobstores['default'].flush()
+    conn = db_operations.get_connection()
+    rows = {row['id']: (row['next_run_time'], row['job_state'])
+            for row in conn.execute('SELECT * FROM scheduler_jobs')}
+    conn.close()
+    return rows
+
+
+def set_next_run_time(job_id: str, when: datetime):
+    """模拟停机期间错过的执行：把任务的下一次执行时间改到过去"""
+    job = schedule_executor.scheduler.get_job(job_id)
+    job.next_run_time = when
+    schedule_executor.scheduler._jobstores['default'].update_job(job)
+
+
+async def wait_for(condition, timeout: float = 5.0) -> bool:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if condition():
+            return True
+        await asyncio.sleep(0.05)
+    return condition()
+
+
+async def run(args, failures: list):
+    bot = RecordingBot()
+    for i in range(args.schedules):
+        await db_operations.create_schedule(
+            normalize_cron(f"{i % 24}:{i % 60}"), 'Asia/Shanghai', f"message {i}",
+            [(-1000000 - i, None), (-2000000 - i, None)])
+    # 每分钟执行的播报（检查错过多次只补发一次）和没有目标群的播报（不应有任务）
+    minutely = await db_operations.create_schedule(
+        '* * * * *', 'UTC', 'minutely', [(-3000001, None), (-3000002, None), (-3000003, None)])
+    no_targets = await db_operations.create_schedule('0 9 * * *', 'UTC', 'nobody', [])
+
+    # 首次启动
+    start = time.perf_counter()
+    summary = await setup_scheduled_broadcasts(bot)
+    first_sync = time.perf_counter() - start
+    if summary.get('added') != args.schedules + 1:
+        failures.append(f"首次同步: {summary}")
+    rows = job_rows()
+    if len(rows) != args.schedules + 1 or f"schedule_{no_targets}" in rows:
+        failures.append(f"首次同步: scheduler_jobs 有 {len(rows)} 行")
+
+    # 修改时间：只改动一个任务
+    await db_operations.update_schedule(1, cron='15 7 * * 1-5')
+    start = time.perf_counter()
+    action = await reconcile_schedule(1)
+    single = time.perf_counter() - start
+    after = job_rows()
+    changed = [job_id for job_id in rows if rows[job_id] != after.get(job_id)]
+    if action != 'rescheduled' or changed != ['schedule_1']:
+        failures.append(f"修改时间: {action}, 改动的任务 {changed}")
+    next_run = schedule_executor.get_next_run_time(1)
+    if not next_run or next_run.weekday() > 4 or (next_run.hour, next_run.minute) != (7, 15):
+        failures.append(f"修改时间: 下次执行 {next_run}（应为工作日 07:15）")
+
+    # 修改内容和群组：任务不变，触发时读取
+    rows = after
+    await db_operations.update_schedule(2, message='updated message')
+    await db_operations.set_schedule_targets(2, [(-4000001, None), (-4000002, None)])
+    action = await reconcile_schedule(2)
+    if action != 'unchanged' or job_rows() != rows:
+        failures.append(f"修改内容: {action}")
+
+    # 数据库被其他连接锁住时，任务存储的写入不阻塞事件循环
+    store = schedule_executor.scheduler._jobstores['default']
+    locker = db_operations.get_connection()
+    locker.execute('BEGIN IMMEDIATE')
+    start = time.perf_counter()
+    store.update_job(schedule_executor.scheduler.get_job('schedule_6'))
+    blocked = time.perf_counter() - start
+    locker.rollback()
+    locker.close()
+    if blocked > 0.05 or not store.flush(timeout=5):
+        failures.append(f"数据库被锁住时更新任务等待了 {blocked * 1000:.0f} ms")
+
+    # 立即触发播报 2：应发送最新内容到新的目标群
+    schedule_executor.scheduler.get_job('schedule_2').modify(
+        next_run_time=datetime.now(timezone.utc))
+    await wait_for(lambda: len(bot.sent) >= 2)
+    if sorted(bot.sent) != [(-4000002, 'updated message'), (-4000001, 'updated message')]:
+        failures.append(f"触发: 发送了 {bot.sent}")
+    bot.sent.clear()
+
+    # 停用 / 删除：移除任务
+    await db_operations.update_schedule(3, is_active=0)
+    await db_operations.delete_schedule(4)
+    actions = [await reconcile_schedule(3), await reconcile_schedule(4)]
+    if actions != ['removed', 'removed']:
+        failures.append(f"停用/删除: {actions}")
+
+    # 模拟停机：每分钟的播报错过 10 次，每天的播报错过 2 小时（超过宽限时间）
+    now = datetime.now(timezone.utc)
+    schedule_executor.scheduler.pause()
+    set_next_run_time(f"schedule_{minutely}", now - timedelta(minutes=10))
+    set_next_run_time('schedule_5', now - timedelta(hours=2))
+    shutdown_scheduler()
+    rows = job_rows()
+
+    start = time.perf_counter()
+    summary = await setup_scheduled_broadcasts(bot)
+    restart_sync = time.perf_counter() - start
+    # 全部播报（含停用、没有目标群的）都不需要改动任务
+    if summary != {'unchanged': args.schedules + 1}:
+        failures.append(f"重启同步: {summary}")
+    await wait_for(lambda: len(bot.sent) >= 3)
+    await asyncio.sleep(0.3)
+    minutely_sent = [s for s in bot.sent if s[1] == 'minutely']
+    if len(minutely_sent) != 3 or len(bot.sent) != 3:
+        failures.append(f"重启补发: 发送了 {len(bot.sent)} 条（应只补发每分钟播报一次，3 个群）")
+    next_run = schedule_executor.get_next_run_time(5)
+    if not next_run or next_run <= now:
+        failures.append(f"重启补发: 超过宽限时间的播报下次执行 {next_run}")
+    shutdown_scheduler()
+    await asyncio.sleep(0.1)
+    return first_sync, restart_sync, single
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--schedules', type=int, default=1000, help='定时播报数量')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    # 错过执行的日志是预期的
+    logging.getLogger('apscheduler').setLevel(logging.ERROR)
+    init_db.init_database()
+    failures = []
+    try:
+        first_sync, restart_sync, single = asyncio.run(run(args, failures))
+    finally:
+        db_pool.close_pool()
+
+    print(f"\n{args.schedules} 条定时播报")
+    print(f"  首次同步（添加全部任务）: {first_sync * 1000:.0f} ms")
+    print(f"  重启同步（任务已持久化，无改动）: {restart_sync * 1000:.0f} ms")
+    print(f"  修改一条播报的时间: {single * 1000:.1f} ms")
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("✅ 定时播报调度检查通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+"""每日存量检查：任意一天日终的存量、区间期初/期末，与每天实际的存量一致
+
+用法:
+    python scripts/check_stock_history.py [--days 10] [--orders 300] [--groups 5]
+
+在临时数据库中连续 --days 天，每天按 --groups 个归属新建 --orders 个订单，并记利息、完成、违约、
+减少本金、修改归属、开销；前一半日期逐天日结。每天结束时记下全局和各归属的实际存量，然后检查：
+  - get_stock_as_of 每天、每个归属的结果与当天记下的存量一致
+  - get_stock_change 的期初 / 期末 / 变化与对应两天的存量一致
+  - 补记到之前未日结日期的变动同时计入之后每天的存量
+  - 根据流水重建统计（rebuild_stats_from_ledger）后结果不变
+  - 区间报表显示期初 → 期末
+输出按日终存量查询的耗时，以及重放流水得到同一结果的耗时。
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+from pathlib import Path
+
+# 必须在导入 db_operations 之前设置
+os.environ['DATA_DIR'] = tempfile.mkdtemp(prefix='check_stock_history_')
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_operations
+import db_pool
+from db_operations import STOCK_FIELDS
+from handlers.report_handlers import generate_report_text
+
+FIRST_DATE = '2025-11-01'
+
+
+def day(index: int) -> str:
+    return (datetime.strptime(FIRST_DATE, '%Y-%m-%d') + timedelta(days=index)).strftime('%Y-%m-%d')
+
+
+async def current_stock() -> dict:
+    """全局和各归属的实际存量 {group_id(None为全局): (字段...)}"""
+    financial = await db_operations.get_financial_data()
+    stock = {None: tuple(financial[f] for f in STOCK_FIELDS)}
+    for group_id, row in (await db_operations.get_grouped_data()).items():
+        stock[group_id] = tuple(row[f] for f in STOCK_FIELDS)
+    return stock
+
+
+async def run_day(index: int, args) -> None:
+    date = day(index)
+    groups = [f"H{g + 1:02d}" for g in range(args.groups)]
+    base = index * args.orders
+    for start in range(0, args.orders, 200):
+        await asyncio.gather(*(db_operations.open_order(date, {
+            'order_id': f"SH{base + i:07d}", 'group_id': groups[(base + i) % args.groups],
+            'chat_id': -700000 - base - i, 'date': f"{date} 12:00:00", 'group': '一',
+            'customer': 'AB'[i % 2], 'amount': 1000 + i % 7 * 500, 'state': 'normal'})
+            for i in range(start, min(start + 200, args.orders))))
+    chats = [-700000 - base - i for i in range(args.orders)]
+    await asyncio.gather(*(db_operations.record_interest(date, chat_id, 30) for chat_id in chats[::3]))
+    await asyncio.gather(*(db_operations.end_order(date, chat_id) for chat_id in chats[1::7]))
+    await asyncio.gather(*(db_operations.breach_order(date, chat_id) for chat_id in chats[2::11]))
+    await asyncio.gather(*(db_operations.reduce_principal(date, chat_id, 200)
+                           for chat_id in chats[3::13]))
+    await db_operations.reassign_order(date, f"SH{base:07d}", groups[(index + 1) % args.groups])
+    await db_operations.record_expense(date, 'company', 150 + index, f"day {index}")
+
+
+def replay_as_of(date: str, group_id) -> tuple:
+    """对比：不用每日存量，从流水重放到该日期（只统计有日期的变动）"""
+    conn = db_operations.get_connection()
+    totals = dict.fromkeys(STOCK_FIELDS, 0)
+    for (deltas,) in conn.execute(
+            'SELECT deltas FROM order_events WHERE date <= ? ORDER BY id', (date,)):
+        data = json.loads(deltas)
+        fields = data.get('financial', {}) if group_id is None else data.get('grouped', {}).get(group_id, {})
+        for field in STOCK_FIELDS:
+            totals[field] += fields.get(field, 0)
+    conn.close()
+    return tuple(totals[f] for f in STOCK_FIELDS)
+
+
+def same(actual: dict, expected: tuple) -> bool:
+    return all(abs(actual[f] - value) < 0.005 for f, value in zip(STOCK_FIELDS, expected))
+
+
+async def check_history(expected: dict, label: str, failures: list) -> float:
+    """检查每天、每个归属的日终存量和区间期初/期末，返回每次查询的平均耗时"""
+    queries, start = 0, time.perf_counter()
+    group_ids = set().union(*(stock.keys() for stock in expected.values()))
+    for index, stock in expected.items():
+        for group_id in group_ids:
+            actual = await db_operations.get_stock_as_of(day(index), group_id)
+            queries += 1
+            want = stock.get(group_id, (0,) * len(STOCK_FIELDS))
+            if not same(actual, want):
+                failures.append(f"{label} {day(index)} {group_id or '全局'}: {actual} != {want}")
+    for first, last in [(1, 3), (0, len(expected) - 1), (len(expected) // 2, len(expected) - 2)]:
+        for group_id in group_ids:
+            change = await db_operations.get_stock_change(day(first), day(last), group_id)
+            queries += 1
+            # 第一天之前没有存量记录，期初按 0 计
+            opening = expected[first - 1].get(group_id) if first else None
+            opening = opening or (0,) * len(STOCK_FIELDS)
+            closing = expected[last].get(group_id, (0,) * len(STOCK_FIELDS))
+            if not same(change['opening'], opening) or not same(change['closing'], closing) or \
+                    not same(change['change'], tuple(c - o for o, c in zip(opening, closing))):
+                failures.append(f"{label} {day(first)}~{day(last)} {group_id or '全局'}: {change}")
+    return (time.perf_counter() - start) / queries
+
+
+async def run(args, failures: list) -> dict:
+    await db_operations.apply_stats_delta(
+        db_operations.StatsDelta(day(0)).for_event('adjust').add_liquid(args.days * args.orders * 5000))
+    expected = {}
+    closed_days = args.days // 2
+    for index in range(args.days):
+        await run_day(index, args)
+        expected[index] = await current_stock()
+        if index < closed_days:
+            await db_operations.close_day(day(index))
+
+    # 补记到之前未日结的日期：之后每天的存量同时增加
+    backdated = closed_days + 1
+    order = await db_operations.get_order_by_order_id(f"SH{backdated * args.orders + 5:07d}")
+    await db_operations.record_interest(day(backdated), order['chat_id'], 999)
+    for index in range(backdated, args.days):
+        for group_id in (None, order['group_id']):
+            fields = list(expected[index][group_id])
+            fields[STOCK_FIELDS.index('liquid_funds')] += 999 if group_id is None else 0
+            expected[index][group_id] = tuple(fields)
+    if await current_stock() != expected[args.days - 1]:
+        failures.append("补记后的实际存量与预期不一致")
+
+    timings = {'lookup': await check_history(expected, '增量', failures)}
+
+    # 与重放流水对比耗时（同一个归属、最后一天）
+    group_id = order['group_id']
+    start = time.perf_counter()
+    replayed = replay_as_of(day(args.days - 1), group_id)
+    timings['replay'] = time.perf_counter() - start
+    if not same(await db_operations.get_stock_as_of(day(args.days - 1), group_id), replayed):
+        failures.append(f"重放流水得到 {replayed}")
+
+    # 根据流水重建统计后，每日存量不变
+    result = await db_operations.rebuild_stats_from_ledger(apply=True)
+    if result['drift']:
+        failures.append(f"统计与流水不一致: {result['drift'][:3]}")
+    await check_history(expected, '重建后', failures)
+    if len(await db_operations.get_daily_stock(day(0))) != args.groups + 1:
+        failures.append("重建后已日结日期的日终存量不完整")
+
+    # 区间报表：期初 → 期末
+    report = await generate_report_text("query", day(1), day(3), group_id)
+    opening, closing = expected[0][group_id], expected[3][group_id]
+    line = f"有效订单金额: {opening[1]:.2f} → {closing[1]:.2f}"
+    if line not in report:
+        failures.append(f"区间报表缺少 {line}")
+
+    timings['groups'] = args.groups
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--days', type=int, default=10, help='天数')
+    parser.add_argument('--orders', type=int, default=300, help='每天新建的订单数量')
+    parser.add_argument('--groups', type=int, default=5, help='归属数量')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    init_db.init_database()
+    failures = []
+    try:
+        timings = asyncio.run(run(args, failures))
+    finally:
+        db_pool.close_pool()
+
+    print(f"\n{args.days} 天，{args.days * args.orders} 个订单，{timings['groups']} 个归属")
+    print(f"  按日终存量查询某天 / 区间: {timings['lookup'] * 1000:.3f} ms/次")
+    print(f"  重放流水得到同一天的存量: {timings['replay'] * 1000:.1f} ms")
+    if failures:
+        print(f"❌ 发现 {len(failures)} 个问题:")
+        for failure in failures[:20]:
+            print(f"  - {failure}")
+        sys.exit(1)
+    print("✅ 每日存量检查通过")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+"""历史订单批量导入（命令行）
+
+用法:
+    python scripts/import_orders.py orders.csv [--format csv|jsonl] [--rejected rejected.csv] [--chunk 2000]
+
+写入 DATA_DIR 下的正式数据库（与机器人相同）；被拒绝的行写入 --rejected 文件
+（默认与输入文件同目录的 <文件名>.rejected.csv）。文件格式见 utils/order_import.py。
+"""
+import os
+import sys
+import asyncio
+import argparse
+from pathlib import Path
+
+project_root = Path(__file__).parent.parent.absolute()
+if str(project_root) not in sys.path:
+    sys.path.insert(0, str(project_root))
+
+import init_db
+import db_pool
+from utils.order_import import (
+    IMPORT_CHUNK_SIZE, detect_import_format, read_import_rows, import_orders)
+
+
+async def progress(stats):
+    print(f"  {stats['total']} 行, 已导入 {stats['inserted']}, 拒绝 {stats['rejected']} "
+          f"({stats['rows_per_sec']:.0f} 行/秒)", flush=True)
+
+
+async def run(args) -> dict:
+    with open(args.path, encoding='utf-8-sig', newline='') as source, \
+            open(args.rejected, 'w', encoding='utf-8-sig', newline='') as rejected:
+        return await import_orders(
+            read_import_rows(source, args.format), rejected,
+            chunk_size=args.chunk, progress=progress)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('path', help='CSV / JSONL 文件')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='文件格式（默认按扩展名判断）')
+    parser.add_argument('--rejected', help='被拒绝行的输出文件')
+    parser.add_argument('--chunk', type=int, default=IMPORT_CHUNK_SIZE, help='每个事务导入的行数')
+    args = parser.parse_args()
+
+    args.format = args.format or detect_import_format(args.path)
+    if not args.format:
+        parser.error('无法从扩展名判断文件格式，请指定 --format')
+    args.rejected = args.rejected or f"{os.path.splitext(args.path)[0]}.rejected.csv"
+
+    init_db.init_database()
+    try:
+        stats = asyncio.run(run(args))
+    finally:
+        db_pool.close_pool()
+
+    print(f"\n总行数: {stats['total']}")
+    print(f"已导入: {stats['inserted']}")
+    print(f"拒绝: {stats['rejected']}" + (f" -> {args.rejected}" if stats['rejected'] else ''))
+    print(f"耗时: {stats['seconds']:.2f} 秒 ({stats['rows_per_sec']:,.0f} 行/秒)")
+
+
+if __name__ == "__main__":
+    main()
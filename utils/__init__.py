@@ -15,9 +15,10 @@ from .order_helpers import (
     parse_order_from_title,
     get_state_from_title,
     update_order_state_from_title,
+    check_order_command,
     try_create_order_from_title
 )
-from .stats_helpers import update_all_stats, update_liquid_capital
+from .stats_helpers import update_all_stats, update_liquid_capital, new_stats_delta, apply_stats
 from .message_helpers import display_search_results_helper
 
 __all__ = [
@@ -28,9 +29,12 @@ __all__ = [
     'parse_order_from_title',
     'get_state_from_title',
     'update_order_state_from_title',
+    'check_order_command',
     'try_create_order_from_title',
     'update_all_stats',
     'update_liquid_capital',
+    'new_stats_delta',
+    'apply_stats',
     'display_search_results_helper'
 ]
 
@@ -0,0 +1,261 @@
+"""群发引擎：有限并发 + 令牌桶限速（全局和单群），任务状态持久化，重启后继续发送
+
+引擎只使用 bot.send_message / bot.edit_message_text，可以传入假的 bot 对象进行测试。
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+import db_operations
+
+logger = logging.getLogger(__name__)
+
+# 群发配置（可通过环境变量调整）
+BROADCAST_CONCURRENCY = int(os.getenv('BROADCAST_CONCURRENCY', '8'))
+# Telegram 限制：全局约 30 条/秒，同一群约 20 条/分钟
+BROADCAST_GLOBAL_RATE = float(os.getenv('BROADCAST_GLOBAL_RATE', '25'))
+BROADCAST_PER_CHAT_PER_MINUTE = float(os.getenv('BROADCAST_PER_CHAT_PER_MINUTE', '20'))
+BROADCAST_MAX_RETRIES = int(os.getenv('BROADCAST_MAX_RETRIES', '3'))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv('BROADCAST_PROGRESS_INTERVAL', '3'))
+
+
+class TokenBucket:
+    """令牌桶（预约式：允许令牌数为负，返回需要等待的时间）"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, now: float) -> float:
+        """预约一个令牌，返回需要等待的秒数"""
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    def is_idle(self, now: float) -> bool:
+        self._refill(now)
+        return self.tokens >= self.capacity
+
+
+class RateLimiter:
+    """全局 + 单群限速，所有群发任务共用"""
+
+    # 单群令牌桶数量超过该值时清理已空闲的桶
+    MAX_CHAT_BUCKETS = 4096
+
+    def __init__(self, global_rate: float = BROADCAST_GLOBAL_RATE,
+                 per_chat_per_minute: float = BROADCAST_PER_CHAT_PER_MINUTE):
+        self.global_bucket = TokenBucket(global_rate, max(1.0, global_rate))
+        self.per_chat_rate = per_chat_per_minute / 60
+        self.per_chat_capacity = max(1.0, min(3.0, per_chat_per_minute))
+        self._chats: Dict[int, TokenBucket] = {}
+        self._paused_until = 0.0
+
+    def _chat_bucket(self, chat_id: int, now: float) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            if len(self._chats) >= self.MAX_CHAT_BUCKETS:
+                self._chats = {cid: b for cid, b in self._chats.items() if not b.is_idle(now)}
+            bucket = self._chats[chat_id] = TokenBucket(
+                self.per_chat_rate, self.per_chat_capacity)
+        return bucket
+
+    async def acquire(self, chat_id: int):
+        """等待直到可以向该群发送一条消息"""
+        now = time.monotonic()
+        wait = max(
+            self._paused_until - now,
+            self.global_bucket.reserve(now),
+            self._chat_bucket(chat_id, now).reserve(now),
+        )
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def pause(self, seconds: float):
+        """收到 RetryAfter 后暂停所有发送"""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+# 全局限速器
+limiter = RateLimiter()
+
+
+def _retry_seconds(retry_after: Union[int, float, timedelta]) -> float:
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+class BroadcastEngine:
+    """执行一个群发任务（新建或从数据库恢复）"""
+
+    def __init__(self, bot, rate_limiter: Optional[RateLimiter] = None,
+                 concurrency: int = BROADCAST_CONCURRENCY,
+                 max_retries: int = BROADCAST_MAX_RETRIES,
+                 progress_interval: float = BROADCAST_PROGRESS_INTERVAL):
+        self.bot = bot
+        self.limiter = rate_limiter or limiter
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        self.progress_interval = progress_interval
+
+    async def send(self, chat_id: int, text: str) -> Tuple[bool, Optional[str]]:
+        """限速发送一条消息，返回 (是否成功, 错误信息)"""
+        error = None
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(chat_id)
+            try:
+                await self.bot.send_message(chat_id=chat_id, text=text)
+                return True, None
+            except RetryAfter as e:
+                delay = _retry_seconds(e.retry_after)
+                logger.warning(f"群发触发限流，暂停 {delay:.0f} 秒 (群组: {chat_id})")
+                self.limiter.pause(delay)
+                error = str(e)
+            except ChatMigrated as e:
+                # 群组升级为超级群，改用新ID重试
+                chat_id = e.new_chat_id
+                error = str(e)
+            except (BadRequest, Forbidden) as e:
+                # 群不存在、机器人被移出等，重试无意义
+                return False, str(e)
+            except NetworkError as e:
+                error = str(e)
+                await asyncio.sleep(min(2 ** attempt, 30))
+            except TelegramError as e:
+                return False, str(e)
+        return False, error
+
+    def _render_status(self, job: Dict, finished: bool) -> str:
+        done = job['sent'] + job['failed']
+        return (
+            f"📢 Broadcast #{job['id']}\n"
+            f"Progress: {done}/{job['total']}\n"
+            f"✅ Success: {job['sent']}\n"
+            f"❌ Failed: {job['failed']}\n"
+            + ("✅ Completed" if finished else "⏳ Sending...")
+        )
+
+    async def _update_status(self, job: Dict, finished: bool = False):
+        """编辑进度消息（没有进度消息时忽略）"""
+        if not job.get('status_chat_id') or not job.get('status_message_id'):
+            return
+        try:
+            await self.bot.edit_message_text(
+                chat_id=job['status_chat_id'],
+                message_id=job['status_message_id'],
+                text=self._render_status(job, finished))
+        except BadRequest as e:
+            if 'not modified' not in str(e).lower():
+                logger.warning(f"更新群发进度失败: {e}")
+        except TelegramError as e:
+            logger.warning(f"更新群发进度失败: {e}")
+
+    async def start(self, text: str, targets: Iterable[Union[int, Tuple[int, Optional[str]]]],
+                    created_by: Optional[int] = None,
+                    status_chat_id: Optional[int] = None) -> Optional[int]:
+        """
+        创建并持久化群发任务，发送进度消息，返回任务ID（执行需调用 run）
+        :param targets: chat_id 列表，或 (chat_id, 单独文本) 列表
+        """
+        normalized = [t if isinstance(t, tuple) else (t, None) for t in targets]
+        job_id = await db_operations.create_broadcast_job(
+            text, normalized, created_by, status_chat_id)
+        if not job_id:
+            return None
+        if status_chat_id:
+            try:
+                job = await db_operations.get_broadcast_job(job_id)
+                message = await self.bot.send_message(
+                    chat_id=status_chat_id, text=self._render_status(job, False))
+                await db_operations.set_broadcast_status_message(job_id, message.message_id)
+            except TelegramError as e:
+                logger.warning(f"发送群发进度消息失败: {e}")
+        return job_id
+
+    async def run(self, job_id: int) -> Optional[Dict]:
+        """发送任务中所有未发送的目标，返回最终任务状态"""
+        job = await db_operations.get_broadcast_job(job_id)
+        if not job:
+            return None
+        pending = await db_operations.get_pending_broadcast_targets(job_id)
+        queue: asyncio.Queue = asyncio.Queue()
+        for target in pending:
+            queue.put_nowait(target)
+
+        async def worker():
+            while True:
+                try:
+                    target = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                success, error = await self.send(
+                    target['chat_id'], target['text'] or job['text'])
+                if not success:
+                    logger.error(f"群发失败 {target['chat_id']}: {error}")
+                if await db_operations.mark_broadcast_target(
+                        job_id, target['chat_id'], success, error):
+                    job['sent' if success else 'failed'] += 1
+
+        async def report_progress():
+            last = None
+            while True:
+                await asyncio.sleep(self.progress_interval)
+                current = (job['sent'], job['failed'])
+                if current != last:
+                    await self._update_status(job)
+                    last = current
+
+        reporter = asyncio.create_task(report_progress())
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(pending)) or 1)))
+        finally:
+            reporter.cancel()
+
+        await db_operations.finish_broadcast_job(job_id)
+        job['status'] = 'done'
+        await self._update_status(job, finished=True)
+        logger.info(
+            f"群发任务 {job_id} 完成: 成功 {job['sent']}, 失败 {job['failed']}, 共 {job['total']}")
+        return job
+
+
+# 正在执行的任务（保留引用，防止被垃圾回收）
+_running: Dict[int, asyncio.Task] = {}
+
+
+def _spawn(engine: BroadcastEngine, job_id: int) -> asyncio.Task:
+    task = asyncio.create_task(engine.run(job_id))
+    _running[job_id] = task
+    task.add_done_callback(lambda _: _running.pop(job_id, None))
+    return task
+
+
+async def start_broadcast(bot, text: str, targets: List, created_by: Optional[int] = None,
+                          status_chat_id: Optional[int] = None) -> Optional[int]:
+    """创建群发任务并在后台执行，立即返回任务ID"""
+    engine = BroadcastEngine(bot)
+    job_id = await engine.start(text, targets, created_by, status_chat_id)
+    if job_id:
+        _spawn(engine, job_id)
+    return job_id
+
+
+async def resume_broadcast_jobs(bot) -> int:
+    """启动时继续执行未完成的群发任务，返回任务数"""
+    jobs = await db_operations.get_unfinished_broadcast_jobs()
+    for job in jobs:
+        if job['id'] not in _running:
+            logger.info(
+                f"继续群发任务 {job['id']}: 已完成 {job['sent'] + job['failed']}/{job['total']}")
+            _spawn(BroadcastEngine(bot), job['id'])
+    return len(jobs)
@@ -0,0 +1,85 @@
+"""日结任务
+
+每天日切（DAILY_CUTOFF_HOUR）时：
+- 冻结刚结束的日期：之后提交的统计变动计入新的一天
+- 补全全局和各归属的日终存量（有效订单数、有效金额、流动资金；当天有变动的已随变动写入 daily_stock）
+- 预先生成新一天的全局和各归属今日报表的统计部分（/report 直接使用，余额在读取时填入）
+- 把刚结束这一天的全局报表和归属排行发给管理员
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from apscheduler.triggers.cron import CronTrigger
+from telegram.constants import ParseMode
+import db_operations
+from constants import DAILY_CUTOFF_HOUR
+from utils.date_helpers import get_daily_period_date
+from utils import schedule_executor
+
+logger = logging.getLogger(__name__)
+
+# 是否每天日切时自动日结
+DAY_CLOSE_ENABLED = os.getenv('DAY_CLOSE', '1').strip().lower() not in ('0', 'false', 'no')
+
+DAY_CLOSE_JOB_ID = 'day_close'
+# 与 get_daily_period_date 的日切时区一致
+DAY_CLOSE_TIMEZONE = 'Asia/Shanghai'
+
+
+def previous_date(date: str) -> str:
+    return (datetime.strptime(date, '%Y-%m-%d') - timedelta(days=1)).strftime('%Y-%m-%d')
+
+
+async def close_day(period_date: Optional[str] = None) -> Dict:
+    """
+    日结 period_date 的前一天，并预先生成 period_date 的今日报表
+    :return: {'date', 'status', 'stock', 'reports'}
+    """
+    # 报表生成依赖处理器模块，延迟导入
+    from handlers.report_handlers import prerender_today_reports
+
+    period_date = period_date or get_daily_period_date()
+    date = previous_date(period_date)
+    result = await db_operations.close_day(date)
+    group_ids = await db_operations.get_all_group_ids()
+    reports = await prerender_today_reports(period_date, group_ids)
+    if result['status'] == 'ok':
+        logger.info(f"日结 {date}: {len(result['stock'])} 条日终存量，预先生成 {reports} 份报表")
+    return {'date': date, 'status': result['status'], 'stock': result['stock'], 'reports': reports}
+
+
+async def push_day_report(bot, date: str, admin_ids: Iterable[int]):
+    """把某天的全局报表和归属排行发给管理员"""
+    from handlers.report_handlers import generate_report_text, generate_leaderboard_text
+
+    report = await generate_report_text("close", date, date)
+    leaderboard = await generate_leaderboard_text("today", date, date)
+    for admin_id in admin_ids:
+        try:
+            await bot.send_message(chat_id=admin_id, text=report)
+            for message in leaderboard:
+                await bot.send_message(chat_id=admin_id, text=message, parse_mode=ParseMode.HTML)
+        except Exception as e:
+            logger.error(f"发送日结报表给管理员 {admin_id} 失败: {e}")
+
+
+async def run_day_close(admin_ids: Iterable[int] = ()) -> Dict:
+    """定时任务：日结，新完成日结时把报表发给管理员（重复执行只重新生成报表）"""
+    result = await close_day()
+    bot = schedule_executor.get_scheduler_bot()
+    if result['status'] == 'ok' and bot is not None:
+        await push_day_report(bot, result['date'], admin_ids)
+    return result
+
+
+def setup_day_close(admin_ids: Iterable[int]) -> str:
+    """添加/移除每天日切时的日结任务（需在 setup_scheduled_broadcasts 之后调用）"""
+    trigger = None
+    if DAY_CLOSE_ENABLED:
+        trigger = CronTrigger(hour=DAILY_CUTOFF_HOUR, minute=0, timezone=DAY_CLOSE_TIMEZONE)
+    action = schedule_executor.ensure_job(
+        DAY_CLOSE_JOB_ID, run_day_close, trigger, (sorted(admin_ids),), "日结")
+    if action != 'unchanged':
+        logger.info(f"日结任务: {action}")
+    return action
@@ -1,13 +1,14 @@
 """订单相关工具函数"""
 import re
 import logging
-from datetime import datetime, date, timedelta
+from datetime import datetime, date
 from telegram import Update
 from telegram.ext import ContextTypes
 import db_operations
 from constants import HISTORICAL_THRESHOLD_DATE, WEEKDAY_GROUP
-from utils.stats_helpers import update_all_stats, update_liquid_capital
+from utils.date_helpers import get_daily_period_date
 from utils.chat_helpers import is_group_chat, get_current_group, reply_in_group
+from utils.payment_reminder import render_order_reminder
 
 logger = logging.getLogger(__name__)
 
@@ -76,57 +77,55 @@ def parse_order_from_title(title: str):
     }
 
 
-async def update_order_state_from_title(update: Update, context: ContextTypes.DEFAULT_TYPE, order: dict, title: str):
-    """根据群名变更自动更新订单状态"""
-    current_state = order['state']
+async def check_order_command(result, reply_func,
+                              state_error: str = "❌ Failed: Order state not allowed.") -> bool:
+    """
+    检查订单命令（db_operations.end_order 等）的结果，失败时回复用户
+    :return: 命令是否成功
+    """
+    if not result:
+        await reply_func("❌ Failed: DB Error")
+        return False
+    status = result['status']
+    if status == 'ok':
+        return True
+    if status == 'no_order':
+        await reply_func("❌ Failed: No active order.")
+    elif status == 'invalid_state':
+        await reply_func(state_error)
+    elif status == 'invalid_amount':
+        await reply_func("❌ Failed: Amount must be positive.")
+    else:
+        await reply_func(f"❌ Failed: {status}")
+    return False
 
-    # 1. 完成状态不再更改
-    if current_state in ['end', 'breach_end']:
-        return
 
+async def update_order_state_from_title(update: Update, context: ContextTypes.DEFAULT_TYPE, order: dict, title: str):
+    """根据群名变更自动更新订单状态"""
     target_state = get_state_from_title(title)
+    current_state = order['state']
 
-    # 2. 状态一致无需更改
-    if current_state == target_state:
+    # 1. 完成状态不再更改；2. 状态一致无需更改
+    if current_state in ['end', 'breach_end'] or current_state == target_state:
         return
 
-    chat_id = order['chat_id']
-    group_id = order['group_id']
-    amount = order['amount']
-    order_id = order['order_id']
-
     try:
-        # 3. 执行状态变更逻辑
+        # 状态和统计迁移在同一事务中完成（事务内重新读取订单并校验状态）
+        result = await db_operations.set_order_state(
+            get_daily_period_date(), order['chat_id'], target_state, note='title')
+        if not result or result['status'] != 'ok':
+            return
+
         # 逻辑矩阵:
         # Normal/Overdue -> Breach: 移动统计 (Valid -> Breach)
         # Breach -> Normal/Overdue: 移动统计 (Breach -> Valid)
         # Normal <-> Overdue: 仅更新状态 (都在 Valid 统计下)
-
-        is_current_valid = current_state in ['normal', 'overdue']
-        is_target_valid = target_state in ['normal', 'overdue']
-
-        is_current_breach = current_state == 'breach'
-        is_target_breach = target_state == 'breach'
-
-        # 更新数据库状态
-        if await db_operations.update_order_state(chat_id, target_state):
-
-            # 处理统计数据迁移
-            if is_current_valid and is_target_breach:
-                # Valid -> Breach
-                await update_all_stats('valid', -amount, -1, group_id)
-                await update_all_stats('breach', amount, 1, group_id)
-                await reply_in_group(update, f"🔄 State Changed: {target_state} (Auto)\nStats moved to Breach.")
-
-            elif is_current_breach and is_target_valid:
-                # Breach -> Valid
-                await update_all_stats('breach', -amount, -1, group_id)
-                await update_all_stats('valid', amount, 1, group_id)
-                await reply_in_group(update, f"🔄 State Changed: {target_state} (Auto)\nStats moved to Valid.")
-
-            else:
-                # Normal <-> Overdue (都在 Valid 池中，仅状态变更)
-                await reply_in_group(update, f"🔄 State Changed: {target_state} (Auto)")
+        if target_state == 'breach':
+            await reply_in_group(update, f"🔄 State Changed: {target_state} (Auto)\nStats moved to Breach.")
+        elif current_state == 'breach':
+            await reply_in_group(update, f"🔄 State Changed: {target_state} (Auto)\nStats moved to Valid.")
+        else:
+            await reply_in_group(update, f"🔄 State Changed: {target_state} (Auto)")
 
     except Exception as e:
         logger.error(f"Auto update state failed: {e}", exc_info=True)
@@ -175,20 +174,6 @@ async def try_create_order_from_title(update: Update, context: ContextTypes.DEFA
     threshold_date = date(*HISTORICAL_THRESHOLD_DATE)
     is_historical = order_date < threshold_date
 
-    # 检查余额 (仅当非历史订单时检查)
-    if not is_historical:
-        financial_data = await db_operations.get_financial_data()
-        if financial_data['liquid_funds'] < amount:
-            msg = (
-                f"❌ Insufficient Liquid Funds\n"
-                f"Current Balance: {financial_data['liquid_funds']:.2f}\n"
-                f"Required: {amount:.2f}\n"
-                f"Missing: {amount - financial_data['liquid_funds']:.2f}"
-            )
-            if manual_trigger or is_group_chat(update):
-                await update.message.reply_text(msg)
-            return
-
     group_id = 'S01'  # 默认归属
     weekday_group = get_current_group()
 
@@ -206,32 +191,27 @@ async def try_create_order_from_title(update: Update, context: ContextTypes.DEFA
         'state': initial_state
     }
 
-    # 6. 创建订单
-    if not await db_operations.create_order(new_order):
+    # 6. 创建订单并更新统计（同一事务；非历史订单在事务内检查余额并扣款）
+    result = await db_operations.open_order(
+        get_daily_period_date(), new_order, historical=is_historical)
+    if not result or result['status'] == 'duplicate':
         if manual_trigger:
             await update.message.reply_text("❌ Failed to create order. Order ID might duplicate.")
         return
 
-    # 7. 更新统计
-    # 根据初始状态决定计入 Valid 还是 Breach
-    is_initial_breach = (initial_state == 'breach')
+    if result['status'] == 'insufficient_funds':
+        liquid_funds = result['financial'].get('liquid_funds', 0)
+        msg = (
+            f"❌ Insufficient Liquid Funds\n"
+            f"Current Balance: {liquid_funds:.2f}\n"
+            f"Required: {amount:.2f}\n"
+            f"Missing: {amount - liquid_funds:.2f}"
+        )
+        if manual_trigger or is_group_chat(update):
+            await update.message.reply_text(msg)
+        return
 
     if not is_historical:
-        # 正常扣款流程
-
-        # 统计金额/数量
-        if is_initial_breach:
-            await update_all_stats('breach', amount, 1, group_id)
-        else:
-            await update_all_stats('valid', amount, 1, group_id)
-
-        # 扣除流动资金
-        await update_liquid_capital(-amount)
-
-        # 客户统计
-        client_field = 'new_clients' if customer == 'A' else 'old_clients'
-        await update_all_stats(client_field, amount, 1, group_id)
-
         msg = (
             f"✅ Order Created Successfully\n\n"
             f"📋 Order ID: {order_id}\n"
@@ -242,18 +222,8 @@ async def try_create_order_from_title(update: Update, context: ContextTypes.DEFA
             f"💰 Amount: {amount:.2f}\n"
             f"📈 Status: {initial_state}"
         )
-        await update.message.reply_text(msg)
-
-        # 自动播报下一期还款
-        await send_auto_broadcast(update, context, chat_id, amount)
-
     else:
-        # 历史订单流程 (不扣款)
-        if is_initial_breach:
-            await update_all_stats('breach', amount, 1, group_id)
-        else:
-            await update_all_stats('valid', amount, 1, group_id)
-
+        # 历史订单 (不扣款)
         msg = (
             f"✅ Historical Order Imported\n\n"
             f"📋 Order ID: {order_id}\n"
@@ -264,40 +234,17 @@ async def try_create_order_from_title(update: Update, context: ContextTypes.DEFA
             f"📈 Status: {initial_state}\n"
             f"⚠️ Funds Update: Skipped (Historical Data Only)"
         )
-        await update.message.reply_text(msg)
+    await update.message.reply_text(msg)
 
-        # 历史订单也自动播报
-        await send_auto_broadcast(update, context, chat_id, amount)
+    # 自动播报下一期还款（历史订单也播报）
+    await send_auto_broadcast(update, context, chat_id, amount)
 
 
 async def send_auto_broadcast(update: Update, context: ContextTypes.DEFAULT_TYPE, chat_id: int, amount: float):
     """订单创建后自动播报下一期还款"""
     try:
-        # 计算本金和本金12%
-        principal = amount
-        principal_12 = principal * 0.12
-
-        # 计算下一个付款日期（下周五）
-        today = datetime.now()
-        days_until_friday = (4 - today.weekday()) % 7
-        if days_until_friday == 0:
-            days_until_friday = 7
-        next_friday = today + timedelta(days=days_until_friday)
-
-        # 格式化日期（格式：November 26,2025）
-        date_str = next_friday.strftime("%B %d,%Y")
-        weekday_str = next_friday.strftime("%A")
-
-        # 格式化金额（添加千位分隔符）
-        principal_formatted = f"{principal:,.0f}"
-        principal_12_formatted = f"{principal_12:,.0f}"
-
-        # 构建并发送播报消息
-        message = (
-            f"Your next payment is due on {date_str} ({weekday_str}) "
-            f"for {principal_formatted} or {principal_12_formatted} to defer the principal payment for one week.\n\n"
-            f"Your outstanding interest is 0"
-        )
+        # 本金 或 本金12%，下周五付款，新订单未付利息为 0
+        message = render_order_reminder(amount, outstanding_interest=0)
 
         await context.bot.send_message(chat_id=chat_id, text=message)
         logger.info(f"自动播报已发送到群组 {chat_id}")
@@ -0,0 +1,187 @@
+"""历史订单批量导入（CSV / JSONL，流式读取，分块校验后批量写入）
+
+每行可以是群名（title 列，按 parse_order_from_title 解析），也可以是订单字段：
+    chat_id, title[, state, group_id]
+    chat_id, order_id, date, amount[, customer, state, group_id, weekday_group]
+只导入 HISTORICAL_THRESHOLD_DATE 之前的订单（不扣流动资金），校验失败的行写入拒绝文件
+导入的订单以导入当天作为最近付款日（与升级时回填的订单相同），逾期扫描从导入后的下一个付款周期开始判断
+"""
+import os
+import csv
+import json
+import time
+import logging
+from datetime import datetime, date
+from typing import Dict, Iterable, Iterator, Optional, Tuple, Callable, Awaitable
+import db_operations
+from constants import HISTORICAL_THRESHOLD_DATE, WEEKDAY_GROUP
+from utils.date_helpers import get_daily_period_date
+from utils.order_helpers import parse_order_from_title, get_state_from_title
+
+logger = logging.getLogger(__name__)
+
+# 每个事务导入的行数
+IMPORT_CHUNK_SIZE = int(os.getenv('IMPORT_CHUNK_SIZE', '2000'))
+# 导入订单允许的状态
+IMPORT_STATES = ('normal', 'overdue', 'breach')
+# 拒绝文件的列
+REJECTED_HEADER = ['line', 'reason', 'row']
+
+
+def detect_import_format(filename: str) -> Optional[str]:
+    """按文件扩展名判断格式：csv / jsonl"""
+    name = (filename or '').lower()
+    if name.endswith('.csv'):
+        return 'csv'
+    if name.endswith(('.jsonl', '.ndjson', '.json')):
+        return 'jsonl'
+    return None
+
+
+def read_import_rows(stream: Iterable[str], fmt: str) -> Iterator[Tuple[int, object]]:
+    """逐行读取导入文件，返回 (行号, 行数据)；JSONL 中无法解析的行返回原始文本"""
+    if fmt == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, {k.strip(): (v or '').strip() for k, v in row.items() if k}
+        return
+
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, line
+            continue
+        yield line_no, row
+
+
+def _parse_order_date(value: str) -> Optional[date]:
+    for fmt in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d'):
+        try:
+            return datetime.strptime(value.strip(), fmt).date()
+        except ValueError:
+            continue
+    return None
+
+
+def validate_import_row(row) -> Tuple[Optional[Dict], Optional[str]]:
+    """
+    校验一行导入数据
+    :return: (订单数据, None) 或 (None, 拒绝原因)
+    """
+    if not isinstance(row, dict):
+        return None, 'invalid row'
+
+    try:
+        chat_id = int(row.get('chat_id'))
+    except (TypeError, ValueError):
+        return None, 'invalid chat_id'
+
+    title = str(row.get('title') or '').strip()
+    if title:
+        parsed = parse_order_from_title(title)
+        if not parsed:
+            return None, 'invalid title'
+        order_id = parsed['order_id']
+        order_date = parsed['date']
+        amount = parsed['amount']
+        customer = parsed['customer']
+        state = row.get('state') or get_state_from_title(title)
+    else:
+        order_id = str(row.get('order_id') or '').strip()
+        if not order_id:
+            return None, 'missing order_id or title'
+        order_date = _parse_order_date(str(row.get('date') or ''))
+        if not order_date:
+            return None, 'invalid date'
+        try:
+            amount = float(row.get('amount'))
+        except (TypeError, ValueError):
+            return None, 'invalid amount'
+        customer = str(row.get('customer') or ('A' if order_id.startswith('A') else 'B')).upper()
+        state = row.get('state') or 'normal'
+
+    if amount <= 0:
+        return None, 'invalid amount'
+    if customer not in ('A', 'B'):
+        return None, 'invalid customer'
+    if state not in IMPORT_STATES:
+        return None, 'invalid state'
+    if order_date >= date(*HISTORICAL_THRESHOLD_DATE):
+        return None, 'not historical'
+
+    return {
+        'order_id': order_id,
+        'group_id': str(row.get('group_id') or 'S01').strip(),
+        'chat_id': chat_id,
+        'date': f"{order_date.strftime('%Y-%m-%d')} 12:00:00",
+        'group': row.get('weekday_group') or WEEKDAY_GROUP[order_date.weekday()],
+        'customer': customer,
+        'amount': amount,
+        'state': state,
+    }, None
+
+
+async def import_orders(rows: Iterable[Tuple[int, object]], rejected_file=None,
+                        chunk_size: int = IMPORT_CHUNK_SIZE,
+                        progress: Optional[Callable[[Dict], Awaitable[None]]] = None) -> Dict:
+    """
+    分块导入历史订单
+    :param rows: read_import_rows() 的结果
+    :param rejected_file: 文本流，写入被拒绝的行（CSV: line, reason, row）
+    :param progress: 每个块提交后调用，参数为当前统计
+    :return: {'total', 'inserted', 'rejected', 'seconds', 'rows_per_sec'}
+    """
+    writer = csv.writer(rejected_file) if rejected_file is not None else None
+    if writer:
+        writer.writerow(REJECTED_HEADER)
+    stats = {'total': 0, 'inserted': 0, 'rejected': 0, 'seconds': 0.0, 'rows_per_sec': 0.0}
+    started = time.perf_counter()
+
+    def reject(line_no: int, reason: str, row):
+        stats['rejected'] += 1
+        if writer:
+            raw = row if isinstance(row, str) else json.dumps(row, ensure_ascii=False)
+            writer.writerow([line_no, reason, raw])
+
+    async def flush(chunk):
+        result = await db_operations.import_historical_orders(
+            get_daily_period_date(), [order for _, order, _ in chunk])
+        if not result:
+            for line_no, _, row in chunk:
+                reject(line_no, 'database error', row)
+        else:
+            stats['inserted'] += result['inserted']
+            for index, reason in result['rejected']:
+                line_no, _, row = chunk[index]
+                reject(line_no, reason, row)
+        elapsed = time.perf_counter() - started
+        stats['seconds'] = elapsed
+        stats['rows_per_sec'] = stats['total'] / elapsed if elapsed else 0.0
+        if progress:
+            await progress(dict(stats))
+
+    chunk = []
+    for line_no, row in rows:
+        stats['total'] += 1
+        order, error = validate_import_row(row)
+        if error:
+            reject(line_no, error, row)
+            continue
+        chunk.append((line_no, order, row))
+        if len(chunk) >= chunk_size:
+            await flush(chunk)
+            chunk = []
+    if chunk:
+        await flush(chunk)
+
+    elapsed = time.perf_counter() - started
+    stats['seconds'] = elapsed
+    stats['rows_per_sec'] = stats['total'] / elapsed if elapsed else 0.0
+    logger.info(
+        f"历史订单导入完成: {stats['inserted']}/{stats['total']} 行导入, "
+        f"{stats['rejected']} 行拒绝, {stats['rows_per_sec']:.0f} 行/秒")
+    return stats
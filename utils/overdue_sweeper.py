@@ -0,0 +1,93 @@
+"""逾期扫描
+
+每天日切（DAILY_CUTOFF_HOUR）时，把已过付款日仍未付款的正常订单一次性转为逾期：
+- 订单按星期分组每周付款一次，付款日为该星期几
+- 最近付款日（利息/本金减少，没有付款时为下单日）不晚于上一个付款日前 7 天，即整个付款周期内没有付款
+- 一条 UPDATE 完成全部状态变更，重复执行不会重复变更；每个归属发一条汇总给管理员
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, Optional
+from apscheduler.triggers.cron import CronTrigger
+import db_operations
+from constants import DAILY_CUTOFF_HOUR, WEEKDAY_GROUP
+from utils.date_helpers import get_daily_period_date
+from utils import schedule_executor
+
+logger = logging.getLogger(__name__)
+
+# 是否每天日切时自动扫描
+OVERDUE_SWEEP_ENABLED = os.getenv('OVERDUE_SWEEP', '1').strip().lower() not in ('0', 'false', 'no')
+# 付款日后宽限天数
+OVERDUE_GRACE_DAYS = int(os.getenv('OVERDUE_GRACE_DAYS', '0'))
+# 汇总消息中最多列出的订单号
+OVERDUE_SUMMARY_MAX_ORDERS = 50
+
+OVERDUE_JOB_ID = 'overdue_sweep'
+# 与 get_daily_period_date 的日切时区一致
+OVERDUE_TIMEZONE = 'Asia/Shanghai'
+
+
+def compute_due_before(period_date: str, grace_days: int = OVERDUE_GRACE_DAYS) -> Dict[str, str]:
+    """
+    每个星期分组的截止日期：最近付款日不晚于该日期的正常订单视为逾期
+    上一个付款日 = 日结日期（减去宽限天数）之前最近的该星期几，截止日期 = 上一个付款日 - 7 天
+    """
+    reference = datetime.strptime(period_date, '%Y-%m-%d') - timedelta(days=grace_days)
+    due_before = {}
+    for weekday, group in WEEKDAY_GROUP.items():
+        last_due = reference - timedelta(days=(reference.weekday() - weekday - 1) % 7 + 1)
+        due_before[group] = (last_due - timedelta(days=7)).strftime('%Y-%m-%d')
+    return due_before
+
+
+async def sweep_overdue(period_date: Optional[str] = None) -> Dict[str, Dict]:
+    """执行一次逾期扫描，返回 {归属ID: {'count', 'amount', 'order_ids'}}"""
+    period_date = period_date or get_daily_period_date()
+    summary = await db_operations.sweep_overdue_orders(period_date, compute_due_before(period_date))
+    total = sum(group['count'] for group in summary.values())
+    if total:
+        logger.info(f"逾期扫描 {period_date}: {total} 个订单转为逾期（{len(summary)} 个归属）")
+    return summary
+
+
+def render_sweep_summary(period_date: str, group_id: str, group: Dict) -> str:
+    """一个归属的逾期扫描汇总"""
+    order_ids = group['order_ids'][:OVERDUE_SUMMARY_MAX_ORDERS]
+    more = group['count'] - len(order_ids)
+    return (
+        f"⏰ 逾期扫描 {period_date}\n"
+        f"归属 {group_id}: {group['count']} 个订单转为逾期，金额 {group['amount']:,.2f}\n\n"
+        + "\n".join(order_ids)
+        + (f"\n... 另有 {more} 个" if more > 0 else "")
+    )
+
+
+async def run_overdue_sweep(admin_ids: Iterable[int] = ()):
+    """定时任务：扫描逾期订单，并把每个归属的汇总发给管理员"""
+    period_date = get_daily_period_date()
+    summary = await sweep_overdue(period_date)
+    bot = schedule_executor.get_scheduler_bot()
+    if not summary or bot is None:
+        return summary
+    for group_id in sorted(summary):
+        message = render_sweep_summary(period_date, group_id, summary[group_id])
+        for admin_id in admin_ids:
+            try:
+                await bot.send_message(chat_id=admin_id, text=message)
+            except Exception as e:
+                logger.error(f"发送逾期扫描汇总给管理员 {admin_id} 失败: {e}")
+    return summary
+
+
+def setup_overdue_sweep(admin_ids: Iterable[int]) -> str:
+    """添加/移除每天日切时的逾期扫描任务（需在 setup_scheduled_broadcasts 之后调用）"""
+    trigger = None
+    if OVERDUE_SWEEP_ENABLED:
+        trigger = CronTrigger(hour=DAILY_CUTOFF_HOUR, minute=0, timezone=OVERDUE_TIMEZONE)
+    action = schedule_executor.ensure_job(
+        OVERDUE_JOB_ID, run_overdue_sweep, trigger, (sorted(admin_ids),), "逾期扫描")
+    if action != 'unchanged':
+        logger.info(f"逾期扫描任务: {action}")
+    return action
@@ -0,0 +1,130 @@
+"""付款提醒
+
+- render_payment_reminder：所有付款提醒共用的文本（/broadcast、建单后自动播报、手动输入播报、提醒活动）
+- 提醒活动：一次查询选出全部有效订单（可按星期分组/归属ID/状态筛选），为每个群生成各自的
+  本金 / 本金12% 提醒，作为一个群发任务交给群发引擎（限速、限流重试、进度统计、重启后继续）
+- 设置 REMINDER_CRON 后由调度器按时自动执行（任务保存在 scheduler_jobs 中）
+"""
+import os
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+import db_operations
+from utils.broadcast_engine import start_broadcast
+from utils import schedule_executor
+
+logger = logging.getLogger(__name__)
+
+# 延期一周需支付的本金比例
+PRINCIPAL_DEFER_RATE = 0.12
+# 付款日（周五）
+PAYMENT_WEEKDAY = 4
+
+# 定时提醒活动：cron 表达式（为空时不定时执行）和筛选条件
+REMINDER_CRON = os.getenv('REMINDER_CRON', '').strip()
+REMINDER_TIMEZONE = os.getenv('REMINDER_TIMEZONE', schedule_executor.SCHEDULE_TIMEZONE)
+REMINDER_WEEKDAY_GROUP = os.getenv('REMINDER_WEEKDAY_GROUP', '').strip() or None
+REMINDER_GROUP_ID = os.getenv('REMINDER_GROUP_ID', '').strip().upper() or None
+REMINDER_STATES = tuple(
+    s.strip() for s in os.getenv('REMINDER_STATES', 'normal,overdue').split(',') if s.strip())
+
+REMINDER_JOB_ID = 'payment_reminder_campaign'
+
+
+def next_payment_date(today: Optional[datetime] = None) -> datetime:
+    """下一个付款日（下周五；当天是周五时为下周五）"""
+    today = today or datetime.now()
+    days = (PAYMENT_WEEKDAY - today.weekday()) % 7 or 7
+    return today + timedelta(days=days)
+
+
+def render_payment_reminder(amounts: Sequence[float], due: Optional[datetime] = None,
+                            outstanding_interest: Optional[float] = None,
+                            decimals: int = 0) -> str:
+    """
+    付款提醒文本
+    :param amounts: 可选的付款金额（如 [本金, 本金12%]），用 or 连接
+    :param outstanding_interest: 未付利息，None 时不显示
+    """
+    due = due or next_payment_date()
+    amount_text = " or ".join(f"{amount:,.{decimals}f}" for amount in amounts)
+    message = (
+        f"Your next payment is due on {due.strftime('%B %d,%Y')} ({due.strftime('%A')}) "
+        f"for {amount_text} to defer the principal payment for one week."
+    )
+    if outstanding_interest is not None:
+        message += f"\n\nYour outstanding interest is {outstanding_interest:,.{decimals}f}"
+    return message
+
+
+def render_order_reminder(principal: float, due: Optional[datetime] = None,
+                          outstanding_interest: Optional[float] = None) -> str:
+    """按订单本金生成提醒（本金 或 本金12%）"""
+    return render_payment_reminder(
+        [principal, principal * PRINCIPAL_DEFER_RATE], due, outstanding_interest)
+
+
+def build_reminder_targets(orders: Iterable[Dict], due: Optional[datetime] = None
+                           ) -> List[Tuple[int, str]]:
+    """为每个订单群生成提醒文本（同一次活动使用同一个付款日）"""
+    due = due or next_payment_date()
+    return [(order['chat_id'], render_order_reminder(order['amount'], due))
+            for order in orders if order['amount'] > 0]
+
+
+def describe_campaign(weekday_group: Optional[str], group_id: Optional[str],
+                      states: Sequence[str]) -> str:
+    """活动说明（作为群发任务文本保存）"""
+    parts = ["付款提醒"]
+    if weekday_group:
+        parts.append(f"星期{weekday_group}")
+    if group_id:
+        parts.append(group_id)
+    parts.append("/".join(states))
+    return " ".join(parts)
+
+
+async def start_reminder_campaign(bot, weekday_group: Optional[str] = None,
+                                  group_id: Optional[str] = None,
+                                  states: Sequence[str] = REMINDER_STATES,
+                                  created_by: Optional[int] = None,
+                                  status_chat_id: Optional[int] = None) -> Tuple[Optional[int], int]:
+    """
+    向符合条件的所有有效订单群发送付款提醒（后台执行），返回 (群发任务ID, 群数)
+    没有符合条件的订单时返回 (None, 0)
+    """
+    orders = await db_operations.get_reminder_orders(weekday_group, group_id, tuple(states))
+    targets = build_reminder_targets(orders)
+    if not targets:
+        return None, 0
+    job_id = await start_broadcast(
+        bot, describe_campaign(weekday_group, group_id, states), targets,
+        created_by=created_by, status_chat_id=status_chat_id)
+    logger.info(f"付款提醒活动开始: {len(targets)} 个群 (群发任务 {job_id})")
+    return job_id, len(targets)
+
+
+async def run_reminder_campaign(status_chat_id: Optional[int] = None):
+    """定时任务：按 REMINDER_* 配置执行提醒活动"""
+    bot = schedule_executor.get_scheduler_bot()
+    if bot is None:
+        logger.error("付款提醒活动触发时调度器未初始化")
+        return
+    job_id, count = await start_reminder_campaign(
+        bot, REMINDER_WEEKDAY_GROUP, REMINDER_GROUP_ID, REMINDER_STATES,
+        status_chat_id=status_chat_id)
+    if not job_id:
+        logger.info("付款提醒活动: 没有符合条件的订单")
+
+
+def setup_reminder_campaign(status_chat_id: Optional[int] = None) -> str:
+    """按 REMINDER_CRON 添加/调整/移除定时提醒任务（需在 setup_scheduled_broadcasts 之后调用）"""
+    trigger = None
+    if REMINDER_CRON:
+        trigger = schedule_executor.build_trigger(
+            schedule_executor.normalize_cron(REMINDER_CRON), REMINDER_TIMEZONE)
+    action = schedule_executor.ensure_job(
+        REMINDER_JOB_ID, run_reminder_campaign, trigger, (status_chat_id,), "付款提醒活动")
+    if action != 'unchanged':
+        logger.info(f"付款提醒活动任务: {action}")
+    return action
@@ -1,72 +1,233 @@
-"""定时播报执行器"""
-import logging
-import asyncio
-from datetime import datetime, time as dt_time
-from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.cron import CronTrigger
-import db_operations
-
-logger = logging.getLogger(__name__)
-
-# 全局调度器
-scheduler = None
-
-
-async def send_scheduled_broadcast(bot, broadcast):
-    """发送定时播报"""
-    try:
-        chat_id = broadcast['chat_id']
-        message = broadcast['message']
-        
-        if not chat_id:
-            logger.warning(f"播报 {broadcast['slot']} 没有设置chat_id，跳过发送")
-            return
-        
-        await bot.send_message(chat_id=chat_id, text=message)
-        logger.info(f"定时播报 {broadcast['slot']} 已发送到群组 {chat_id}")
-    except Exception as e:
-        logger.error(f"发送定时播报 {broadcast['slot']} 失败: {e}", exc_info=True)
-
-
-async def setup_scheduled_broadcasts(bot):
-    """设置定时播报任务"""
-    global scheduler
-    
-    if scheduler is None:
-        scheduler = AsyncIOScheduler()
-        scheduler.start()
-    
-    # 清除所有现有任务
-    scheduler.remove_all_jobs()
-    
-    # 获取所有激活的定时播报
-    broadcasts = await db_operations.get_active_scheduled_broadcasts()
-    
-    for broadcast in broadcasts:
-        try:
-            time_str = broadcast['time']
-            # 解析时间 (HH:MM 或 HH)
-            time_parts = time_str.split(':')
-            hour = int(time_parts[0])
-            minute = int(time_parts[1]) if len(time_parts) > 1 else 0
-            
-            # 创建定时任务（每天执行）
-            job_id = f"broadcast_{broadcast['slot']}"
-            
-            scheduler.add_job(
-                send_scheduled_broadcast,
-                trigger=CronTrigger(hour=hour, minute=minute),
-                args=[bot, broadcast],
-                id=job_id,
-                replace_existing=True
-            )
-            
-            logger.info(f"已设置定时播报 {broadcast['slot']}: 每天 {time_str} 发送到群组 {broadcast['chat_id']}")
-        except Exception as e:
-            logger.error(f"设置定时播报 {broadcast['slot']} 失败: {e}", exc_info=True)
-
-
-async def reload_scheduled_broadcasts(bot):
-    """重新加载定时播报任务"""
-    await setup_scheduled_broadcasts(bot)
-
+"""定时播报执行器
+
+每条定时播报（schedules 表）对应调度器中的一个任务（id = schedule_<播报ID>），
+任务保存在数据库的 scheduler_jobs 表中（SQLiteJobStore），重启后继续按原计划执行。
+- 任务只保存播报ID，触发时才从数据库读取内容和目标群，修改内容不需要重建任务
+- 修改播报后只调整这一个任务（reconcile_schedule）；启动时 sync_schedules 只改动与数据库不一致的任务
+- 重启期间错过的执行：超过 SCHEDULE_MISFIRE_GRACE_TIME 秒不再补发；
+  SCHEDULE_COALESCE 开启时错过多次只补发一次
+"""
+import os
+import re
+import logging
+from datetime import datetime
+from typing import Dict, Optional
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+from apscheduler.util import astimezone
+import db_operations
+from utils.broadcast_engine import start_broadcast
+from utils.schedule_store import SQLiteJobStore
+
+logger = logging.getLogger(__name__)
+
+# 新建播报的默认时区
+SCHEDULE_TIMEZONE = os.getenv('SCHEDULE_TIMEZONE', 'Asia/Shanghai')
+# 错过执行时间后多少秒内仍然补发（0 表示不限）
+SCHEDULE_MISFIRE_GRACE_TIME = int(os.getenv('SCHEDULE_MISFIRE_GRACE_TIME', '300'))
+# 错过多次执行时是否只补发一次
+SCHEDULE_COALESCE = os.getenv('SCHEDULE_COALESCE', '1').strip().lower() not in ('0', 'false', 'no')
+
+JOB_PREFIX = 'schedule_'
+
+# 标准 cron 的星期数字（0 和 7 为周日）；APScheduler 的数字从周一开始，统一换成英文缩写
+_CRON_WEEKDAYS = ['sun', 'mon', 'tue', 'wed', 'thu', 'fri', 'sat', 'sun']
+
+# 全局调度器和发送用的 bot（任务只保存播报ID，触发时使用这里的 bot）
+scheduler: Optional[AsyncIOScheduler] = None
+_bot = None
+
+
+def _job_id(schedule_id: int) -> str:
+    return f"{JOB_PREFIX}{schedule_id}"
+
+
+def _job_options() -> Dict:
+    return {
+        'coalesce': SCHEDULE_COALESCE,
+        'misfire_grace_time': SCHEDULE_MISFIRE_GRACE_TIME or None,
+        'max_instances': 1,
+    }
+
+
+def normalize_cron(text: str) -> str:
+    """
+    把用户输入转换为 5 段 cron 表达式（分 时 日 月 星期），格式错误时抛出 ValueError
+    支持: 22 / 22:30（每天）/ 标准 cron 表达式（如 0 9 * * 1-5）
+    """
+    text = ' '.join(text.split())
+    match = re.fullmatch(r'(\d{1,2})(?::(\d{1,2}))?', text)
+    if match:
+        hour, minute = int(match.group(1)), int(match.group(2) or 0)
+        if not (0 <= hour <= 23 and 0 <= minute <= 59):
+            raise ValueError("小时必须在0-23之间，分钟必须在0-59之间")
+        return f"{minute} {hour} * * *"
+    if len(text.split(' ')) != 5:
+        raise ValueError("cron 表达式需要 5 段：分 时 日 月 星期")
+    build_trigger(text, 'UTC')
+    return text
+
+
+def validate_timezone(name: str) -> str:
+    """检查时区名称（如 Asia/Shanghai），错误时抛出 ValueError"""
+    name = name.strip()
+    try:
+        astimezone(name)
+    except Exception:
+        raise ValueError(f"未知时区: {name}")
+    return name
+
+
+def build_trigger(cron: str, timezone: str) -> CronTrigger:
+    """由 cron 表达式和时区创建触发器（星期按标准 cron：0/7 为周日）"""
+    minute, hour, day, month, day_of_week = cron.split(' ')
+    # 只替换星期的值，不替换步长（*/2）
+    day_of_week = re.sub(
+        r'(?<![/\d])\d+', lambda m: _CRON_WEEKDAYS[int(m.group())] if int(m.group()) <= 7
+        else m.group(), day_of_week)
+    return CronTrigger(minute=minute, hour=hour, day=day, month=month,
+                       day_of_week=day_of_week, timezone=timezone)
+
+
+def describe_schedule(schedule: Dict) -> str:
+    """cron 表达式的简短说明（每天的固定时间显示为 HH:MM）"""
+    parts = schedule['cron'].split(' ')
+    if parts[2:] == ['*', '*', '*'] and parts[0].isdigit() and parts[1].isdigit():
+        text = f"每天 {int(parts[1]):02d}:{int(parts[0]):02d}"
+    else:
+        text = f"cron {schedule['cron']}"
+    return f"{text} ({schedule['timezone']})"
+
+
+def _same_trigger(a, b) -> bool:
+    return type(a) is type(b) and str(a) == str(b) and str(a.timezone) == str(b.timezone)
+
+
+async def run_schedule(schedule_id: int):
+    """任务触发：读取最新的播报内容，按群发任务发送到所有目标群"""
+    schedule = await db_operations.get_schedule(schedule_id)
+    if not schedule or not schedule['is_active']:
+        logger.info(f"定时播报 {schedule_id} 已删除或停用，跳过")
+        return
+    chat_ids = [target['chat_id'] for target in schedule['targets']]
+    if not chat_ids:
+        logger.warning(f"定时播报 {schedule_id} 没有目标群组，跳过发送")
+        return
+    if _bot is None:
+        logger.error(f"定时播报 {schedule_id} 触发时调度器未初始化")
+        return
+    job_id = await start_broadcast(_bot, schedule['message'], chat_ids)
+    logger.info(f"定时播报 {schedule_id} 已开始发送到 {len(chat_ids)} 个群组 (群发任务 {job_id})")
+
+
+def ensure_job(job_id: str, func, trigger: Optional[CronTrigger], args: tuple = (),
+               name: Optional[str] = None) -> str:
+    """
+    让调度器中的一个任务与期望一致，返回执行的操作
+    trigger 为 None 表示不需要该任务；触发器和 misfire/coalesce 设置都没变时不改动任务
+    """
+    job = scheduler.get_job(job_id)
+    if trigger is None:
+        if job:
+            scheduler.remove_job(job_id)
+            return 'removed'
+        return 'unchanged'
+
+    options = _job_options()
+    if job is None:
+        scheduler.add_job(func, trigger=trigger, args=list(args), id=job_id,
+                          name=name or job_id, **options)
+        return 'added'
+
+    action = 'unchanged'
+    if not _same_trigger(job.trigger, trigger):
+        # 重新计算下一次执行时间
+        job.reschedule(trigger)
+        action = 'rescheduled'
+    if list(job.args) != list(args):
+        job.modify(args=list(args))
+        action = 'rescheduled' if action == 'rescheduled' else 'modified'
+    changes = {key: value for key, value in options.items() if getattr(job, key) != value}
+    if changes:
+        job.modify(**changes)
+        action = 'rescheduled' if action == 'rescheduled' else 'modified'
+    return action
+
+
+def _reconcile(schedule: Optional[Dict], schedule_id: int) -> str:
+    """让一条播报的任务与数据库一致，返回执行的操作"""
+    trigger = None
+    if schedule and schedule['is_active'] and schedule['targets']:
+        trigger = build_trigger(schedule['cron'], schedule['timezone'])
+    return ensure_job(_job_id(schedule_id), run_schedule, trigger, (schedule_id,),
+                      f"定时播报 {schedule_id}")
+
+
+def get_scheduler_bot():
+    """定时任务发送消息使用的 bot（setup_scheduled_broadcasts 之前为 None）"""
+    return _bot
+
+
+def get_next_run_time(schedule_id: int) -> Optional[datetime]:
+    """播报的下一次发送时间（未激活或调度器未启动时为 None）"""
+    if scheduler is None:
+        return None
+    job = scheduler.get_job(_job_id(schedule_id))
+    return job.next_run_time if job else None
+
+
+async def reconcile_schedule(schedule_id: int) -> str:
+    """播报修改后调用：只调整这一条播报的任务"""
+    if scheduler is None:
+        return 'unchanged'
+    schedule = await db_operations.get_schedule(schedule_id)
+    action = _reconcile(schedule, schedule_id)
+    if action != 'unchanged':
+        logger.info(f"定时播报 {schedule_id} 任务: {action}")
+    return action
+
+
+async def sync_schedules() -> Dict[str, int]:
+    """让全部任务与数据库一致（启动时调用），未改动的任务保留原来的下一次执行时间"""
+    schedules = {s['id']: s for s in await db_operations.get_all_schedules()}
+    job_ids = {job.id for job in scheduler.get_jobs() if job.id.startswith(JOB_PREFIX)}
+    schedule_ids = set(schedules) | {int(job_id[len(JOB_PREFIX):]) for job_id in job_ids}
+
+    summary: Dict[str, int] = {}
+    for schedule_id in sorted(schedule_ids):
+        try:
+            action = _reconcile(schedules.get(schedule_id), schedule_id)
+        except Exception as e:
+            logger.error(f"设置定时播报 {schedule_id} 失败: {e}", exc_info=True)
+            action = 'failed'
+        summary[action] = summary.get(action, 0) + 1
+    return summary
+
+
+async def setup_scheduled_broadcasts(bot) -> Dict[str, int]:
+    """启动调度器（任务从数据库恢复）并与定时播报表同步，返回各操作的任务数"""
+    global scheduler, _bot
+    _bot = bot
+    if scheduler is None:
+        scheduler = AsyncIOScheduler(
+            jobstores={'default': SQLiteJobStore(db_operations.DB_NAME)},
+            job_defaults=_job_options(),
+            timezone=SCHEDULE_TIMEZONE,
+        )
+        # 先暂停启动：同步完成前不执行任何任务
+        scheduler.start(paused=True)
+    summary = await sync_schedules()
+    scheduler.resume()
+    logger.info(f"定时播报任务已同步: {summary}")
+    return summary
+
+
+def shutdown_scheduler():
+    """停止调度器（不等待正在执行的任务）"""
+    global scheduler
+    if scheduler is not None:
+        store = scheduler._jobstores['default']
+        scheduler.shutdown(wait=False)
+        # AsyncIOScheduler 在事件循环中异步关闭，先等任务的改动写入数据库
+        store.flush()
+        scheduler = None
@@ -0,0 +1,119 @@
+"""APScheduler 的 SQLite 任务存储（保存在主数据库的 scheduler_jobs 表中）
+
+与 APScheduler 自带的 SQLAlchemyJobStore 使用相同的表结构（id / next_run_time / job_state），
+不需要额外安装 SQLAlchemy。表由 init_db 的迁移创建。
+任务状态在每次触发后更新下一次执行时间，重启后从表中恢复，错过的执行按 misfire/coalesce 设置处理。
+
+AsyncIOScheduler 在事件循环中调用任务存储，而写连接可能正持有 BEGIN IMMEDIATE 的批量事务，
+同步写数据库会让事件循环最多等待 busy timeout。因此运行期间以内存中的任务为准（与 MemoryJobStore 相同），
+只在启动时从表中加载一次；增删改提交到写队列（与其他写操作合并提交），不等待写入完成。
+"""
+import pickle
+import sqlite3
+import logging
+import threading
+from concurrent.futures import Future, wait
+from typing import Optional, Set
+from apscheduler.job import Job
+from apscheduler.jobstores.memory import MemoryJobStore
+from apscheduler.util import datetime_to_utc_timestamp
+import db_pool
+from db_pool import DB_BUSY_TIMEOUT_MS
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteJobStore(MemoryJobStore):
+    """保存在 SQLite 表中的任务存储（内存中查询，写入经写队列异步持久化）"""
+
+    def __init__(self, db_path: str, tablename: str = 'scheduler_jobs',
+                 pickle_protocol: int = pickle.HIGHEST_PROTOCOL):
+        super().__init__()
+        self.db_path = db_path
+        self.tablename = tablename
+        self.pickle_protocol = pickle_protocol
+        # 已提交到写队列、尚未写入的请求
+        self._pending: Set[Future] = set()
+        self._pending_lock = threading.Lock()
+
+    def start(self, scheduler, alias):
+        super().start(scheduler, alias)
+        # 启动时（调度器开始执行任务之前）读取一次
+        conn = sqlite3.connect(self.db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000)
+        try:
+            rows = conn.execute(
+                f'SELECT id, job_state FROM {self.tablename} ORDER BY next_run_time').fetchall()
+        finally:
+            conn.close()
+        for job_id, job_state in rows:
+            try:
+                job = self._reconstitute_job(job_state)
+            except BaseException:
+                self._logger.exception(f'无法恢复任务 "{job_id}"，已删除')
+                self._persist(f'DELETE FROM {self.tablename} WHERE id = ?', (job_id,))
+                continue
+            MemoryJobStore.add_job(self, job)
+
+    def add_job(self, job):
+        super().add_job(job)
+        self._persist(
+            f'INSERT INTO {self.tablename} (id, next_run_time, job_state) VALUES (?, ?, ?)',
+            (job.id, datetime_to_utc_timestamp(job.next_run_time), self._job_state(job)))
+
+    def update_job(self, job):
+        super().update_job(job)
+        self._persist(
+            f'UPDATE {self.tablename} SET next_run_time = ?, job_state = ? WHERE id = ?',
+            (datetime_to_utc_timestamp(job.next_run_time), self._job_state(job), job.id))
+
+    def remove_job(self, job_id):
+        super().remove_job(job_id)
+        self._persist(f'DELETE FROM {self.tablename} WHERE id = ?', (job_id,))
+
+    def remove_all_jobs(self):
+        super().remove_all_jobs()
+        self._persist(f'DELETE FROM {self.tablename}')
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """等待已提交的写入完成（关闭时和检查脚本中调用），返回是否全部完成"""
+        with self._pending_lock:
+            pending = list(self._pending)
+        return not wait(pending, timeout=timeout).not_done
+
+    def shutdown(self):
+        self.flush()
+        # 只清空内存，不删除表中的任务
+        MemoryJobStore.remove_all_jobs(self)
+
+    def _job_state(self, job) -> bytes:
+        return pickle.dumps(job.__getstate__(), self.pickle_protocol)
+
+    def _persist(self, sql: str, params=()):
+        """提交到写队列，不等待；写入失败时记录日志（内存中的任务不受影响）"""
+        def work(conn):
+            conn.execute(sql, params)
+            conn.commit()
+
+        future = db_pool.get_pool(self.db_path).write_queue.submit(work)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._persisted)
+
+    def _persisted(self, future: Future):
+        with self._pending_lock:
+            self._pending.discard(future)
+        error = future.exception()
+        if error is not None:
+            logger.error(f"保存调度任务失败: {error!r}")
+
+    def _reconstitute_job(self, job_state):
+        job_state = pickle.loads(job_state)
+        job_state['jobstore'] = self
+        job = Job.__new__(Job)
+        job.__setstate__(job_state)
+        job._scheduler = self._scheduler
+        job._jobstore_alias = self._alias
+        return job
+
+    def __repr__(self):
+        return f'<{self.__class__.__name__} (db_path={self.db_path})>'
@@ -0,0 +1,248 @@
+"""启动时处理重启期间积压的更新（代替 drop_pending_updates）
+
+启动时逐批（每批最多 BACKLOG_FETCH_LIMIT 条）取出积压更新并分类：
+- 修改数据的操作（+金额、/end 等命令、订单操作按钮、新成员入群、/import 文件）照常处理
+- 同一批中同一个群的多次群名变更只处理最后一次
+- 菜单按钮回调（同一条消息上只有最后一次点击可能有效）和等待输入的文本（状态在重启后已丢失）丢弃
+- 其他命令超过 BACKLOG_COMMAND_MAX_AGE 秒视为过期丢弃
+保留的更新交给 ChatSerializedUpdateProcessor：同一群按顺序、不同群并发，处理完再开始接收新消息。
+一批处理完成后才用下一次 getUpdates 的 offset 向 Telegram 确认，处理中途退出时未处理的批次会重新投递。
+单条更新处理出错时记录日志并计入汇总的失败数，这一批仍会确认
+（重新投递会让同一批中已成功的操作再执行一次）。
+"""
+import os
+import time
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from telegram import Update
+from telegram.ext import Application
+
+logger = logging.getLogger(__name__)
+
+# 启动时如何处理积压的更新：catchup（分类后处理）或 drop（全部丢弃，旧行为）
+UPDATE_BACKLOG_MODE = os.getenv('UPDATE_BACKLOG_MODE', 'catchup').strip().lower()
+# 查询类命令（/report 等）积压超过该秒数不再回复
+BACKLOG_COMMAND_MAX_AGE = float(os.getenv('BACKLOG_COMMAND_MAX_AGE', '120'))
+# 每次 getUpdates 取出的数量（Telegram 上限 100）
+BACKLOG_FETCH_LIMIT = 100
+
+# 修改订单/资金/员工数据的命令
+MUTATING_COMMANDS = frozenset({
+    'create', 'normal', 'overdue', 'end', 'breach', 'breach_end',
+    'adjust', 'create_attribution', 'add_employee', 'remove_employee', 'import',
+})
+# 修改订单状态的按钮（order_action_create 只提示用法）
+MUTATING_CALLBACKS = frozenset({
+    'order_action_normal', 'order_action_overdue', 'order_action_end',
+    'order_action_breach', 'order_action_breach_end',
+})
+
+# 分类结果
+KIND_MUTATION = 'mutation'
+KIND_TITLE = 'title'
+KIND_CALLBACK = 'callback'
+KIND_COMMAND = 'command'
+KIND_PROMPT = 'prompt'
+KIND_OTHER = 'other'
+
+# 丢弃原因（用于汇总）
+DROP_REASONS = {
+    'title_superseded': '群名已再次变更',
+    'callback_superseded': '同一消息上有更新的点击',
+    'callback_ui': '菜单按钮',
+    'prompt': '等待输入的文本（状态已丢失）',
+    'command_stale': '过期的查询命令',
+}
+
+
+def _command_name(text: str) -> Optional[str]:
+    """'/end@bot 参数' -> 'end'"""
+    if not text or not text.startswith('/'):
+        return None
+    parts = text[1:].split(maxsplit=1)
+    return parts[0].split('@', 1)[0].lower() if parts else None
+
+
+def classify_update(update: Update) -> str:
+    """判断积压更新的类别"""
+    if update.callback_query:
+        return KIND_CALLBACK
+    message = update.message
+    if not message:
+        return KIND_OTHER
+    if message.new_chat_title:
+        return KIND_TITLE
+    if message.new_chat_members:
+        return KIND_MUTATION
+    if message.document and _command_name(message.caption or '') == 'import':
+        return KIND_MUTATION
+    text = message.text
+    if not text:
+        return KIND_OTHER
+    if text.startswith('+') and message.chat.type != 'private':
+        return KIND_MUTATION
+    command = _command_name(text)
+    if command:
+        return KIND_MUTATION if command in MUTATING_COMMANDS else KIND_COMMAND
+    return KIND_PROMPT
+
+
+def plan_backlog(updates: List[Update], now: Optional[datetime] = None
+                 ) -> Tuple[List[Update], Dict[str, Counter]]:
+    """
+    分类积压更新，返回 (要处理的更新（保持原顺序）, 汇总)
+    汇总: {'processed': Counter(类别), 'dropped': Counter(原因)}
+    """
+    now = now or datetime.now(timezone.utc)
+    kinds = [classify_update(u) for u in updates]
+
+    # 每个群最后一次群名变更、每条消息最后一次按钮点击
+    latest_title: Dict[int, int] = {}
+    latest_callback: Dict[Tuple, int] = {}
+    for update, kind in zip(updates, kinds):
+        if kind == KIND_TITLE:
+            latest_title[update.message.chat_id] = update.update_id
+        elif kind == KIND_CALLBACK:
+            latest_callback[_callback_key(update)] = update.update_id
+
+    keep = []
+    processed, dropped = Counter(), Counter()
+    for update, kind in zip(updates, kinds):
+        reason = None
+        if kind == KIND_TITLE and latest_title[update.message.chat_id] != update.update_id:
+            reason = 'title_superseded'
+        elif kind == KIND_CALLBACK:
+            if latest_callback[_callback_key(update)] != update.update_id:
+                reason = 'callback_superseded'
+            elif update.callback_query.data not in MUTATING_CALLBACKS:
+                reason = 'callback_ui'
+        elif kind == KIND_PROMPT:
+            reason = 'prompt'
+        elif kind == KIND_COMMAND:
+            age = (now - update.message.date).total_seconds()
+            if age > BACKLOG_COMMAND_MAX_AGE:
+                reason = 'command_stale'
+
+        if reason:
+            dropped[reason] += 1
+        else:
+            keep.append(update)
+            processed[kind] += 1
+    return keep, {'processed': processed, 'dropped': dropped}
+
+
+def _callback_key(update: Update) -> Tuple:
+    """按钮所在的消息（没有消息时按用户区分）"""
+    query = update.callback_query
+    if query.message:
+        return ('message', query.message.chat.id, query.message.message_id)
+    return ('inline', query.inline_message_id or query.from_user.id)
+
+
+async def iter_backlog(bot) -> AsyncIterator[List[Update]]:
+    """
+    逐批取出积压更新：调用方处理完一批后再取下一批
+    取下一批时的 offset 才确认上一批，最后一次（没有更新）的请求确认最后一批
+    """
+    # 设置了 webhook 时不能调用 getUpdates；删除后积压的更新保留，webhook 模式启动时会重新设置
+    await bot.delete_webhook(drop_pending_updates=False)
+    offset = None
+    while True:
+        batch = await bot.get_updates(
+            offset=offset, limit=BACKLOG_FETCH_LIMIT, timeout=0,
+            allowed_updates=Update.ALL_TYPES)
+        if not batch:
+            return
+        yield batch
+        offset = batch[-1].update_id + 1
+
+
+async def process_backlog(application: Application, updates: List[Update]) -> Dict:
+    """按类别处理积压更新，返回汇总"""
+    keep, summary = plan_backlog(updates)
+    start = time.perf_counter()
+    processor = application.update_processor
+    # 与正常接收消息一样经过更新处理器：同一群按顺序，不同群并发
+    results = await asyncio.gather(*(
+        processor.process_update(update, application.process_update(update))
+        for update in keep
+    ), return_exceptions=True)
+    failed = Counter()
+    for update, result in zip(keep, results):
+        if isinstance(result, Exception):
+            failed[classify_update(update)] += 1
+            logger.error(f"处理积压更新 {update.update_id} 失败: {result!r}", exc_info=result)
+    summary['failed'] = failed
+    summary['total'] = len(updates)
+    summary['chat_ids'] = {u.effective_chat.id for u in keep if u.effective_chat}
+    summary['chats'] = len(summary['chat_ids'])
+    summary['seconds'] = time.perf_counter() - start
+    return summary
+
+
+def _merge_summary(total: Dict, summary: Dict):
+    """累加一批的处理汇总"""
+    total['processed'].update(summary['processed'])
+    total['dropped'].update(summary['dropped'])
+    total['failed'].update(summary['failed'])
+    total['total'] += summary['total']
+    total['chat_ids'] |= summary['chat_ids']
+    total['chats'] = len(total['chat_ids'])
+    total['seconds'] += summary['seconds']
+
+
+def format_backlog_summary(summary: Dict) -> str:
+    """积压处理结果（发给管理员）"""
+    processed = sum(summary['processed'].values())
+    dropped = sum(summary['dropped'].values())
+    failed = sum(summary['failed'].values())
+    labels = {
+        KIND_MUTATION: '数据操作', KIND_TITLE: '群名变更', KIND_CALLBACK: '订单按钮',
+        KIND_COMMAND: '查询命令', KIND_OTHER: '其他',
+    }
+    message = (
+        "🔄 重启期间积压的消息已处理\n\n"
+        f"共 {summary['total']} 条，处理 {processed} 条（{summary['chats']} 个群/用户），"
+        f"丢弃 {dropped} 条，耗时 {summary['seconds']:.1f} 秒\n"
+    )
+    if failed:
+        message += f"⚠️ 其中 {failed} 条处理出错（详见日志），不会重新处理\n"
+    if processed:
+        message += "\n已处理:\n"
+        for kind, count in summary['processed'].most_common():
+            message += f"  {labels.get(kind, kind)}: {count}\n"
+    if dropped:
+        message += "\n已丢弃:\n"
+        for reason, count in summary['dropped'].most_common():
+            message += f"  {DROP_REASONS.get(reason, reason)}: {count}\n"
+    return message
+
+
+async def catch_up_backlog(application: Application, admin_ids) -> Optional[Dict]:
+    """启动时逐批处理积压更新并通知管理员，没有积压时返回 None"""
+    summary = None
+    async for batch in iter_backlog(application.bot):
+        if summary is None:
+            logger.info("处理重启期间积压的更新")
+            summary = {'processed': Counter(), 'dropped': Counter(), 'failed': Counter(),
+                       'total': 0, 'chat_ids': set(), 'chats': 0, 'seconds': 0.0}
+        # 处理过程本身出错（而不是单条更新）时不再取下一批，这一批不会被确认
+        _merge_summary(summary, await process_backlog(application, batch))
+    if summary is None:
+        return None
+
+    logger.info(
+        f"积压更新处理完成: 共 {summary['total']}, 处理 {sum(summary['processed'].values())}, "
+        f"失败 {sum(summary['failed'].values())}, "
+        f"丢弃 {dict(summary['dropped'])}, 耗时 {summary['seconds']:.2f} 秒")
+
+    message = format_backlog_summary(summary)
+    for admin_id in admin_ids:
+        try:
+            await application.bot.send_message(chat_id=admin_id, text=message)
+        except Exception as e:
+            logger.warning(f"发送积压处理汇总给管理员 {admin_id} 失败: {e}")
+    return summary
@@ -0,0 +1,129 @@
+"""按群串行、跨群并发的更新处理器
+
+- 同一个群（chat_id）的更新严格按到达顺序逐个处理，避免 +金额、/end 等读-改-写操作互相覆盖
+- 同一个用户（user_id）的更新也按顺序处理，保证 handle_text_input 的状态机不乱序
+- 不同群、不同用户的更新并发处理，一个群里慢的 send_message 不会拖慢其他群
+- 同时执行的处理器数量和已接收未完成的更新数量都有上限
+"""
+import os
+import asyncio
+import inspect
+import logging
+from typing import Dict, List, Tuple
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# 更新处理配置（可通过环境变量调整）
+# 同时执行的处理器数量
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '16'))
+# 已接收但尚未处理完的更新数量上限（含按群排队等待的更新），超过后新更新等待
+UPDATE_MAX_IN_FLIGHT = int(os.getenv('UPDATE_MAX_IN_FLIGHT', '256'))
+# 单个群/用户排队的更新数超过该值时记录警告
+UPDATE_QUEUE_WARN_DEPTH = int(os.getenv('UPDATE_QUEUE_WARN_DEPTH', '20'))
+
+
+class _KeyQueue:
+    """一个群或用户的更新队列（锁 + 排队数量）"""
+
+    __slots__ = ('lock', 'depth')
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0
+
+
+class ChatSerializedUpdateProcessor(BaseUpdateProcessor):
+    """按 chat_id / user_id 串行、不同群之间并发的更新处理器
+
+    基类的信号量限制已接收未完成的更新数（max_in_flight），
+    本类的信号量限制真正在执行的处理器数（concurrency）。
+    排队等待同群前一条更新的任务不占用执行名额，其他群不会被阻塞。
+    """
+
+    def __init__(self, concurrency: int = UPDATE_CONCURRENCY,
+                 max_in_flight: int = UPDATE_MAX_IN_FLIGHT,
+                 warn_depth: int = UPDATE_QUEUE_WARN_DEPTH):
+        concurrency = max(1, concurrency)
+        # 基类要求大于1才会并发调度更新
+        super().__init__(max(2, concurrency, max_in_flight))
+        self.concurrency = concurrency
+        self.warn_depth = warn_depth
+        self._running = None
+        self._queues: Dict[Tuple[str, int], _KeyQueue] = {}
+        self.active = 0
+        self.processed = 0
+        self.max_depth_seen = 0
+
+    @staticmethod
+    def update_keys(update: object) -> List[Tuple[str, int]]:
+        """更新需要串行的键（按固定顺序排序，避免同时获取两把锁时死锁）"""
+        if not isinstance(update, Update):
+            return []
+        keys = []
+        if update.effective_chat:
+            keys.append(('chat', update.effective_chat.id))
+        if update.effective_user:
+            keys.append(('user', update.effective_user.id))
+        return sorted(keys)
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        keys = self.update_keys(update)
+        queues = []
+        for key in keys:
+            queue = self._queues.get(key)
+            if queue is None:
+                queue = self._queues[key] = _KeyQueue()
+            queue.depth += 1
+            if queue.depth > self.max_depth_seen:
+                self.max_depth_seen = queue.depth
+            if queue.depth == self.warn_depth:
+                logger.warning(f"{key[0]} {key[1]} 排队的更新已达 {queue.depth} 条")
+            queues.append((key, queue))
+
+        acquired = []
+        try:
+            for _, queue in queues:
+                await queue.lock.acquire()
+                acquired.append(queue)
+            async with self._running:
+                self.active += 1
+                try:
+                    await coroutine
+                finally:
+                    self.active -= 1
+                    self.processed += 1
+        finally:
+            for queue in acquired:
+                queue.lock.release()
+            for key, queue in queues:
+                queue.depth -= 1
+                if queue.depth == 0 and self._queues.get(key) is queue:
+                    del self._queues[key]
+            # 排队时被取消、从未执行的协程需要关闭，避免 "never awaited" 警告
+            if inspect.iscoroutine(coroutine) and \
+                    inspect.getcoroutinestate(coroutine) == inspect.CORO_CREATED:
+                coroutine.close()
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        pass
+
+    def stats(self, top: int = 10) -> Dict:
+        """当前处理状态和排队最多的群/用户"""
+        depths = sorted(
+            ((key, queue.depth) for key, queue in self._queues.items()),
+            key=lambda item: -item[1])
+        return {
+            'active': self.active,
+            'concurrency': self.concurrency,
+            'in_flight': self.current_concurrent_updates,
+            'max_in_flight': self.max_concurrent_updates,
+            'processed': self.processed,
+            'queued_keys': len(self._queues),
+            'max_depth': self.max_depth_seen,
+            'top_queues': depths[:top],
+        }